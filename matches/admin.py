@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import MatchType, Match, MatchParticipation, GameState, SoloRun, ProgressiveRun, PrivateLobby, PrivateLobbyMember
+from django.utils import timezone
+from .models import MatchType, Match, MatchReplay, StoredReplay, MatchParticipation, SettlementJob, GameState, SoloRun, ProgressiveRun, PrivateLobby, PrivateLobbyMember
 
 @admin.register(MatchType)
 class MatchTypeAdmin(admin.ModelAdmin):
@@ -18,6 +19,18 @@ class MatchAdmin(admin.ModelAdmin):
     list_display = ("id", "matchType", "status", "gridSize", "currentPlayers", "totalPot", "createdAt")
     list_filter = ("status", "isSoloMode")
 
+@admin.register(MatchReplay)
+class MatchReplayAdmin(admin.ModelAdmin):
+    list_display = ("match", "storedReplay", "createdAt")
+    raw_id_fields = ("match", "storedReplay")
+    exclude = ("replayData",)
+
+@admin.register(StoredReplay)
+class StoredReplayAdmin(admin.ModelAdmin):
+    list_display = ("key", "backend", "codec", "size", "rawSize", "frameCount", "version", "createdAt")
+    list_filter = ("backend", "codec", "version")
+    search_fields = ("key",)
+
 @admin.register(MatchParticipation)
 class MatchParticipationAdmin(admin.ModelAdmin):
     list_display = ("match", "get_player", "get_username", "entryFeePaid", "placement", "isBot")
@@ -31,6 +44,20 @@ class MatchParticipationAdmin(admin.ModelAdmin):
         return obj.username if obj.isBot else (obj.player.username if obj.player else "—")
     get_username.short_description = "Username"
 
+@admin.register(SettlementJob)
+class SettlementJobAdmin(admin.ModelAdmin):
+    list_display = ("match", "status", "attempts", "runAfter", "createdAt", "updatedAt", "lastError")
+    list_filter = ("status",)
+    search_fields = ("match__id",)
+    raw_id_fields = ("match",)
+    readonly_fields = ("createdAt", "updatedAt")
+    actions = ("retry",)
+    
+    @admin.action(description="Retry now")
+    def retry(self, request, queryset):
+        count = queryset.exclude(status='DONE').update(status='PENDING', attempts=0, runAfter=timezone.now())
+        self.message_user(request, f"{count} settlements queued again; the next worker poll runs them")
+
 @admin.register(GameState)
 class GameStateAdmin(admin.ModelAdmin):
     list_display = ("match", "tickNumber", "timestamp", "activePlayers")
@@ -38,11 +65,13 @@ class GameStateAdmin(admin.ModelAdmin):
 @admin.register(SoloRun)
 class SoloRunAdmin(admin.ModelAdmin):
     list_display = ("player", "wallsSurvived", "netCoins", "startedAt", "endedAt")
+    raw_id_fields = ("storedReplay",)
 
 @admin.register(ProgressiveRun)
 class ProgressiveRunAdmin(admin.ModelAdmin):
     list_display = ("player", "level", "won", "botsEliminated", "coinsEarned", "startedAt")
     list_filter = ("won", "level")
+    raw_id_fields = ("storedReplay",)
 
 @admin.register(PrivateLobby)
 class PrivateLobbyAdmin(admin.ModelAdmin):
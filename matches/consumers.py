@@ -1,24 +1,87 @@
 import json
 import asyncio
+import logging
 import random
+import secrets
+import time
+from array import array
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from channels.layers import get_channel_layer
 from django.utils import timezone
-from django.db.models import F
+from django.conf import settings
 from decimal import Decimal
-from .models import Match, MatchParticipation
-from shop.models import Transaction
+from .models import Match, MatchParticipation, MatchReplay
+from .replaystore import SegmentedReplay
+from .scheduler import SCHEDULER
+from .gamelog import MatchLog
+from .metrics import TickMetrics
+from .replay import ReplayRecorder, InputLog
+from .snapshot import claimSnapshot, restoreEngine, discardSnapshot, WORKER_ID
+from .ownership import OWNERSHIP
+from .settlement import enqueueSettlement, SETTLEMENTS
+from .protocol import DeltaEncoder, BinaryPacker, BINARY_SUBPROTOCOL, JSON_SUBPROTOCOL
 
-# Active games {matchId: GameEngine instance}
-ACTIVE_GAMES = {}
+# Active games {matchId: GameEngine instance}, owned by this worker's tick scheduler
+ACTIVE_GAMES = SCHEDULER.engines
 # Active countdowns {matchId: asyncio.Task}
 ACTIVE_COUNTDOWNS = {}
 
+# Close code telling clients this worker is draining and they should reconnect
+DRAIN_CLOSE_CODE = 4001
+# Close code for sockets that may not join the match (not logged in, not a participant); clients don't retry
+REFUSED_CLOSE_CODE = 4003
+# A consumer whose match has had no owner for this long reconnects, so its connect can take the match over
+ORPHAN_SECONDS = 1.0
+
+# Occupancy grid cell values
+CELL_EMPTY = 0
+CELL_WALL = 1
+CELL_COUNTDOWN = 2
+
+
+def frameGroupName(roomGroupName, binary):
+    """Group of a match's sockets that take tick frames in one encoding (the match group carries the rest)"""
+    return f'{roomGroupName}.{"bin" if binary else "json"}'
+
+
+def createGameEngine(matchId, gridSize, speed, wallSpawnInterval, seed=None):
+    """Build the engine for a match (NumPy-backed when GAME_ENGINE_MODE is 'array')"""
+    engine = None
+    if getattr(settings, 'GAME_ENGINE_MODE', 'dict') == 'array':
+        try:
+            from .kernel import ArrayGameEngine
+            engine = ArrayGameEngine(matchId, gridSize, speed, wallSpawnInterval, seed)
+        except ImportError as e:
+            MatchLog(matchId).warning('engineFallback', 'Array engine unavailable, using dict engine: %s', e)
+    if engine is None:
+        engine = GameEngine(matchId, gridSize, speed, wallSpawnInterval, seed)
+    
+    # Stream the replay to the replay store during the match instead of holding every frame
+    segmentFrames = getattr(settings, 'GAME_REPLAY_SEGMENT_FRAMES', 0)
+    if segmentFrames and engine.inputLog is None:
+        engine.replay.streamTo(SegmentedReplay(attach=lambda storedReplay: attachMatchReplay(matchId, storedReplay)), segmentFrames)
+    return engine
+
+
+def attachMatchReplay(matchId, storedReplay):
+    """Point a match and its participations at its replay once the first segment is stored (writer thread)"""
+    replay, _ = MatchReplay.objects.update_or_create(
+        match_id=matchId,
+        defaults={'storedReplay': storedReplay, 'replayData': None}
+    )
+    MatchParticipation.objects.filter(match_id=matchId).update(replay=replay)
+
+
 class GameEngine:
-    def __init__(self, matchId, gridSize, speed, wallSpawnInterval):
+    def __init__(self, matchId, gridSize, speed, wallSpawnInterval, seed=None, replayFormat=None, botSettings=None):
         self.matchId = matchId
         self.gridSize = gridSize
+        self.log = MatchLog(matchId)
+        # Every random choice (spawns, bot AI, walls) comes from this engine's own generator,
+        # so a match is reproducible from its seed and inputs
+        self.seed = seed if seed is not None else secrets.randbits(32)
+        self.rng = random.Random(self.seed)
         self.speed = speed
         self.wallSpawnInterval = wallSpawnInterval
         # Speed to tick rate mapping (ms)
@@ -29,24 +92,62 @@ class GameEngine:
         self.countdownWalls = []
         self.tickNumber = 0
         self.running = False
-        self.task = None
-        self.wallSpawnTask = None
+        self.roomGroupName = None
+        self.handleGameOverCallback = None
+        # Real tick timing measured by the scheduler on the monotonic clock
+        self.tickTiming = {
+            'ticks': 0,
+            'firstAt': None,
+            'lastAt': None,
+            'jitterAvgMs': 0.0,
+            'jitterMaxMs': 0.0,
+            'caughtUp': 0,
+            'skipped': 0,
+        }
+        # Per-phase tick timing histograms and payload sizes (metrics endpoint, engine debug page)
+        self.metrics = TickMetrics()
         self.availableColors = [
             '#5b7bff', '#10b981', '#f59e0b', '#ec4899', '#8b5cf6',
             '#06b6d4', '#ef4444', '#84cc16', '#f97316', '#14b8a6',
         ]
-        self.replayFrames = []  # ADD THIS
-        # Cache bot settings once to avoid database queries every tick (async/sync context issues)
+        self.replay = ReplayRecorder(getattr(settings, 'GAME_REPLAY_KEYFRAME_INTERVAL', 100), self.seed)
+        # GAME_REPLAY_FORMAT 'inputs': log the seed, roster and inputs instead of recording frames
+        self.inputLog = None
+        if (replayFormat or getattr(settings, 'GAME_REPLAY_FORMAT', 'inputs')) == 'inputs':
+            self.inputLog = InputLog()
+        # How much of the input log (or unstreamed replay frames) earlier snapshots have already stored
+        self.snapshotLog = {'chunks': 0, 'events': 0, 'frames': 0}
+        # gameState protocol: 'delta' = periodic keyframes + per-tick deltas, 'full' = getState() every tick
+        self.stateEncoder = None
+        if getattr(settings, 'GAME_STATE_PROTOCOL', 'delta') == 'delta':
+            self.stateEncoder = DeltaEncoder(getattr(settings, 'GAME_STATE_KEYFRAME_INTERVAL', 50))
+        # Binary frames for sockets that negotiated BINARY_SUBPROTOCOL (keyframe/delta messages only)
+        self.statePacker = None
+        self.binaryFrames = getattr(settings, 'GAME_STATE_BINARY', True)
+        if self.stateEncoder and self.binaryFrames:
+            self.statePacker = BinaryPacker()
+        # Occupancy grid (one byte per cell, row-major) kept in sync with walls/countdownWalls,
+        # plus a per-cell count of alive player heads, so every "is (x, y) blocked?" check is O(1).
+        # Head counts are 16-bit: a big bot arena can pile far more than 255 heads onto one cell
+        self.occupancy = bytearray(gridSize * gridSize)
+        self.headCounts = array('H', bytes(2 * gridSize * gridSize))
+        # Cache bot settings once to avoid database queries every tick (async/sync context issues);
+        # replays and the headless harness pass (difficulty, reactionSpeed, randomness) instead
+        if botSettings is None:
+            botSettings = self.loadBotSettings()
+        self.botDifficulty, self.botReactionSpeed, self.botRandomness = botSettings
+    
+    def loadBotSettings(self):
         from shop.models import SystemSettings
         try:
-            self.botDifficulty = SystemSettings.getInt('botDifficulty', 5)
-            self.botReactionSpeed = SystemSettings.getInt('botReactionSpeed', 5)
-            self.botRandomness = SystemSettings.getInt('botRandomness', 5)
+            return (
+                SystemSettings.getInt('botDifficulty', 5),
+                SystemSettings.getInt('botReactionSpeed', 5),
+                SystemSettings.getInt('botRandomness', 5),
+            )
         except Exception as e:
-            print(f"[Match {matchId}] Failed to load bot settings, using defaults: {e}")
-            self.botDifficulty = 5
-            self.botReactionSpeed = 5
-            self.botRandomness = 5
+            self.log.warning('botSettings', 'Failed to load bot settings, using defaults: %s', e)
+            return (5, 5, 5)
     
     def addPlayer(self, userId, username, playerColor, isBot=False):
         if userId in self.players:
@@ -59,8 +160,8 @@ class GameEngine:
         spawn_valid = False
         attempts = 0
         while not spawn_valid and attempts < 50:
-            x = random.randint(1, self.gridSize - 2)
-            y = random.randint(1, self.gridSize - 2)
+            x = self.rng.randint(1, self.gridSize - 2)
+            y = self.rng.randint(1, self.gridSize - 2)
             
             # Check distance from existing players
             valid = True
@@ -76,27 +177,55 @@ class GameEngine:
         
         # Fallback if no valid spawn found (shouldn't happen on 20x20 grid with 2 players)
         if not spawn_valid:
-            x = random.randint(1, self.gridSize - 2)
-            y = random.randint(1, self.gridSize - 2)
+            x = self.rng.randint(1, self.gridSize - 2)
+            y = self.rng.randint(1, self.gridSize - 2)
         
         self.players[userId] = {
             'username': username,
             'x': x,
             'y': y,
-            'direction': random.choice(['UP', 'DOWN', 'LEFT', 'RIGHT']),
+            'direction': self.rng.choice(['UP', 'DOWN', 'LEFT', 'RIGHT']),
             'alive': True,
             'playerColor': playerColor,
             'score': 0,
             'hits': 0,
             'isBot': isBot,
             'botDirectionChangeCounter': 0,  # For bot AI
-            'botNextDirectionChangeAt': random.randint(5, 10),  # Bot changes direction every 5-10 ticks
+            'botNextDirectionChangeAt': self.rng.randint(5, 10),  # Bot changes direction every 5-10 ticks
         }
+        self.headCounts[self.cellIndex(x, y)] += 1
+        if self.inputLog is not None:
+            self.inputLog.join(self.tickNumber, userId, username, playerColor, isBot)
     
     def removePlayer(self, userId):
         """Remove a player from the game"""
         if userId in self.players:
+            player = self.players[userId]
+            if player['alive']:
+                self.headCounts[self.cellIndex(player['x'], player['y'])] -= 1
             del self.players[userId]
+            if self.inputLog is not None:
+                self.inputLog.leave(self.tickNumber, userId)
+    
+    def cellIndex(self, x, y):
+        return y * self.gridSize + x
+    
+    def isBlocked(self, x, y):
+        """True if (x, y) is off the board or holds a wall or countdown wall"""
+        if x < 0 or x >= self.gridSize or y < 0 or y >= self.gridSize:
+            return True
+        return self.occupancy[y * self.gridSize + x] != CELL_EMPTY
+    
+    def addWall(self, x, y):
+        """Place a solid wall and mark it in the occupancy grid"""
+        self.walls.append({'x': x, 'y': y})
+        self.occupancy[self.cellIndex(x, y)] = CELL_WALL
+    
+    def markDead(self, player):
+        """Eliminate a player and clear their head from the occupancy grid"""
+        if player['alive']:
+            player['alive'] = False
+            self.headCounts[self.cellIndex(player['x'], player['y'])] -= 1
     
     def updateBotAI(self, userId, player):
         """Update bot player AI - REACTIVE wall avoidance every tick, not just periodic"""
@@ -119,13 +248,8 @@ class GameEngine:
         elif currentDir == 'RIGHT':
             nextX += 1
         
-        # Check if next move would be bad (boundary or wall)
-        isCurrentDirUnsafe = (
-            nextX < 0 or nextX >= self.gridSize or 
-            nextY < 0 or nextY >= self.gridSize or
-            any(w['x'] == nextX and w['y'] == nextY for w in self.walls) or
-            any(w['x'] == nextX and w['y'] == nextY for w in self.countdownWalls)
-        )
+        # Check if next move would be bad (boundary, wall or countdown wall)
+        isCurrentDirUnsafe = self.isBlocked(nextX, nextY)
         
         # Periodically pick a new direction (speed affected by botReactionSpeed: higher = faster reactions)
         # Range: 4-8 at default (5), up to 2-4 at max difficulty (10), down to 6-12 at min (1)
@@ -134,7 +258,7 @@ class GameEngine:
         
         if player['botDirectionChangeCounter'] >= player.get('botNextDirectionChangeAt', directionChangeInterval):
             player['botDirectionChangeCounter'] = 0
-            player['botNextDirectionChangeAt'] = random.randint(max(2, directionChangeInterval - 2), directionChangeInterval + 2)
+            player['botNextDirectionChangeAt'] = self.rng.randint(max(2, directionChangeInterval - 2), directionChangeInterval + 2)
             isCurrentDirUnsafe = True  # Force direction change
         
         # If current direction is unsafe OR timer expired, pick a new safe direction
@@ -158,63 +282,67 @@ class GameEngine:
                 if testX < 1 or testX >= self.gridSize - 1 or testY < 1 or testY >= self.gridSize - 1:
                     continue
                 
-                # Check wall collision
-                if any(w['x'] == testX and w['y'] == testY for w in self.walls):
-                    continue
-                
-                # Check countdown wall collision
-                if any(w['x'] == testX and w['y'] == testY for w in self.countdownWalls):
+                # Check wall and countdown wall collision
+                if self.occupancy[self.cellIndex(testX, testY)] != CELL_EMPTY:
                     continue
                 
                 safeDirections.append(direction)
             
             # Pick a safe direction
             if safeDirections:
-                player['direction'] = random.choice(safeDirections)
+                player['direction'] = self.rng.choice(safeDirections)
             else:
                 # If trapped, pick any direction
-                player['direction'] = random.choice(directions)
+                player['direction'] = self.rng.choice(directions)
         
         # Random movement chance (affected by botRandomness: higher = less random)
         # At difficulty 5 (default): 1% chance. Higher difficulty = lower chance.
         randomChance = max(0.001, 0.05 - (botRandomness * 0.005))
-        if random.random() < randomChance:
-            player['direction'] = random.choice(['UP', 'DOWN', 'LEFT', 'RIGHT'])
+        if self.rng.random() < randomChance:
+            player['direction'] = self.rng.choice(['UP', 'DOWN', 'LEFT', 'RIGHT'])
     
     def updateDirection(self, userId, direction):
         if userId in self.players and self.players[userId]['alive']:
             # Don't allow direction updates for bots during their AI decision
             if not self.players[userId].get('isBot', False):
+                if self.inputLog is not None and self.players[userId]['direction'] != direction:
+                    self.inputLog.direction(self.tickNumber, userId, direction)
                 self.players[userId]['direction'] = direction
     
     def updateCountdownWalls(self):
-        toRemove = []
+        if self.inputLog is not None:
+            self.inputLog.countdown(self.tickNumber)
+        remaining = []
         for wall in self.countdownWalls:
             wall['secondsLeft'] -= 1
             if wall['secondsLeft'] <= 0:
-                self.walls.append({'x': wall['x'], 'y': wall['y']})
-                
-                # All alive players gain +1 point
-                for player in self.players.values():
-                    if player['alive']:
-                        player['score'] += 1
-                
-                toRemove.append(wall)
+                self.addWall(wall['x'], wall['y'])
+                self.awardWallPoint()
+            else:
+                remaining.append(wall)
         
-        for wall in toRemove:
-            self.countdownWalls.remove(wall)
+        self.countdownWalls[:] = remaining
+    
+    def awardWallPoint(self):
+        """All alive players gain +1 point when a wall lands"""
+        for player in self.players.values():
+            if player['alive']:
+                player['score'] += 1
     
     def spawnWall(self):
+        if self.inputLog is not None:
+            self.inputLog.spawn(self.tickNumber)
         attempts = 0
         while attempts < 100:
-            x = random.randint(0, self.gridSize - 1)
-            y = random.randint(0, self.gridSize - 1)
+            x = self.rng.randint(0, self.gridSize - 1)
+            y = self.rng.randint(0, self.gridSize - 1)
             
-            occupied = any(w['x'] == x and w['y'] == y for w in self.walls)
-            occupied = occupied or any(w['x'] == x and w['y'] == y for w in self.countdownWalls)
-            occupied = occupied or any(p['x'] == x and p['y'] == y and p['alive'] for p in self.players.values())
+            # Walls, countdown walls and alive player heads all block a spawn
+            idx = self.cellIndex(x, y)
+            occupied = self.occupancy[idx] != CELL_EMPTY or self.headCounts[idx] > 0
             if not occupied:
                 self.countdownWalls.append({'x': x, 'y': y, 'secondsLeft': 3})
+                self.occupancy[idx] = CELL_COUNTDOWN
                 break
             
             attempts += 1
@@ -222,6 +350,8 @@ class GameEngine:
     def tick(self):
         try:
             self.tickNumber += 1
+            metrics = self.metrics
+            metrics.start()
             
             # STEP 1: Update bot AI
             try:
@@ -232,210 +362,182 @@ class GameEngine:
                     if player['alive'] and player.get('isBot', False):
                         self.updateBotAI(userId, player)
             except Exception as e:
-                print(f"[Match {self.matchId}] Error updating bot AI: {e}")
+                self.log.error('botAI', 'Error updating bot AI: %s', e)
+            metrics.lap('botAI')
             
-            # STEP 2: Calculate new positions for all players
-            newPositions = {}
-            try:
-                for userId in list(self.players.keys()):
-                    if userId not in self.players:
-                        continue
-                    player = self.players[userId]
-                    if not player['alive']:
-                        continue
-                    
-                    x, y = player['x'], player['y']
-                    direction = player.get('direction', 'UP')
-                    
-                    if direction == 'UP':
-                        y -= 1
-                    elif direction == 'DOWN':
-                        y += 1
-                    elif direction == 'LEFT':
-                        x -= 1
-                    elif direction == 'RIGHT':
-                        x += 1
-                    
-                    newPositions[userId] = (x, y)
-            except Exception as e:
-                print(f"[Match {self.matchId}] Error calculating positions: {e}")
+            # STEPS 2-4: Move players and resolve collisions
+            if not self.movePlayers():
                 return
             
-            print(f"[Match {self.matchId}] Tick {self.tickNumber}: Processing {len(newPositions)} players")
-            # STEP 3: Calculate collisions (don't update positions yet)
-            collisions = {}  # userId -> 'none', 'wall', 'headOn', or 'sideKill'
-            sideKillPairs = {}  # userId -> victimId for side kills
-            processedHeadOns = set()
-            
+            # STEP 5: Record frame
             try:
-                for userId in list(newPositions.keys()):
-                    if userId not in self.players or userId not in newPositions:
+                self.recordFrame()
+            except Exception as e:
+                self.log.error('recordFrame', 'Error recording frame: %s', e)
+            metrics.lap('recordFrame')
+        
+        except Exception as e:
+            self.log.error('tick', 'Critical error in tick: %s', e, exc_info=True)
+    
+    def movePlayers(self):
+        """Move alive players one cell and resolve collisions (False if the tick must be abandoned)"""
+        # STEP 2: Calculate new positions for all players
+        newPositions = {}
+        try:
+            for userId in list(self.players.keys()):
+                if userId not in self.players:
+                    continue
+                player = self.players[userId]
+                if not player['alive']:
+                    continue
+                
+                x, y = player['x'], player['y']
+                direction = player.get('direction', 'UP')
+                
+                if direction == 'UP':
+                    y -= 1
+                elif direction == 'DOWN':
+                    y += 1
+                elif direction == 'LEFT':
+                    x -= 1
+                elif direction == 'RIGHT':
+                    x += 1
+                
+                newPositions[userId] = (x, y)
+        except Exception as e:
+            self.log.error('movePlayers', 'Error calculating positions: %s', e)
+            return False
+        self.metrics.lap('movement')
+        
+        self.log.tick(self.tickNumber, 'tick', 'Tick %d: Processing %d players', self.tickNumber, len(newPositions))
+        # STEP 3: Calculate collisions (don't update positions yet)
+        collisions = {}  # userId -> 'none', 'wall', 'headOn', or 'sideKill'
+        sideKillPairs = {}  # userId -> victimId for side kills
+        processedHeadOns = set()
+        
+        try:
+            for userId in list(newPositions.keys()):
+                if userId not in self.players or userId not in newPositions:
+                    continue
+                
+                player = self.players[userId]
+                newX, newY = newPositions[userId]
+                
+                # Check boundaries
+                if newX < 0 or newX >= self.gridSize or newY < 0 or newY >= self.gridSize:
+                    collisions[userId] = 'wall'
+                    self.handleWallHit(userId)
+                    continue
+                
+                # Check wall collision (solid walls only - countdown walls can be crossed)
+                newIdx = self.cellIndex(newX, newY)
+                if self.occupancy[newIdx] == CELL_WALL:
+                    collisions[userId] = 'wall'
+                    self.handleWallHit(userId)
+                    continue
+                
+                # Check head-on collisions (both moving to same spot OR swapping positions)
+                headOnCollision = False
+                for otherId in list(self.players.keys()):
+                    if otherId not in self.players or otherId == userId:
                         continue
-                    
-                    player = self.players[userId]
-                    newX, newY = newPositions[userId]
-                    
-                    # Check boundaries
-                    if newX < 0 or newX >= self.gridSize or newY < 0 or newY >= self.gridSize:
-                        collisions[userId] = 'wall'
-                        self.handleWallHit(userId)
+                    if not self.players[otherId]['alive']:
                         continue
-                    
-                    # Check wall collision
-                    wallHit = False
-                    for wall in self.walls:
-                        if wall['x'] == newX and wall['y'] == newY:
-                            wallHit = True
-                            break
-                    
-                    if wallHit:
-                        collisions[userId] = 'wall'
-                        self.handleWallHit(userId)
+                    if otherId not in newPositions:
                         continue
                     
-                    # Check head-on collisions (both moving to same spot OR swapping positions)
-                    headOnCollision = False
-                    for otherId in list(self.players.keys()):
-                        if otherId not in self.players or otherId == userId:
-                            continue
-                        if not self.players[otherId]['alive']:
-                            continue
-                        if otherId not in newPositions:
-                            continue
-                        
-                        otherX, otherY = newPositions[otherId]
-                        otherOriginalX, otherOriginalY = self.players[otherId]['x'], self.players[otherId]['y']
-                        
-                        # Check if both moving to same spot
-                        sameSpot = (newX == otherX and newY == otherY)
-                        
-                        # Check if swapping positions (moving into each other's original positions)
-                        swapping = (newX == otherOriginalX and newY == otherOriginalY and 
-                                   otherX == player['x'] and otherY == player['y'])
-                        
-                        if sameSpot or swapping:
-                            # Convert to strings for consistent sorting (userIds can be int or string 'bot_X')
-                            collisionKey = tuple(sorted([str(userId), str(otherId)]))
-                            if collisionKey not in processedHeadOns:
-                                # Head-on collision: BOTH get +1 hit (like hitting a wall)
-                                collisionType = "SWAP" if swapping else "SAME_SPOT"
-                                print(f"[Match {self.matchId}] HEAD-ON ({collisionType}): {userId} and {otherId}")
-                                self.handleWallHit(userId)
-                                self.handleWallHit(otherId)
-                                processedHeadOns.add(collisionKey)
-                            collisions[userId] = 'headOn'
-                            headOnCollision = True
-                            break
+                    otherX, otherY = newPositions[otherId]
+                    otherOriginalX, otherOriginalY = self.players[otherId]['x'], self.players[otherId]['y']
                     
-                    if headOnCollision:
-                        continue
+                    # Check if both moving to same spot
+                    sameSpot = (newX == otherX and newY == otherY)
                     
-                    # Check side/back collisions (moving into ORIGINAL position of other player)
-                    sideCollision = False
-                    for otherId in list(self.players.keys()):
-                        if otherId not in self.players or otherId == userId:
-                            continue
-                        if not self.players[otherId]['alive']:
-                            continue
-                        
-                        # Always check against ORIGINAL position (before any moves in this tick)
-                        otherX, otherY = self.players[otherId]['x'], self.players[otherId]['y']
-                        
-                        if newX == otherX and newY == otherY:
-                            print(f"[Match {self.matchId}] SIDE KILL: {userId} moving to ({newX},{newY}) kills {otherId}")
-                            self.handlePlayerCollision(attackerId=userId, victimId=otherId)
-                            collisions[userId] = 'sideKill'
-                            sideKillPairs[userId] = otherId
-                            sideCollision = True
-                            break
+                    # Check if swapping positions (moving into each other's original positions)
+                    swapping = (newX == otherOriginalX and newY == otherOriginalY and 
+                               otherX == player['x'] and otherY == player['y'])
                     
-                    if not sideCollision:
-                        collisions[userId] = 'none'
-            except Exception as e:
-                print(f"[Match {self.matchId}] Error calculating collisions: {e}")
-                import traceback
-                traceback.print_exc()
-                return
-            
-            # STEP 4: Apply position updates based on collision results
-            try:
-                for userId in list(newPositions.keys()):
-                    if userId not in self.players:
+                    if sameSpot or swapping:
+                        # Convert to strings for consistent sorting (userIds can be int or string 'bot_X')
+                        collisionKey = tuple(sorted([str(userId), str(otherId)]))
+                        if collisionKey not in processedHeadOns:
+                            # Head-on collision: BOTH get +1 hit (like hitting a wall)
+                            collisionType = "SWAP" if swapping else "SAME_SPOT"
+                            self.log.event('headOn', 'HEAD-ON (%s): %s and %s', collisionType, userId, otherId)
+                            self.handleWallHit(userId)
+                            self.handleWallHit(otherId)
+                            processedHeadOns.add(collisionKey)
+                        collisions[userId] = 'headOn'
+                        headOnCollision = True
+                        break
+                
+                if headOnCollision:
+                    continue
+                
+                # Check side/back collisions (moving into ORIGINAL position of other player)
+                # Only scan for the victim when the occupancy grid says an alive head is there
+                sideCollision = False
+                if self.headCounts[newIdx] == 0:
+                    collisions[userId] = 'none'
+                    continue
+                for otherId in list(self.players.keys()):
+                    if otherId not in self.players or otherId == userId:
                         continue
-                    
-                    collision = collisions.get(userId, 'none')
-                    if collision in ['wall', 'headOn']:
-                        # Don't move
+                    if not self.players[otherId]['alive']:
                         continue
-                    else:
-                        # 'none' or 'sideKill' - move to new position
-                        newX, newY = newPositions[userId]
-                        if userId in self.players:
-                            self.players[userId]['x'] = newX
-                            self.players[userId]['y'] = newY
-            except Exception as e:
-                print(f"[Match {self.matchId}] Error applying positions: {e}")
-                import traceback
-                traceback.print_exc()
-                return
-            
-            # STEP 4: Record frame
-            try:
-                self.recordFrame()
-            except Exception as e:
-                print(f"[Match {self.matchId}] Error recording frame: {e}")
+                    
+                    # Always check against ORIGINAL position (before any moves in this tick)
+                    otherX, otherY = self.players[otherId]['x'], self.players[otherId]['y']
+                    
+                    if newX == otherX and newY == otherY:
+                        self.log.event('sideKill', 'SIDE KILL: %s moving to (%d,%d) kills %s', userId, newX, newY, otherId)
+                        self.handlePlayerCollision(attackerId=userId, victimId=otherId)
+                        collisions[userId] = 'sideKill'
+                        sideKillPairs[userId] = otherId
+                        sideCollision = True
+                        break
+                
+                if not sideCollision:
+                    collisions[userId] = 'none'
+        except Exception as e:
+            self.log.error('movePlayers', 'Error calculating collisions: %s', e, exc_info=True)
+            return False
+        self.metrics.lap('collision')
         
+        # STEP 4: Apply position updates based on collision results
+        try:
+            for userId in list(newPositions.keys()):
+                if userId not in self.players:
+                    continue
+                
+                collision = collisions.get(userId, 'none')
+                if collision in ['wall', 'headOn']:
+                    # Don't move
+                    continue
+                else:
+                    # 'none' or 'sideKill' - move to new position
+                    newX, newY = newPositions[userId]
+                    if userId in self.players:
+                        player = self.players[userId]
+                        if player['alive']:
+                            self.headCounts[self.cellIndex(player['x'], player['y'])] -= 1
+                            self.headCounts[self.cellIndex(newX, newY)] += 1
+                        player['x'] = newX
+                        player['y'] = newY
         except Exception as e:
-            print(f"[Match {self.matchId}] Critical error in tick: {e}")
-            import traceback
-            traceback.print_exc()
+            self.log.error('movePlayers', 'Error applying positions: %s', e, exc_info=True)
+            return False
+        self.metrics.lap('apply')
+        
+        return True
     
     def recordFrame(self):
-        """Record current game state for replay"""
+        """Record current game state for replay (v2: keyframes + deltas)"""
+        if self.inputLog is not None:
+            return
         try:
-            frame = {
-                'gridSize': self.gridSize,
-                'players': {},
-                'walls': [],
-                'countdownWalls': [],
-            }
-            
-            # Safely copy walls
-            try:
-                for w in self.walls:
-                    frame['walls'].append({'x': w['x'], 'y': w['y']})
-            except Exception as e:
-                print(f"[Match {self.matchId}] Error recording walls: {e}")
-            
-            # Safely copy countdown walls
-            try:
-                for w in self.countdownWalls:
-                    frame['countdownWalls'].append({'x': w['x'], 'y': w['y'], 'secondsLeft': w['secondsLeft']})
-            except Exception as e:
-                print(f"[Match {self.matchId}] Error recording countdown walls: {e}")
-            
-            # Safely copy player data
-            for userId in list(self.players.keys()):
-                try:
-                    if userId not in self.players:
-                        continue
-                    player = self.players[userId]
-                    frame['players'][str(userId)] = {
-                        'x': player.get('x', 0),
-                        'y': player.get('y', 0),
-                        'direction': player.get('direction', 'UP'),
-                        'alive': player.get('alive', False),
-                        'score': player.get('score', 0),
-                        'hits': player.get('hits', 0),
-                        'username': player.get('username', 'Unknown'),
-                        'playerColor': player.get('playerColor', '#ffffff')
-                    }
-                except Exception as e:
-                    print(f"[Match {self.matchId}] Error recording player {userId}: {e}")
-            
-            self.replayFrames.append(frame)
+            self.replay.record(self)
         except Exception as e:
-            print(f"[Match {self.matchId}] Critical error in recordFrame: {e}")
+            self.log.error('recordFrame', 'Critical error in recordFrame: %s', e)
     
     def handleWallHit(self, userId):
         """Handle player hitting a wall or boundary"""
@@ -451,7 +553,7 @@ class GameEngine:
         
         # Eliminate after 50 hits
         if player['hits'] >= 50:
-            player['alive'] = False
+            self.markDead(player)
     
     def handlePlayerCollision(self, attackerId, victimId):
         """Attacker eliminates victim and gains their score"""
@@ -471,7 +573,7 @@ class GameEngine:
         
         # Victim loses all their score on elimination
         victim['score'] = 0
-        victim['alive'] = False
+        self.markDead(victim)
     
     def getState(self):
         return {
@@ -483,6 +585,31 @@ class GameEngine:
             'aliveCount': sum(1 for p in self.players.values() if p['alive'])
         }
     
+    def recordTickTiming(self, now, jitter):
+        """Track when scheduled ticks actually ran and how far from their due time"""
+        timing = self.tickTiming
+        if timing['firstAt'] is None:
+            timing['firstAt'] = now
+        timing['lastAt'] = now
+        timing['ticks'] += 1
+        jitterMs = jitter * 1000
+        timing['jitterAvgMs'] += (jitterMs - timing['jitterAvgMs']) * 0.1
+        timing['jitterMaxMs'] = max(timing['jitterMaxMs'], jitterMs)
+    
+    def measuredFrameDuration(self):
+        """Average real ms per recorded frame (nominal tick rate until enough ticks ran)"""
+        timing = self.tickTiming
+        frames = timing['ticks'] + timing['caughtUp']
+        if frames < 2:
+            return int(self.tickRate * 1000)
+        return round((timing['lastAt'] - timing['firstAt']) * 1000 / (frames - 1))
+    
+    def buildStateMessage(self):
+        """Broadcast payload for this tick in the configured protocol"""
+        if self.stateEncoder:
+            return self.stateEncoder.encode(self)
+        return self.getState()
+    
     def checkGameOver(self):
         alive = [uid for uid, p in self.players.items() if p['alive']]
         # Game only ends when:
@@ -495,75 +622,60 @@ class GameEngine:
                 return alive[0] if alive else None
         return None
     
-    async def start(self, roomGroupName, handleGameOverCallback):
+    async def start(self, roomGroupName, handleGameOverCallback, jobs=None):
+        """Hand the engine to this worker's shared tick scheduler (jobs: a resumed snapshot's job delays)"""
         self.running = True
-        channel_layer = get_channel_layer()
-        
-        async def gameLoop():
-            last_log_tick = 0
-            while self.running:
-                try:
-                    self.tick()
-                    
-                    # Log every 100 ticks to detect hangs
-                    if self.tickNumber % 100 == 0 and self.tickNumber != last_log_tick:
-                        last_log_tick = self.tickNumber
-                        print(f"[Match {self.matchId}] Tick {self.tickNumber}, Players: {sum(1 for p in self.players.values() if p['alive'])} alive")
-                    
-                    state = self.getState()
-                    
-                    # Broadcast state
-                    try:
-                        await channel_layer.group_send(
-                            roomGroupName,
-                            {
-                                'type': 'gameState',
-                                'state': state
-                            }
-                        )
-                    except Exception as e:
-                        print(f"[Match {self.matchId}] Failed to broadcast state: {e}")
-                    
-                    winnerId = self.checkGameOver()
-                    if winnerId is not None:
-                        await self.endGame(winnerId, roomGroupName, handleGameOverCallback)
-                        break
-                    
-                    # Also check if game is over due to tie (everyone dead)
-                    aliveCount = sum(1 for p in self.players.values() if p['alive'])
-                    if aliveCount == 0:
-                        await self.endGame(None, roomGroupName, handleGameOverCallback)
-                        break
-                    
-                    await asyncio.sleep(self.tickRate)
-                except Exception as e:
-                    print(f"[GameEngine {self.matchId}] Error in gameLoop: {e}")
-                    self.running = False
-                    break
-        
-        async def countdownLoop():
-            while self.running:
-                try:
-                    await asyncio.sleep(1)
-                    self.updateCountdownWalls()
-                except Exception as e:
-                    print(f"[GameEngine {self.matchId}] Error in countdownLoop: {e}")
-        
-        async def spawnLoop():
-            # FIX: Only spawn walls if wallSpawnInterval > 0
-            if self.wallSpawnInterval <= 0:
+        self.roomGroupName = roomGroupName
+        self.handleGameOverCallback = handleGameOverCallback
+        SCHEDULER.start(self, jobs)
+    
+    async def runFrame(self, channel_layer):
+        """One game loop iteration (called by the scheduler): tick, broadcast, check game over"""
+        try:
+            self.tick()
+            
+            # Sampled progress line (every GAME_LOG_TICK_SAMPLE ticks) to detect hangs
+            self.log.tick(self.tickNumber, 'progress', 'Tick %d, Players: %d alive', self.tickNumber,
+                          sum(1 for p in self.players.values() if p['alive']), level=logging.INFO)
+            
+            # Serialize the frame once here; every consumer in a frame group sends the same text/bytes
+            metrics = self.metrics
+            metrics.start()
+            message = self.buildStateMessage()
+            text = json.dumps(message)
+            packed = self.statePacker.pack(message) if self.statePacker else None
+            metrics.lap('serialize')
+            metrics.payload(len(text), len(packed or b''))
+            
+            # Broadcast state: each socket's group gets one encoding, so a frame crosses the channel
+            # layer once per socket. Binary sockets take the text when there is no binary frame
+            # (GAME_STATE_PROTOCOL 'full', or the packer gave up).
+            try:
+                await channel_layer.group_send(frameGroupName(self.roomGroupName, False), {'type': 'gameState', 'text': text})
+                if self.binaryFrames:
+                    binaryFrame = {'type': 'gameState', 'bytes': packed} if packed is not None else {'type': 'gameState', 'text': text}
+                    await channel_layer.group_send(frameGroupName(self.roomGroupName, True), binaryFrame)
+            except Exception as e:
+                self.log.error('broadcast', 'Failed to broadcast state: %s', e)
+            metrics.lap('broadcast')
+            
+            if not self.running:
                 return
             
-            while self.running:
-                try:
-                    await asyncio.sleep(self.wallSpawnInterval)
-                    self.spawnWall()
-                except Exception as e:
-                    print(f"[GameEngine {self.matchId}] Error in spawnLoop: {e}")
-        
-        self.task = asyncio.create_task(gameLoop())
-        self.wallSpawnTask = asyncio.create_task(spawnLoop())
-        asyncio.create_task(countdownLoop())
+            winnerId = self.checkGameOver()
+            if winnerId is not None:
+                self.running = False
+                asyncio.create_task(self.endGame(winnerId, self.roomGroupName, self.handleGameOverCallback))
+                return
+            
+            # Also check if game is over due to tie (everyone dead)
+            aliveCount = sum(1 for p in self.players.values() if p['alive'])
+            if aliveCount == 0:
+                self.running = False
+                asyncio.create_task(self.endGame(None, self.roomGroupName, self.handleGameOverCallback))
+        except Exception as e:
+            self.log.error('gameLoop', 'Error in gameLoop: %s', e, exc_info=True)
+            self.running = False
     
     async def endGame(self, winnerId, roomGroupName, handleGameOverCallback):
         self.running = False
@@ -580,44 +692,220 @@ class GameEngine:
                 'finalScores': {str(uid): p['score'] for uid, p in self.players.items()},
                 'finalHits': {str(uid): p['hits'] for uid, p in self.players.items()}
             }
-            # Build replay data
-            replayData = {
-                'frames': self.replayFrames,
-                'frameDuration': int(self.tickRate * 1000),  # Convert to ms
-                'mode': 'multiplayer'
-            }
-            print(f"[Match {self.matchId}] 🎬 endGame: Built replayData with {len(self.replayFrames)} frames")
-            # Pass replay data to callback
-            gameOverState['replayData'] = replayData
-            # Handle rewards
-            await handleGameOverCallback(gameOverState)
-            # Broadcast game over
+            # Broadcast game over first: players never wait on the replay or the settlement
             await channel_layer.group_send(
                 roomGroupName,
                 {
                     'type': 'gameState',
-                    'state': gameOverState
+                    'state': dict(gameOverState)
                 }
             )
+            # A finished match must never be resumed from a snapshot
+            discardSnapshot(self.matchId)
+            # Finish the replay (frameDuration = real ms per frame)
+            frameDuration = self.measuredFrameDuration()
+            if self.inputLog is not None:
+                gameOverState['replayData'] = self.inputLog.build(self, frameDuration)
+                self.log.info('endGame', 'endGame: Built input-log replay with %d events over %d ticks',
+                              len(self.inputLog.events), self.tickNumber)
+            elif self.replay.segments is not None:
+                # Write the last segment; the match's MatchReplay already points at it
+                await asyncio.wrap_future(self.replay.flush(frameDuration, final=True))
+                self.log.info('endGame', 'endGame: Finished streamed replay with %d frames', self.replay.frameCount)
+            else:
+                # Pass replay data to callback
+                gameOverState['replayData'] = self.replay.build(frameDuration)
+                self.log.info('endGame', 'endGame: Built replayData with %d frames', self.replay.frameCount)
+            # Queue the settlement (the pot is paid out by the settlement worker)
+            await handleGameOverCallback(gameOverState)
         except Exception as e:
-            import traceback
-            print(f"[GameEngine {self.matchId}] Error in endGame: {e}")
-            print(traceback.format_exc())
+            self.log.error('endGame', 'Error in endGame: %s', e, exc_info=True)
+        finally:
+            if ACTIVE_GAMES.get(self.matchId) is self:
+                SCHEDULER.remove(self.matchId)
+                await OWNERSHIP.release(self.matchId)
     
     def stop(self):
+        # The scheduler drops jobs for engines that are no longer running
         self.running = False
-        if self.task:
-            self.task.cancel()
-        if self.wallSpawnTask:
-            self.wallSpawnTask.cancel()
+
+
+def matchGameOverHandler(matchId):
+    """Game over callback for a match's engine: stores the replay and queues the settlement"""
+    log = MatchLog(matchId)
+    
+    async def handleGameOver(state):
+        """Handle game over - queue the payout and match completion"""
+        try:
+            log.info('gameOver', 'handleGameOver called with state: isTie=%s, winnerId=%s', state.get('isTie'), state.get('winnerId'))
+            
+            await database_sync_to_async(enqueueSettlement)(
+                matchId,
+                winnerId=state.get('winnerId'),
+                isTie=state.get('isTie', False),
+                replayData=state.get('replayData')
+            )
+            SETTLEMENTS.wake()
+            
+            log.info('gameOver', 'handleGameOver completed successfully')
+        except Exception as e:
+            log.error('gameOver', 'ERROR in handleGameOver: %s', e, exc_info=True)
+    
+    return handleGameOver
+
+
+async def resumeMatch(matchId):
+    """Take over a handed-off or orphaned match and resume it here from its snapshot; returns the engine, or None if it isn't ours to resume"""
+    if matchId in ACTIVE_GAMES:
+        return ACTIVE_GAMES[matchId]
+    if not await OWNERSHIP.acquire(matchId):
+        return None
+    snapshot = await asyncio.to_thread(claimSnapshot, matchId)
+    if matchId in ACTIVE_GAMES:
+        return ACTIVE_GAMES[matchId]
+    if snapshot is None:
+        await OWNERSHIP.release(matchId)
+        return None
+    engine = restoreEngine(snapshot)
+    await engine.start(snapshot['roomGroupName'], matchGameOverHandler(matchId), snapshot['jobs'])
+    engine.log.info('resume', 'Resumed at tick %d from worker %s (snapshot %.1fs old)',
+                    engine.tickNumber, snapshot['worker'], time.time() - snapshot['savedAt'])
+    return engine
+
+
+async def hostMatch(match):
+    """Create the match's engine on this worker if it can take the ownership lease, else None"""
+    if not await OWNERSHIP.acquire(match.id):
+        return None
+    if match.id in ACTIVE_GAMES:
+        return ACTIVE_GAMES[match.id]
+    
+    engine = createGameEngine(
+        match.id,
+        match.gridSize,
+        match.speed,
+        match.matchType.wallSpawnInterval,
+        match.seed
+    )
+    ACTIVE_GAMES[match.id] = engine
+    if match.seed is None:
+        await saveMatchSeed(match.id, engine.seed)
+    
+    # Load all existing participants including bots
+    participants = await getMatchParticipants(match.id)
+    botColors = [
+        '#ef4444', '#f59e0b', '#06b6d4', '#8b5cf6',
+        '#ec4899', '#84cc16', '#f97316', '#14b8a6'
+    ]
+    botColorIdx = 0
+    for participant in participants:
+        if participant.isBot:
+            botColor = botColors[botColorIdx % len(botColors)]
+            botColorIdx += 1
+            engine.addPlayer(
+                f"bot_{participant.id}",
+                participant.username,
+                botColor,
+                isBot=True
+            )
+    return engine
+
+
+def engineChannel():
+    """Channel the engine workers share: each request on it reaches one of them"""
+    return getattr(settings, 'GAME_ENGINE_CHANNEL', 'game-engines')
+
+
+async def serveEngineRequest(message):
+    """Engine worker side of GAME_ENGINE_CHANNEL: host (or resume) a match nobody owns, then apply the join"""
+    matchId = message['matchId']
+    if matchId not in ACTIVE_GAMES and await OWNERSHIP.forward(matchId, message):
+        return
+    
+    if matchId not in ACTIVE_GAMES:
+        match = await getMatch(matchId)
+        if match is None or match.status not in ('STARTING', 'IN_PROGRESS'):
+            return
+        engine = await (resumeMatch(matchId) if match.status == 'IN_PROGRESS' else hostMatch(match))
+        if engine is None:
+            # Another engine worker won the lease meanwhile
+            await OWNERSHIP.forward(matchId, message)
+            return
+    await handleRelayed(message)
+
+
+@database_sync_to_async
+def getMatch(matchId):
+    return Match.objects.select_related('matchType').filter(id=matchId).first()
+
+
+@database_sync_to_async
+def saveMatchSeed(matchId, seed):
+    """Record the engine's RNG seed so the match can be reproduced"""
+    Match.objects.filter(id=matchId, seed__isnull=True).update(seed=seed)
+
+
+@database_sync_to_async
+def getMatchParticipants(matchId):
+    """Get all match participants including bots, in join order so spawns follow the seed"""
+    return list(MatchParticipation.objects.filter(match_id=matchId).order_by('id'))
+
+
+async def startCountdownOnce(matchId, engine, status=None):
+    """Start the pre-match countdown the first time a player reaches a STARTING match's engine"""
+    if engine.running or matchId in ACTIVE_COUNTDOWNS:
+        return
+    if status is None:
+        status = await database_sync_to_async(
+            lambda: Match.objects.filter(id=matchId).values_list('status', flat=True).first()
+        )()
+    if status == 'STARTING' and not engine.running and matchId not in ACTIVE_COUNTDOWNS:
+        ACTIVE_COUNTDOWNS[matchId] = asyncio.create_task(
+            startMatchCountdown(matchId, f'match_{matchId}', engine)
+        )
+
+
+async def handleRelayed(message, retries=20):
+    """Apply a message forwarded by a consumer on a worker that doesn't own the match"""
+    engine = ACTIVE_GAMES.get(message['matchId'])
+    if engine is None:
+        # A join can beat the engine here when both players connect at once: give its setup a moment
+        if message['type'] == 'engine.join' and retries and message['matchId'] in OWNERSHIP.hosted:
+            await asyncio.sleep(0.05)
+            asyncio.create_task(handleRelayed(message, retries - 1))
+        return
+    
+    if message['type'] == 'engine.input':
+        engine.updateDirection(message['userId'], message['direction'])
+    elif message['type'] == 'engine.join':
+        engine.addPlayer(message['userId'], message['username'], message['playerColor'])
+        await startCountdownOnce(message['matchId'], engine)
+    elif message['type'] == 'engine.resync' and engine.stateEncoder:
+        keyframe = engine.stateEncoder.keyframe()
+        packed = engine.statePacker.pack(keyframe) if message.get('binary') and engine.statePacker else None
+        frame = {'type': 'gameState', 'bytes': packed} if packed is not None else {'type': 'gameState', 'text': json.dumps(keyframe)}
+        await get_channel_layer().send(message['replyTo'], frame)
+
+
+async def ownershipLost(matchId):
+    """Another worker holds this match's lease now: stop the engine here so the match never runs twice"""
+    countdown = ACTIVE_COUNTDOWNS.pop(matchId, None)
+    if countdown is not None:
+        countdown.cancel()
+    engine = ACTIVE_GAMES.get(matchId)
+    if engine is not None:
+        engine.log.error('ownership', 'Lost the ownership lease to another worker, stopping the engine here')
+        engine.stop()
+        SCHEDULER.remove(matchId)
 
 
 async def startMatchCountdown(matchId, roomGroupName, engine):
     """Standalone countdown function that doesn't depend on consumer instance"""
     channel_layer = get_channel_layer()
+    log = MatchLog(matchId)
     
     try:
-        print(f"[Match {matchId}] Starting 10-second countdown")
+        log.info('countdown', 'Starting 10-second countdown')
         
         # Broadcast countdown - 10 seconds down to 1
         for i in range(10, 0, -1):
@@ -633,11 +921,11 @@ async def startMatchCountdown(matchId, roomGroupName, engine):
                     }
                 )
             except Exception as e:
-                print(f"[Match {matchId}] Failed to broadcast countdown {i}: {e}")
+                log.error('countdown', 'Failed to broadcast countdown %d: %s', i, e)
             
             await asyncio.sleep(1)
         
-        print(f"[Match {matchId}] Countdown complete (10s elapsed), starting match engine")
+        log.info('countdown', 'Countdown complete (10s elapsed), starting match engine')
         
         # Update match status to IN_PROGRESS
         from django.contrib.auth import get_user_model
@@ -649,218 +937,21 @@ async def startMatchCountdown(matchId, roomGroupName, engine):
                 match.status = 'IN_PROGRESS'
                 match.startedAt = timezone.now()
                 match.save()
-                print(f"[Match {matchId}] Match status updated to IN_PROGRESS")
+                log.info('matchStatus', 'Match status updated to IN_PROGRESS')
             except Exception as e:
-                print(f"[Match {matchId}] Failed to update match status: {e}")
+                log.error('matchStatus', 'Failed to update match status: %s', e)
                 raise
         
-        async def handleGameOver(state):
-            """Handle game over - process rewards and complete match"""
-            try:
-                print(f"[Match {matchId}] handleGameOver called with state: isTie={state.get('isTie')}, winnerId={state.get('winnerId')}")
-                
-                # Process in sync context
-                await database_sync_to_async(lambda: handleGameOverSync(state))()
-                
-                print(f"[Match {matchId}] handleGameOver completed successfully")
-            except Exception as e:
-                print(f"[Match {matchId}] ERROR in handleGameOver: {e}")
-                import traceback
-                traceback.print_exc()
-        
-        def handleGameOverSync(state):
-            """Synchronous game over handler - runs in thread pool"""
-            from django.db import transaction as dbTransaction
-            
-            try:
-                match = Match.objects.select_related('matchType').get(id=matchId)
-                
-                isTie = state.get('isTie', False)
-                winnerId = state.get('winnerId')
-                replayData = state.get('replayData')
-                
-                print(f"[Match {matchId}] Processing game over: isTie={isTie}, winnerId={winnerId}")
-                
-                with dbTransaction.atomic():
-                    if isTie:
-                        splitPotSync(match, replayData)
-                    elif winnerId:
-                        awardPotSync(match, winnerId, replayData)
-                    
-                    completeMatchSync(match, winnerId)
-                    
-                print(f"[Match {matchId}] Game over processing completed")
-            except Exception as e:
-                print(f"[Match {matchId}] ERROR in handleGameOverSync: {e}")
-                import traceback
-                traceback.print_exc()
-                raise
-        
-        def splitPotSync(match, replayData=None):
-            from django.db import transaction as dbTransaction
-            import json
-            
-            print(f"[Match {match.id}] splitPotSync: has replayData={replayData is not None}")
-            if replayData:
-                frames_count = len(replayData.get('frames', []))
-                print(f"[Match {match.id}] replayData frames count: {frames_count}, mode: {replayData.get('mode')}")
-            
-            with dbTransaction.atomic():
-                match = Match.objects.select_for_update().get(id=match.id)
-                participants = list(match.participants.select_related('player__profile').all())
-                
-                if not participants:
-                    return
-                
-                share = match.totalPot / len(participants)
-                
-                for participation in participants:
-                    # Skip bot participants (player is None)
-                    if not participation.player:
-                        participation.coinReward = 0
-                        participation.placement = 1  # All tied for first place
-                        if replayData:
-                            participation.replayData = replayData
-                            participation.save(update_fields=['placement', 'replayData'])
-                        else:
-                            participation.save(update_fields=['placement'])
-                        continue
-                    
-                    profile = participation.player.profile
-                    profile = type(profile).objects.select_for_update().get(pk=profile.pk)
-                    
-                    balanceBefore = profile.coins
-                    profile.coins = F('coins') + share
-                    profile.save(update_fields=['coins'])
-                    profile.refresh_from_db()
-                    
-                    participation.coinReward = share
-                    participation.placement = 1
-                    if replayData:
-                        participation.replayData = replayData
-                        participation.save(update_fields=['coinReward', 'placement', 'replayData'])
-                        player_name = participation.player.username if participation.player else f"User({participation.player_id})"
-                        print(f"[Match {match.id}] 💾 Saved replay data for {player_name}")
-                    else:
-                        participation.save(update_fields=['coinReward', 'placement'])
-                        player_name = participation.player.username if participation.player else f"User({participation.player_id})"
-                        print(f"[Match {match.id}] ⚠️  NO REPLAY DATA for {player_name}")
-                    
-                    Transaction.objects.create(
-                        user=participation.player,
-                        amount=share,
-                        transactionType='MATCH_WIN',
-                        relatedMatch=match,
-                        description=f'Tie - Split pot: {match.matchType.name}',
-                        balanceBefore=balanceBefore,
-                        balanceAfter=profile.coins
-                    )
-        
-        def awardPotSync(match, winnerId, replayData=None):
-            from django.db import transaction as dbTransaction
-            from django.contrib.auth import get_user_model
-            import json
-            
-            User = get_user_model()
-            
-            print(f"[Match {match.id}] awardPotSync: winnerId={winnerId}, has replayData={replayData is not None}")
-            if replayData:
-                frames_count = len(replayData.get('frames', []))
-                print(f"[Match {match.id}] replayData frames count: {frames_count}, mode: {replayData.get('mode')}")
-            
-            with dbTransaction.atomic():
-                match = Match.objects.select_for_update().get(id=match.id)
-                # Check if winnerId is a valid integer (not a bot ID string like 'bot_280')
-                winner = None
-                if winnerId and isinstance(winnerId, int):
-                    try:
-                        winner = User.objects.get(id=winnerId)
-                    except (User.DoesNotExist, ValueError):
-                        winner = None
-                
-                # Only update winner stats if winner is a real user (not a bot)
-                if winner:
-                    profile = winner.profile
-                    profile = type(profile).objects.select_for_update().get(pk=profile.pk)
-                    
-                    balanceBefore = profile.coins
-                    profile.coins = F('coins') + match.totalPot
-                    profile.totalWins = F('totalWins') + 1
-                    profile.save(update_fields=['coins', 'totalWins'])
-                    profile.refresh_from_db()
-                
-                # Save replay data for ALL participants (including losers)
-                # Note: replayData is a dict, save it directly to JSONField
-                print(f"[Match {match.id}] DEBUG: Total participations: {match.participants.count()}")
-                for participation in match.participants.select_related('player'):
-                    print(f"[Match {match.id}] DEBUG: Participation player_id={participation.player_id}, player={participation.player}, isBot={participation.isBot}, username={participation.username}")
-                    if participation.player_id == winnerId:
-                        # Winner
-                        participation.coinReward = match.totalPot
-                        participation.placement = 1
-                    else:
-                        # Losers
-                        participation.coinReward = 0
-                        participation.placement = 2
-                    
-                    # Save replay data for this participant
-                    if replayData:
-                        participation.replayData = replayData
-                        participation.save(update_fields=['coinReward', 'placement', 'replayData'])
-                        player_name = participation.player.username if participation.player else f"Bot({participation.username})" if participation.isBot else f"User({participation.player_id})"
-                        print(f"[Match {match.id}] 💾 Saved replay data for {player_name}")
-                    else:
-                        participation.save(update_fields=['coinReward', 'placement'])
-                        player_name = participation.player.username if participation.player else f"Bot({participation.username})" if participation.isBot else f"User({participation.player_id})"
-                        print(f"[Match {match.id}] ⚠️  NO REPLAY DATA for {player_name}")
-                
-                # Only create transaction if winner is a real user (not a bot)
-                if winner:
-                    Transaction.objects.create(
-                        user=winner,
-                        amount=match.totalPot,
-                        transactionType='MATCH_WIN',
-                        relatedMatch=match,
-                        description=f'Won match: {match.matchType.name}',
-                        balanceBefore=balanceBefore,
-                        balanceAfter=profile.coins
-                    )
-        
-        def completeMatchSync(match, winnerId):
-            from django.contrib.auth import get_user_model
-            
-            User = get_user_model()
-            
-            match.status = 'COMPLETED'
-            match.completedAt = timezone.now()
-            # Only set winner if winnerId is a valid integer (not a bot ID string like 'bot_280')
-            if winnerId and isinstance(winnerId, int):
-                try:
-                    match.winner = User.objects.get(id=winnerId)
-                except (User.DoesNotExist, ValueError):
-                    match.winner = None
-            match.save(update_fields=['status', 'completedAt', 'winner'])
-            
-            for participation in match.participants.select_related('player__profile').all():
-                # Skip bot participants (player is None)
-                if not participation.player:
-                    continue
-                profile = participation.player.profile
-                profile.totalMatches = F('totalMatches') + 1
-                profile.save(update_fields=['totalMatches'])
-        
         await setMatchInProgress()
-        print(f"[Match {matchId}] Match status updated to IN_PROGRESS, starting engine in background")
+        log.info('matchStatus', 'Match status updated to IN_PROGRESS, starting engine in background')
         
         # Start engine as background task - don't await it directly
         # This allows the countdown function to complete while the game runs
-        asyncio.create_task(engine.start(roomGroupName, handleGameOver))
-        print(f"[Match {matchId}] Engine started as background task")
+        asyncio.create_task(engine.start(roomGroupName, matchGameOverHandler(matchId)))
+        log.info('engineStart', 'Engine started as background task')
         
     except Exception as e:
-        print(f"[Match {matchId}] ERROR in countdown: {e}")
-        import traceback
-        traceback.print_exc()
+        log.error('countdown', 'ERROR in countdown: %s', e, exc_info=True)
     finally:
         if matchId in ACTIVE_COUNTDOWNS:
             del ACTIVE_COUNTDOWNS[matchId]
@@ -870,86 +961,93 @@ class GameConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.matchId = self.scope['url_route']['kwargs']['matchId']
         self.roomGroupName = f'match_{self.matchId}'
+        self.log = MatchLog(self.matchId, prefix='GameConsumer')
         self.user = self.scope['user']
+        # Clients offer the binary frame format first and JSON as a fallback
+        subprotocols = self.scope.get('subprotocols', [])
+        self.binaryFrames = BINARY_SUBPROTOCOL in subprotocols and getattr(settings, 'GAME_STATE_BINARY', True)
         
         if not self.user.is_authenticated:
-            await self.close()
+            # Accepted first so the client sees the close code rather than a failed handshake
+            await self.accept()
+            await self.close(code=REFUSED_CLOSE_CODE)
+            return
+        
+        if SCHEDULER.draining:
+            # This worker is handing its matches over; the client retries and reaches another one
+            await self.close(code=DRAIN_CLOSE_CODE)
             return
         
         await self.channel_layer.group_add(
             self.roomGroupName,
             self.channel_name
         )
+        await self.channel_layer.group_add(
+            frameGroupName(self.roomGroupName, self.binaryFrames),
+            self.channel_name
+        )
         
-        await self.accept()
+        if self.binaryFrames:
+            await self.accept(subprotocol=BINARY_SUBPROTOCOL)
+        elif JSON_SUBPROTOCOL in subprotocols:
+            await self.accept(subprotocol=JSON_SUBPROTOCOL)
+        else:
+            await self.accept()
         
         participation = await self.getParticipation()
         if not participation:
-            await self.close()
+            await self.close(code=REFUSED_CLOSE_CODE)
             return
         
         playerColor = await self.getPlayerColor()
         
-        if self.matchId not in ACTIVE_GAMES:
-            match = await self.getMatch()
-            engine = GameEngine(
-                self.matchId,
-                match.gridSize,
-                match.speed,
-                match.matchType.wallSpawnInterval
+        engine = ACTIVE_GAMES.get(self.matchId)
+        match = await self.getMatch()
+        # With engine workers on, engines live in `manage.py runengines` processes, never in this one
+        engineWorkers = getattr(settings, 'GAME_ENGINE_WORKERS', False)
+        if engine is None and not engineWorkers:
+            if match.status == 'IN_PROGRESS':
+                # Handed off by a draining worker or orphaned by one that died: resume it here from its
+                # snapshot. Otherwise it runs elsewhere and its frames reach this socket through the group.
+                engine = await resumeMatch(self.matchId)
+            else:
+                engine = await hostMatch(match)
+        
+        if engine is not None:
+            engine.addPlayer(
+                self.user.id,
+                self.user.username,
+                playerColor
             )
-            ACTIVE_GAMES[self.matchId] = engine
-            
-            # Load all existing participants including bots
-            participants = await self.getMatchParticipants()
-            botColors = [
-                '#ef4444', '#f59e0b', '#06b6d4', '#8b5cf6',
-                '#ec4899', '#84cc16', '#f97316', '#14b8a6'
-            ]
-            botColorIdx = 0
-            for participant in participants:
-                if participant.isBot:
-                    botColor = botColors[botColorIdx % len(botColors)]
-                    botColorIdx += 1
-                    engine.addPlayer(
-                        f"bot_{participant.id}",
-                        participant.username,
-                        botColor,
-                        isBot=True
-                    )
-        
-        engine = ACTIVE_GAMES[self.matchId]
-        
-        engine.addPlayer(
-            self.user.id,
-            self.user.username,
-            playerColor
-        )
+        else:
+            # Another worker owns the match, or an engine worker is to host it: its engine adds the player
+            join = {
+                'type': 'engine.join',
+                'userId': self.user.id,
+                'username': self.user.username,
+                'playerColor': playerColor,
+            }
+            if not await OWNERSHIP.forward(self.matchId, join) and engineWorkers:
+                await self.channel_layer.send(engineChannel(), {**join, 'matchId': self.matchId})
         
         await self.send(text_data=json.dumps({
             'type': 'playerColor',
             'playerColor': playerColor
         }))
         
-        match = await self.getMatch()
-        
         # If match is STARTING and countdown hasn't started yet, start it ONCE
-        if match.status == 'STARTING' and not engine.running:
-            if self.matchId not in ACTIVE_COUNTDOWNS:
-                ACTIVE_COUNTDOWNS[self.matchId] = asyncio.create_task(
-                    startMatchCountdown(self.matchId, self.roomGroupName, engine)
-                )
-        
-        # If already IN_PROGRESS but engine not running (shouldn't happen but just in case)
-        elif match.status == 'IN_PROGRESS' and not engine.running:
-            # This shouldn't happen in normal flow, but handle it
-            pass
+        if engine is not None:
+            await startCountdownOnce(self.matchId, engine, match.status)
     
     async def disconnect(self, closeCode):
         await self.channel_layer.group_discard(
             self.roomGroupName,
             self.channel_name
         )
+        await self.channel_layer.group_discard(
+            frameGroupName(self.roomGroupName, self.binaryFrames),
+            self.channel_name
+        )
     
     async def receive(self, text_data):
         data = json.loads(text_data)
@@ -961,18 +1059,56 @@ class GameConsumer(AsyncWebsocketConsumer):
                 engine = ACTIVE_GAMES.get(self.matchId)
                 if engine:
                     engine.updateDirection(self.user.id, direction)
+                else:
+                    await self.forwardToOwner({'type': 'engine.input', 'userId': self.user.id, 'direction': direction})
+        
+        elif action == 'resync':
+            # Client missed a delta - send it a keyframe of the last broadcast state
+            engine = ACTIVE_GAMES.get(self.matchId)
+            if engine and engine.stateEncoder:
+                keyframe = engine.stateEncoder.keyframe()
+                packed = engine.statePacker.pack(keyframe) if self.binaryFrames and engine.statePacker else None
+                if packed is not None:
+                    await self.send(bytes_data=packed)
+                else:
+                    await self.send(text_data=json.dumps(keyframe))
+            elif not engine:
+                # The owner replies straight to this socket's channel, as a gameState frame
+                await self.forwardToOwner({'type': 'engine.resync', 'replyTo': self.channel_name, 'binary': self.binaryFrames})
+    
+    async def forwardToOwner(self, message):
+        """Relay to the worker that owns the match; after ORPHAN_SECONDS without an owner, reconnect to take it over"""
+        if await OWNERSHIP.forward(self.matchId, message):
+            self.orphanedAt = None
+            return
+        if getattr(self, 'orphanedAt', None) is None:
+            self.orphanedAt = time.monotonic()
+        elif time.monotonic() - self.orphanedAt > ORPHAN_SECONDS:
+            self.log.warning('ownership', 'Match has no owner, reconnecting to resume it')
+            await self.close(code=DRAIN_CLOSE_CODE)
+    
+    async def engineMoved(self, event):
+        """The match's engine left a draining worker: sockets on that worker reconnect elsewhere"""
+        if event['worker'] == WORKER_ID:
+            await self.close(code=DRAIN_CLOSE_CODE)
     
     async def gameState(self, event):
         try:
+            # Tick frames arrive already encoded by the engine, in this socket's encoding
+            if 'bytes' in event:
+                await self.send(bytes_data=event['bytes'])
+                return
+            if 'text' in event:
+                await self.send(text_data=event['text'])
+                return
+            
             state = event['state']
-            print(f"[GameConsumer {self.matchId}] Sending gameState to client: {state.get('type')}")
+            self.log.debug('send', 'Sending gameState to client: %s', state.get('type'))
             if state.get('type') == 'gameOver':
-                print(f"[GameConsumer {self.matchId}] 🏁 Sending GAME OVER to client: winnerId={state.get('winnerId')}, isTie={state.get('isTie')}")
+                self.log.info('gameOver', 'Sending GAME OVER to client: winnerId=%s, isTie=%s', state.get('winnerId'), state.get('isTie'))
             await self.send(text_data=json.dumps(state))
         except Exception as e:
-            import traceback
-            print(f"[GameConsumer {self.matchId}] Error in gameState: {e}")
-            print(traceback.format_exc())
+            self.log.error('send', 'Error in gameState: %s', e, exc_info=True)
     
     @database_sync_to_async
     def getPlayerColor(self):
@@ -1000,8 +1136,3 @@ class GameConsumer(AsyncWebsocketConsumer):
     @database_sync_to_async
     def getMatch(self):
         return Match.objects.select_related('matchType').get(id=self.matchId)
-    
-    @database_sync_to_async
-    def getMatchParticipants(self):
-        """Get all match participants including bots"""
-        return list(MatchParticipation.objects.filter(match_id=self.matchId))
\ No newline at end of file
@@ -0,0 +1,63 @@
+import contextlib
+import logging
+from django.conf import settings
+
+logger = logging.getLogger('matches.game')
+
+
+class MatchLog:
+    """Level-gated logging for one match, with sampled per-tick events and event counters.
+
+    Messages use logging's lazy %-style arguments and are checked with isEnabledFor
+    first, so a disabled level costs one comparison and no string formatting. Every
+    record carries matchId and event in `extra` for structured handlers. Counters are
+    kept whether or not the event is logged and are reported by the engine-stats view.
+    """
+
+    def __init__(self, matchId, prefix='Match'):
+        self.matchId = matchId
+        self.prefix = f'[{prefix} {matchId}] '
+        self.tickSample = max(1, getattr(settings, 'GAME_LOG_TICK_SAMPLE', 100))
+        self.counters = {}
+
+    def count(self, event, amount=1):
+        self.counters[event] = self.counters.get(event, 0) + amount
+
+    def log(self, level, event, msg, *args, exc_info=False):
+        if logger.isEnabledFor(level):
+            logger.log(level, self.prefix + msg, *args, exc_info=exc_info,
+                       extra={'matchId': self.matchId, 'event': event})
+
+    def debug(self, event, msg, *args):
+        self.log(logging.DEBUG, event, msg, *args)
+
+    def info(self, event, msg, *args):
+        self.log(logging.INFO, event, msg, *args)
+
+    def warning(self, event, msg, *args):
+        self.log(logging.WARNING, event, msg, *args)
+
+    def error(self, event, msg, *args, exc_info=False):
+        self.count('errors')
+        self.log(logging.ERROR, event, msg, *args, exc_info=exc_info)
+
+    def tick(self, tickNumber, event, msg, *args, level=logging.DEBUG):
+        """Per-tick event, logged only every GAME_LOG_TICK_SAMPLE ticks"""
+        if tickNumber % self.tickSample == 0:
+            self.log(level, event, msg, *args)
+
+    def event(self, event, msg, *args):
+        """Counted game event (collisions etc.), logged at DEBUG"""
+        self.count(event)
+        self.log(logging.DEBUG, event, msg, *args)
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silence game logging for the duration (benchmarks and batch commands)"""
+    disabled = logger.disabled
+    logger.disabled = True
+    try:
+        yield
+    finally:
+        logger.disabled = disabled
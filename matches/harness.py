@@ -0,0 +1,163 @@
+import json
+import random
+import time
+import tracemalloc
+from django.test import override_settings
+from .consumers import GameEngine
+from .gamelog import quiet
+
+DIRECTIONS = ['UP', 'DOWN', 'LEFT', 'RIGHT']
+# (difficulty, reactionSpeed, randomness), the SystemSettings defaults
+DEFAULT_BOT_SETTINGS = (5, 5, 5)
+
+
+class EngineHarness:
+    """Drives a GameEngine synchronously, with no channel layer, database or scheduler.
+
+    settings are Django setting overrides applied while the engine is built (GAME_STATE_*,
+    GAME_REPLAY_*, ...) and botSettings replaces the SystemSettings query. Each step()
+    applies scripted inputs, runs one frame the way the scheduler does (tick, then the
+    gameState message serialized for the group) and fires the countdown and wall spawn
+    jobs on their wall-clock cadence, derived from the tick count.
+    """
+
+    def __init__(self, gridSize=30, speed='MEDIUM', wallSpawnInterval=5, seed=42, engineClass=GameEngine,
+                 settings=None, botSettings=DEFAULT_BOT_SETTINGS, serialize=True, matchId='harness'):
+        with override_settings(**(settings or {})):
+            self.engine = engineClass(matchId, gridSize, speed, wallSpawnInterval, seed=seed, botSettings=botSettings)
+        self.rng = random.Random(seed)
+        self.serialize = serialize
+        self.script = {}
+        self.inputRate = 0
+        self.keepAlive = False
+        self.humans = []
+
+    def addBots(self, count):
+        for i in range(count):
+            self.engine.addPlayer(f'bot_{i}', f'Bot {i}', '#ef4444', isBot=True)
+
+    def addHumans(self, count, inputRate=0.0):
+        """Players steered by the script, plus a random turn with probability inputRate per player per tick"""
+        for i in range(count):
+            userId = len(self.humans) + 1
+            self.engine.addPlayer(userId, f'Player {userId}', '#5b7bff')
+            self.humans.append(userId)
+        self.inputRate = inputRate
+
+    def addWalls(self, density):
+        """Cover this fraction of the free cells with walls"""
+        engine = self.engine
+        freeCells = [
+            (x, y) for y in range(engine.gridSize) for x in range(engine.gridSize)
+            if not engine.occupancy[engine.cellIndex(x, y)] and not engine.headCounts[engine.cellIndex(x, y)]
+        ]
+        for x, y in self.rng.sample(freeCells, int(len(freeCells) * density)):
+            engine.addWall(x, y)
+
+    def direct(self, tick, userId, direction):
+        """Script a changeDirection applied just before the given tick"""
+        self.script.setdefault(tick, []).append((userId, direction))
+
+    def reviveAll(self):
+        """Reset hits and revive everyone so each tick does the same work (benchmarks)"""
+        engine = self.engine
+        for userId, player in engine.players.items():
+            player['hits'] = 0
+            if not player['alive']:
+                player['alive'] = True
+                engine.headCounts[engine.cellIndex(player['x'], player['y'])] += 1
+        if hasattr(engine, 'rebuildArrays'):
+            engine.rebuildArrays()
+
+    def step(self):
+        """One frame; returns False once the game is over"""
+        engine = self.engine
+        tick = engine.tickNumber + 1
+        for userId, direction in self.script.pop(tick, ()):
+            engine.updateDirection(userId, direction)
+        if self.inputRate:
+            for userId in self.humans:
+                if self.rng.random() < self.inputRate:
+                    engine.updateDirection(userId, self.rng.choice(DIRECTIONS))
+
+        engine.tick()
+        if self.serialize:
+            message = engine.buildStateMessage()
+            json.dumps(message)
+            if engine.statePacker:
+                engine.statePacker.pack(message)
+
+        seconds, previous = tick * engine.tickRate, (tick - 1) * engine.tickRate
+        if int(seconds) != int(previous):
+            engine.updateCountdownWalls()
+            if engine.wallSpawnInterval and int(seconds) % engine.wallSpawnInterval == 0:
+                engine.spawnWall()
+        return engine.checkGameOver() is None and any(p['alive'] for p in engine.players.values())
+
+    def run(self, ticks):
+        """Step up to ticks frames (fewer if the game ends); returns the frame count"""
+        for frame in range(ticks):
+            if self.keepAlive:
+                self.reviveAll()
+            if not self.step():
+                return frame + 1
+        return ticks
+
+    def measure(self, ticks, warmup=20, allocations=True):
+        """Timed frames, then (optionally) a second pass under tracemalloc; returns TickStats"""
+        with quiet():
+            self.keepAlive = True
+            self.run(warmup)
+            latencies = []
+            for _ in range(ticks):
+                self.reviveAll()
+                started = time.perf_counter()
+                self.step()
+                latencies.append(time.perf_counter() - started)
+
+            allocated = retained = None
+            if allocations:
+                # Separate pass: tracing slows every allocation down and would skew the timings
+                tracemalloc.start()
+                try:
+                    peaks = []
+                    baseline = tracemalloc.get_traced_memory()[0]
+                    for _ in range(ticks):
+                        self.reviveAll()
+                        before = tracemalloc.get_traced_memory()[0]
+                        tracemalloc.reset_peak()
+                        self.step()
+                        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+                    retained = (tracemalloc.get_traced_memory()[0] - baseline) / ticks
+                    allocated = sum(peaks) / ticks
+                finally:
+                    tracemalloc.stop()
+        return TickStats(latencies, allocated, retained)
+
+
+class TickStats:
+    """Frame latencies (seconds) plus per-frame transient and retained allocation (bytes)"""
+
+    def __init__(self, latencies, allocated=None, retained=None):
+        self.latencies = sorted(latencies)
+        self.allocated = allocated
+        self.retained = retained
+
+    def percentile(self, p):
+        if not self.latencies:
+            return 0.0
+        return self.latencies[min(len(self.latencies) - 1, int(p / 100 * len(self.latencies)))]
+
+    @property
+    def ticksPerSecond(self):
+        total = sum(self.latencies)
+        return len(self.latencies) / total if total else 0.0
+
+    def asDict(self):
+        return {
+            'ticksPerSecond': self.ticksPerSecond,
+            'p50Us': self.percentile(50) * 1e6,
+            'p99Us': self.percentile(99) * 1e6,
+            'allocatedBytes': self.allocated,
+            'retainedBytes': self.retained,
+        }
@@ -0,0 +1,233 @@
+import numpy as np
+from .consumers import GameEngine, CELL_WALL
+from .protocol import DIRECTION_CODES
+
+# Per DIRECTION_CODES order: UP, DOWN, LEFT, RIGHT
+DX = np.array([0, 0, -1, 1], dtype=np.int32)
+DY = np.array([-1, 1, 0, 0], dtype=np.int32)
+
+# Collision outcome per mover (same meaning as the strings used by GameEngine.movePlayers)
+OUTCOME_NONE = 0
+OUTCOME_WALL = 1
+OUTCOME_HEAD_ON = 2
+OUTCOME_SIDE_KILL = 3
+
+
+class ArrayGameEngine(GameEngine):
+    """GameEngine with player positions, directions, alive flags, scores and hits in NumPy arrays.
+
+    The arrays are authoritative; self.players dicts are mirrors kept for getState, recordFrame
+    and the bot AI. Movement, boundary/wall checks and collision candidate detection are batched
+    array operations, and only players that actually touch another player this tick are resolved
+    one by one in join order, so results are identical to GameEngine.movePlayers.
+    """
+
+    def __init__(self, matchId, gridSize, speed, wallSpawnInterval, seed=None, replayFormat=None, botSettings=None):
+        super().__init__(matchId, gridSize, speed, wallSpawnInterval, seed, replayFormat, botSettings)
+        self.rebuildArrays()
+
+    def rebuildArrays(self):
+        """Reload the arrays from the player dicts (row order = join order)"""
+        self.playerIds = list(self.players.keys())
+        self.rowOf = {userId: row for row, userId in enumerate(self.playerIds)}
+        players = [self.players[userId] for userId in self.playerIds]
+        self.xs = np.array([p['x'] for p in players], dtype=np.int32)
+        self.ys = np.array([p['y'] for p in players], dtype=np.int32)
+        self.dirs = np.array([DIRECTION_CODES.get(p['direction'], 0) for p in players], dtype=np.int8)
+        self.alive = np.array([p['alive'] for p in players], dtype=bool)
+        self.scores = np.array([p['score'] for p in players], dtype=np.int64)
+        self.hits = np.array([p['hits'] for p in players], dtype=np.int32)
+
+    def syncRows(self, rows):
+        """Copy array state back into the player dicts for the given rows"""
+        rows = np.asarray(rows, dtype=np.intp)
+        for row, x, y, alive, score, hits in zip(
+            rows.tolist(),
+            self.xs[rows].tolist(),
+            self.ys[rows].tolist(),
+            self.alive[rows].tolist(),
+            self.scores[rows].tolist(),
+            self.hits[rows].tolist(),
+        ):
+            player = self.players[self.playerIds[row]]
+            player['x'] = x
+            player['y'] = y
+            player['alive'] = alive
+            player['score'] = score
+            player['hits'] = hits
+
+    def rebuildHeadCounts(self):
+        """Recompute the alive-head occupancy counts from the position arrays (once per tick, after movement)"""
+        cells = self.gridSize * self.gridSize
+        heads = np.bincount((self.ys * self.gridSize + self.xs)[self.alive], minlength=cells)
+        np.frombuffer(self.headCounts, dtype=np.uint16)[:] = heads
+
+    def dropHead(self, row):
+        """Take a row that just died off its cell's head count"""
+        self.headCounts[self.cellIndex(int(self.xs[row]), int(self.ys[row]))] -= 1
+
+    def addPlayer(self, userId, username, playerColor, isBot=False):
+        super().addPlayer(userId, username, playerColor, isBot)
+        self.rebuildArrays()
+
+    def removePlayer(self, userId):
+        super().removePlayer(userId)
+        self.rebuildArrays()
+
+    def updateDirection(self, userId, direction):
+        super().updateDirection(userId, direction)
+        row = self.rowOf.get(userId)
+        if row is not None:
+            self.dirs[row] = DIRECTION_CODES.get(self.players[userId]['direction'], 0)
+
+    def updateBotAI(self, userId, player):
+        super().updateBotAI(userId, player)
+        self.dirs[self.rowOf[userId]] = DIRECTION_CODES.get(player['direction'], 0)
+
+    def awardWallPoint(self):
+        self.scores[self.alive] += 1
+        self.syncRows(np.flatnonzero(self.alive))
+
+    def handleWallHit(self, userId):
+        row = self.rowOf.get(userId)
+        if row is None:
+            return
+        wasAlive = self.alive[row]
+        self.hitRow(row)
+        self.syncRows([row])
+        if wasAlive and not self.alive[row]:
+            self.dropHead(row)
+
+    def handlePlayerCollision(self, attackerId, victimId):
+        if attackerId not in self.rowOf or victimId not in self.rowOf:
+            return
+        attacker, victim = self.rowOf[attackerId], self.rowOf[victimId]
+        wasAlive = self.alive[victim]
+        self.collideRows(attacker, victim)
+        self.syncRows([attacker, victim])
+        if wasAlive:
+            self.dropHead(victim)
+
+    def hitRow(self, row):
+        """Wall/boundary/head-on hit for one row (eliminated at 50 hits)"""
+        if not self.alive[row]:
+            return
+        self.hits[row] += 1
+        if self.hits[row] >= 50:
+            self.alive[row] = False
+
+    def collideRows(self, attacker, victim):
+        """Attacker eliminates victim and gains their positive score"""
+        if not self.alive[victim]:
+            return
+        self.scores[attacker] += max(0, int(self.scores[victim]))
+        self.scores[victim] = 0
+        self.alive[victim] = False
+
+    def movePlayers(self):
+        try:
+            movers = np.flatnonzero(self.alive)
+            if movers.size == 0:
+                return True
+
+            gridSize = self.gridSize
+            cells = gridSize * gridSize
+
+            # STEP 2: New positions for every alive player
+            dirs = self.dirs[movers]
+            oldX, oldY = self.xs[movers], self.ys[movers]
+            newX, newY = oldX + DX[dirs], oldY + DY[dirs]
+            self.metrics.lap('movement')
+
+            # STEP 3a: Boundary and solid wall checks (countdown walls can be crossed)
+            inBounds = (newX >= 0) & (newX < gridSize) & (newY >= 0) & (newY < gridSize)
+            target = np.where(inBounds, newY * gridSize + newX, 0)
+            occupancy = np.frombuffer(self.occupancy, dtype=np.uint8)
+            blocked = ~inBounds | (occupancy[target] == CELL_WALL)
+            clear = ~blocked
+
+            # STEP 3b: Collision candidates - clear movers sharing a target (same spot), clear movers
+            # stepping onto another player's starting cell (swap / side kill), and those players
+            origin = oldY * gridSize + oldX
+            targetCounts = np.bincount(target[clear], minlength=cells)
+            originCounts = np.bincount(origin, minlength=cells)
+            sameSpot = clear & (targetCounts[target] > 1)
+            intoOrigin = clear & (originCounts[target] > 0)
+            steppedOn = np.zeros(cells, dtype=bool)
+            steppedOn[target[intoOrigin]] = True
+            interacting = sameSpot | intoOrigin | steppedOn[origin]
+
+            outcome = np.where(blocked, OUTCOME_WALL, OUTCOME_NONE).astype(np.int8)
+
+            # STEP 3c: Wall hits for players nobody else interacts with
+            batchHits = movers[blocked & ~interacting]
+            self.hits[batchHits] += 1
+            self.alive[batchHits[self.hits[batchHits] >= 50]] = False
+
+            # STEP 3d: Interacting players one by one, in join order
+            if interacting.any():
+                self.resolveInteractions(movers, np.flatnonzero(interacting), oldX, oldY, newX, newY, blocked, outcome)
+
+            self.metrics.lap('collision')
+
+            # STEP 4: 'none' and 'sideKill' move to their new position
+            moving = (outcome == OUTCOME_NONE) | (outcome == OUTCOME_SIDE_KILL)
+            movedRows = movers[moving]
+            self.xs[movedRows] = newX[moving]
+            self.ys[movedRows] = newY[moving]
+
+            self.rebuildHeadCounts()
+            self.syncRows(movers)
+            self.metrics.lap('apply')
+        except Exception as e:
+            self.log.error('movePlayers', 'Error in array movePlayers: %s', e, exc_info=True)
+            return False
+
+        return True
+
+    def resolveInteractions(self, movers, local, oldX, oldY, newX, newY, blocked, outcome):
+        """Sequential collision rules for the (few) players that touch each other this tick"""
+        rows = movers[local].tolist()
+        fromX, fromY = oldX[local].tolist(), oldY[local].tolist()
+        toX, toY = newX[local].tolist(), newY[local].tolist()
+        isBlocked = blocked[local].tolist()
+        alive = self.alive
+        processedHeadOns = set()
+
+        for i, row in enumerate(rows):
+            if isBlocked[i]:
+                self.hitRow(row)
+                continue
+
+            # Head-on: both moving to same spot OR swapping positions
+            headOn = False
+            for j, other in enumerate(rows):
+                if j == i or not alive[other]:
+                    continue
+                sameSpot = toX[i] == toX[j] and toY[i] == toY[j]
+                swapping = (toX[i] == fromX[j] and toY[i] == fromY[j] and
+                            toX[j] == fromX[i] and toY[j] == fromY[i])
+                if sameSpot or swapping:
+                    collisionKey = (min(i, j), max(i, j))
+                    if collisionKey not in processedHeadOns:
+                        collisionType = "SWAP" if swapping else "SAME_SPOT"
+                        self.log.event('headOn', 'HEAD-ON (%s): %s and %s', collisionType, self.playerIds[row], self.playerIds[other])
+                        self.hitRow(row)
+                        self.hitRow(other)
+                        processedHeadOns.add(collisionKey)
+                    outcome[local[i]] = OUTCOME_HEAD_ON
+                    headOn = True
+                    break
+
+            if headOn:
+                continue
+
+            # Side/back: moving into the ORIGINAL position of another alive player
+            for j, other in enumerate(rows):
+                if j == i or not alive[other]:
+                    continue
+                if toX[i] == fromX[j] and toY[i] == fromY[j]:
+                    self.log.event('sideKill', 'SIDE KILL: %s moving to (%d,%d) kills %s', self.playerIds[row], toX[i], toY[i], self.playerIds[other])
+                    self.collideRows(row, other)
+                    outcome[local[i]] = OUTCOME_SIDE_KILL
+                    break
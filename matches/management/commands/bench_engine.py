@@ -0,0 +1,94 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from matches.consumers import GameEngine
+from matches.gamelog import quiet
+from matches.harness import DEFAULT_BOT_SETTINGS
+
+
+class Command(BaseCommand):
+    help = 'Benchmark GameEngine tick time as the board fills up with walls'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grid-size',
+            type=int,
+            default=30,
+            help='Board size (default: 30)'
+        )
+        parser.add_argument(
+            '--players',
+            type=int,
+            default=8,
+            help='Number of bot players (default: 8)'
+        )
+        parser.add_argument(
+            '--ticks',
+            type=int,
+            default=300,
+            help='Ticks measured per wall density (default: 300)'
+        )
+        parser.add_argument(
+            '--mode',
+            choices=['dict', 'array'],
+            default='dict',
+            help="Engine implementation: 'dict' or NumPy 'array' (default: dict)"
+        )
+        parser.add_argument(
+            '--steps',
+            type=int,
+            default=10,
+            help='Number of wall densities between empty and full board (default: 10)'
+        )
+
+    def handle(self, *args, **options):
+        gridSize = options['grid_size']
+        playerCount = options['players']
+        ticks = options['ticks']
+        steps = options['steps']
+        if options['mode'] == 'array':
+            from matches.kernel import ArrayGameEngine
+            self.engineClass = ArrayGameEngine
+        else:
+            self.engineClass = GameEngine
+        
+        self.stdout.write(f'{self.engineClass.__name__}: grid {gridSize}x{gridSize}, {playerCount} bots, {ticks} ticks per step')
+        # Report the tick with and without replay capture to isolate the collision work
+        self.stdout.write(f'{"walls":>8} {"fill":>6} {"µs/tick":>10} {"+replay":>10}')
+        
+        for step in range(steps + 1):
+            # Leave room for the players themselves on the "full" board
+            fill = step / steps
+            wallCount = int((gridSize * gridSize - playerCount) * fill)
+            perTick = self.measure(gridSize, playerCount, wallCount, ticks, recordReplay=False)
+            withReplay = self.measure(gridSize, playerCount, wallCount, ticks, recordReplay=True)
+            self.stdout.write(f'{wallCount:>8} {fill:>6.0%} {perTick * 1e6:>10.1f} {withReplay * 1e6:>10.1f}')
+
+    def measure(self, gridSize, playerCount, wallCount, ticks, recordReplay):
+        # Engine logs per-tick progress; keep the table readable
+        with quiet():
+            engine = self.engineClass('bench', gridSize, 'EXTREME', 0, seed=42, replayFormat='frames', botSettings=DEFAULT_BOT_SETTINGS)
+            if not recordReplay:
+                engine.recordFrame = lambda: None
+            for i in range(playerCount):
+                engine.addPlayer(f'bot_{i}', f'Bot {i}', '#ef4444', isBot=True)
+            
+            freeCells = [
+                (x, y) for x in range(gridSize) for y in range(gridSize)
+                if not engine.headCounts[engine.cellIndex(x, y)]
+            ]
+            for x, y in random.Random(42).sample(freeCells, min(wallCount, len(freeCells))):
+                engine.addWall(x, y)
+            
+            elapsed = 0.0
+            for _ in range(ticks):
+                # Keep every bot in play so each tick does the same amount of work
+                for userId, player in engine.players.items():
+                    player['hits'] = 0
+                    if hasattr(engine, 'rowOf'):
+                        engine.hits[engine.rowOf[userId]] = 0
+                started = time.perf_counter()
+                engine.tick()
+                elapsed += time.perf_counter() - started
+        
+        return elapsed / ticks
@@ -0,0 +1,80 @@
+import io
+import logging
+import time
+from django.core.management.base import BaseCommand
+from matches.consumers import GameEngine
+from matches.gamelog import logger
+
+
+class Command(BaseCommand):
+    help = 'Benchmark GameEngine tick throughput with game logging off, sampled and at full volume'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grid-size',
+            type=int,
+            default=20,
+            help='Board size (default: 20)'
+        )
+        parser.add_argument(
+            '--players',
+            type=int,
+            default=16,
+            help='Number of bot players (default: 16)'
+        )
+        parser.add_argument(
+            '--ticks',
+            type=int,
+            default=3000,
+            help='Ticks measured per configuration (default: 3000)'
+        )
+
+    def handle(self, *args, **options):
+        # (label, logger level, tick sample); DEBUG with sample 1 is roughly the old print volume
+        configs = [
+            ('off', logging.CRITICAL + 1, 100),
+            ('INFO, sampled', logging.INFO, 100),
+            ('DEBUG, sampled', logging.DEBUG, 100),
+            ('DEBUG, every tick', logging.DEBUG, 1),
+        ]
+
+        savedLevel, savedHandlers, savedPropagate = logger.level, logger.handlers[:], logger.propagate
+        # Log records go to an in-memory stream so the numbers include formatting and handler cost
+        stream = io.StringIO()
+        logger.handlers = [logging.StreamHandler(stream)]
+        logger.propagate = False
+        try:
+            self.stdout.write(f'grid {options["grid_size"]}x{options["grid_size"]}, {options["players"]} bots, {options["ticks"]} ticks')
+            self.stdout.write(f'{"logging":<20} {"ticks/s":>10} {"µs/tick":>10} {"lines":>8}')
+            for label, level, sample in configs:
+                logger.setLevel(level)
+                stream.seek(0)
+                stream.truncate()
+                perTick = self.measure(options['grid_size'], options['players'], options['ticks'], sample)
+                lines = stream.getvalue().count('\n')
+                self.stdout.write(f'{label:<20} {1 / perTick:>10.0f} {perTick * 1e6:>10.1f} {lines:>8}')
+        finally:
+            logger.setLevel(savedLevel)
+            logger.handlers = savedHandlers
+            logger.propagate = savedPropagate
+
+    def measure(self, gridSize, playerCount, ticks, sample):
+        engine = GameEngine('bench', gridSize, 'EXTREME', 0, seed=42)
+        engine.log.tickSample = sample
+        engine.recordFrame = lambda: None
+        for i in range(playerCount):
+            engine.addPlayer(f'bot_{i}', f'Bot {i}', '#ef4444', isBot=True)
+
+        elapsed = 0.0
+        for _ in range(ticks):
+            # Keep every bot in play (collisions included) so each tick does the same work
+            for player in engine.players.values():
+                player['hits'] = 0
+                if not player['alive']:
+                    player['alive'] = True
+                    engine.headCounts[engine.cellIndex(player['x'], player['y'])] += 1
+            started = time.perf_counter()
+            engine.tick()
+            elapsed += time.perf_counter() - started
+
+        return elapsed / ticks
@@ -0,0 +1,114 @@
+import json
+import random
+from django.core.management.base import BaseCommand
+from matches.consumers import GameEngine
+from matches.gamelog import quiet
+from matches.protocol import DeltaEncoder, BinaryPacker
+
+
+class Command(BaseCommand):
+    help = 'Compare gameState bytes per tick for full-state JSON, keyframe/delta JSON and binary frames'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grid-size',
+            type=int,
+            default=30,
+            help='Board size (default: 30)'
+        )
+        parser.add_argument(
+            '--players',
+            type=int,
+            default=8,
+            help='Number of bot players (default: 8)'
+        )
+        parser.add_argument(
+            '--walls',
+            type=int,
+            default=400,
+            help='Walls already on the board when measuring starts (default: 400)'
+        )
+        parser.add_argument(
+            '--ticks',
+            type=int,
+            default=500,
+            help='Ticks measured (default: 500)'
+        )
+        parser.add_argument(
+            '--keyframe-interval',
+            type=int,
+            default=50,
+            help='Messages between keyframes (default: 50)'
+        )
+        parser.add_argument(
+            '--wall-spawn-interval',
+            type=int,
+            default=2,
+            help='Seconds between countdown wall spawns (default: 2)'
+        )
+
+    def handle(self, *args, **options):
+        gridSize = options['grid_size']
+        playerCount = options['players']
+        ticks = options['ticks']
+
+        # Engine logs bot settings failures and per-tick progress; keep the report readable
+        with quiet():
+            engine = GameEngine('bench', gridSize, 'EXTREME', options['wall_spawn_interval'], seed=42)
+            engine.recordFrame = lambda: None
+            for i in range(playerCount):
+                engine.addPlayer(f'bot_{i}', f'Bot {i}', '#ef4444', isBot=True)
+
+            freeCells = [
+                (x, y) for x in range(gridSize) for y in range(gridSize)
+                if not engine.headCounts[engine.cellIndex(x, y)]
+            ]
+            for x, y in random.Random(42).sample(freeCells, min(options['walls'], len(freeCells))):
+                engine.addWall(x, y)
+
+            encoder = DeltaEncoder(options['keyframe_interval'])
+            packer = BinaryPacker()
+            ticksPerSecond = round(1 / engine.tickRate)
+            fullBytes = keyframeBytes = deltaBytes = 0
+            keyframes = deltas = 0
+            binaryBytes = 0
+
+            for tick in range(1, ticks + 1):
+                # Keep every bot in play so each tick moves the same number of players
+                for player in engine.players.values():
+                    player['hits'] = 0
+                engine.tick()
+                # Countdowns and spawns on (roughly) the scheduler's cadence
+                if tick % ticksPerSecond == 0:
+                    engine.updateCountdownWalls()
+                if engine.wallSpawnInterval > 0 and tick % (ticksPerSecond * engine.wallSpawnInterval) == 0:
+                    engine.spawnWall()
+
+                fullBytes += len(json.dumps(engine.getState()))
+                message = encoder.encode(engine)
+                size = len(json.dumps(message))
+                packed = packer.pack(message)
+                # Frames the packer can't handle go out as JSON
+                binaryBytes += len(packed) if packed is not None else size
+                if message['type'] == 'keyframe':
+                    keyframeBytes += size
+                    keyframes += 1
+                else:
+                    deltaBytes += size
+                    deltas += 1
+
+        deltaTotal = keyframeBytes + deltaBytes
+        self.stdout.write(
+            f'grid {gridSize}x{gridSize}, {playerCount} bots, {len(engine.walls)} walls at the end, {ticks} ticks'
+        )
+        self.stdout.write(f'{"full state":<24} {fullBytes / ticks:>10.0f} bytes/tick')
+        self.stdout.write(f'{"keyframe":<24} {keyframeBytes / max(1, keyframes):>10.0f} bytes ({keyframes} sent)')
+        self.stdout.write(f'{"delta":<24} {deltaBytes / max(1, deltas):>10.0f} bytes ({deltas} sent)')
+        self.stdout.write(
+            f'{"delta incl. keyframes":<24} {deltaTotal / ticks:>10.0f} bytes/tick '
+            f'({fullBytes / max(1, deltaTotal):.1f}x smaller)'
+        )
+        self.stdout.write(
+            f'{"binary incl. keyframes":<24} {binaryBytes / ticks:>10.0f} bytes/tick '
+            f'({fullBytes / max(1, binaryBytes):.1f}x smaller)'
+        )
@@ -0,0 +1,166 @@
+import json
+import tracemalloc
+from django.core.management.base import BaseCommand
+from matches.consumers import GameEngine
+from matches.gamelog import quiet
+from matches.replay import expandFrames
+from matches.replaystore import SegmentedReplay, REPLAY_WRITER
+
+
+def legacyFrame(engine):
+    """A v1 replay frame: full copy of every wall, countdown wall and player"""
+    return {
+        'gridSize': engine.gridSize,
+        'players': {
+            str(userId): {
+                'x': player['x'],
+                'y': player['y'],
+                'direction': player['direction'],
+                'alive': player['alive'],
+                'score': player['score'],
+                'hits': player['hits'],
+                'username': player['username'],
+                'playerColor': player['playerColor'],
+            }
+            for userId, player in engine.players.items()
+        },
+        'walls': [{'x': w['x'], 'y': w['y']} for w in engine.walls],
+        'countdownWalls': [{'x': w['x'], 'y': w['y'], 'secondsLeft': w['secondsLeft']} for w in engine.countdownWalls],
+    }
+
+
+class Command(BaseCommand):
+    help = 'Compare replay memory and stored bytes for v1 (full frames), v2 (keyframes + deltas), streamed v2 and input-log replays'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--minutes',
+            type=float,
+            default=5,
+            help='Simulated match length in minutes (default: 5)'
+        )
+        parser.add_argument(
+            '--speed',
+            choices=['SLOW', 'MEDIUM', 'FAST', 'EXTREME'],
+            default='MEDIUM',
+            help='Match speed (default: MEDIUM)'
+        )
+        parser.add_argument(
+            '--grid-size',
+            type=int,
+            default=30,
+            help='Board size (default: 30)'
+        )
+        parser.add_argument(
+            '--players',
+            type=int,
+            default=8,
+            help='Number of bot players (default: 8)'
+        )
+        parser.add_argument(
+            '--wall-spawn-interval',
+            type=int,
+            default=1,
+            help='Seconds between wall spawns (default: 1)'
+        )
+        parser.add_argument(
+            '--segment-frames',
+            type=int,
+            default=600,
+            help='Frames per segment for the streamed replay, written to the configured replay store (default: 600, 0 to skip)'
+        )
+
+    def handle(self, *args, **options):
+        with quiet():
+            legacyFrames, legacyMemory = self.simulate(options, legacy=True)
+            engine, replayMemory = self.simulate(options, legacy=False)
+            if options['segment_frames']:
+                streamedEngine, streamedMemory = self.simulate(options, legacy=False, segmentFrames=options['segment_frames'])
+            inputEngine, inputMemory = self.simulate(options, legacy=False, replayFormat='inputs')
+        replayData = engine.replay.build(engine.tickRate * 1000)
+        legacyData = {'frames': legacyFrames, 'frameDuration': engine.tickRate * 1000, 'mode': 'multiplayer'}
+
+        legacyBytes = len(json.dumps(legacyData))
+        replayBytes = len(json.dumps(replayData))
+        matches = all(
+            self.normalize(expanded) == self.normalize(frame)
+            for expanded, frame in zip(expandFrames(replayData), legacyFrames)
+        ) and len(legacyFrames) == replayData['frameCount']
+
+        self.stdout.write(
+            f'{options["minutes"]:g} min {options["speed"]} match: {len(legacyFrames)} frames, '
+            f'{options["players"]} bots, {len(engine.walls)} walls at the end'
+        )
+        self.stdout.write(f'{"":<12} {"memory":>12} {"JSON":>12}')
+        self.stdout.write(f'{"v1":<12} {legacyMemory / 1e6:>10.1f}MB {legacyBytes / 1e6:>10.2f}MB')
+        self.stdout.write(f'{"v2":<12} {replayMemory / 1e6:>10.1f}MB {replayBytes / 1e6:>10.2f}MB')
+        self.stdout.write(
+            f'{"reduction":<12} {legacyMemory / max(1, replayMemory):>11.1f}x {legacyBytes / max(1, replayBytes):>11.1f}x'
+        )
+        self.stdout.write(f'v2 decodes to the same frames as v1: {"yes" if matches else "NO"}')
+        
+        if options['segment_frames']:
+            # Streamed: memory is the bounded frame buffer; the replay itself is in the replay store
+            recorder = streamedEngine.replay
+            storedReplay = recorder.flush(streamedEngine.tickRate * 1000, final=True).result()
+            streamedMatches = [self.normalize(frame) for frame in expandFrames(storedReplay.load())] == [
+                self.normalize(frame) for frame in legacyFrames
+            ]
+            self.stdout.write(
+                f'{"streamed":<12} {streamedMemory / 1e6:>10.1f}MB {storedReplay.size / 1e6:>10.2f}MB compressed, '
+                f'{storedReplay.segments} segments of {recorder.segmentFrames} frames'
+            )
+            self.stdout.write(f'streamed replay decodes to the same frames as v1: {"yes" if streamedMatches else "NO"}')
+            storedReplay.delete()
+        
+        # Input log: the bench keeps bots alive by resetting hits, which the log doesn't record,
+        # so this row is about size only
+        inputData = inputEngine.inputLog.build(inputEngine, inputEngine.tickRate * 1000)
+        inputBytes = len(json.dumps(inputData))
+        self.stdout.write(
+            f'{"inputs":<12} {inputMemory / 1e3:>10.1f}kB {inputBytes / 1e3:>10.1f}kB '
+            f'({len(inputData["events"])} events, {legacyBytes / max(1, inputBytes):.0f}x smaller than v1)'
+        )
+
+    def simulate(self, options, legacy, segmentFrames=0, replayFormat='frames'):
+        """Run a match on the scheduler's cadence; returns (frames or engine, replay bytes held in memory)"""
+        engine = GameEngine(
+            'bench', options['grid_size'], options['speed'], options['wall_spawn_interval'],
+            seed=42, replayFormat=replayFormat
+        )
+        if segmentFrames:
+            engine.replay.streamTo(SegmentedReplay(), segmentFrames)
+        for i in range(options['players']):
+            engine.addPlayer(f'bot_{i}', f'Bot {i}', '#ef4444', isBot=True)
+
+        legacyFrames = []
+        if legacy:
+            engine.recordFrame = lambda: legacyFrames.append(legacyFrame(engine))
+
+        ticksPerSecond = 1 / engine.tickRate
+        ticks = int(options['minutes'] * 60 * ticksPerSecond)
+        tracemalloc.start()
+        started = tracemalloc.get_traced_memory()[0]
+        for tick in range(1, ticks + 1):
+            # Keep every bot in play for the whole match
+            for player in engine.players.values():
+                player['hits'] = 0
+            engine.tick()
+            seconds, previous = tick / ticksPerSecond, (tick - 1) / ticksPerSecond
+            if int(seconds) != int(previous):
+                engine.updateCountdownWalls()
+                if int(seconds) % engine.wallSpawnInterval == 0:
+                    engine.spawnWall()
+        if segmentFrames:
+            # Let the writer catch up, as it does between segments in a live match
+            REPLAY_WRITER.submit(lambda: None).result()
+        held = tracemalloc.get_traced_memory()[0] - started
+        tracemalloc.stop()
+        return (legacyFrames if legacy else engine), held
+
+    def normalize(self, frame):
+        return {
+            'players': frame['players'],
+            'walls': frame['walls'],
+            'countdownWalls': sorted((w['x'], w['y'], w['secondsLeft']) for w in frame['countdownWalls']),
+        }
@@ -0,0 +1,226 @@
+import asyncio
+import multiprocessing
+import time
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import AsyncClient, override_settings
+from matches.gamelog import quiet
+from matches.harness import EngineHarness
+from matches.management.commands.loadtest import MatchProbe, percentile
+from matches.scheduler import SCHEDULER
+
+
+class Command(BaseCommand):
+    help = (
+        'Tick jitter under concurrent HTTP load, with the engines on the same event loop as the HTTP handling '
+        '(daphne alone) and in a process of their own (runengines). Bot matches that never end tick on the '
+        'scheduler while simulated clients request a page through the ASGI application in a loop, on a '
+        'throwaway test database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--matches',
+            type=int,
+            default=10,
+            help='Concurrent matches (default: 10)'
+        )
+        parser.add_argument(
+            '--bots',
+            type=int,
+            default=6,
+            help='Bots per match, revived every tick so the work stays constant (default: 6)'
+        )
+        parser.add_argument(
+            '--grid-size',
+            type=int,
+            default=40,
+            help='Board size (default: 40)'
+        )
+        parser.add_argument(
+            '--speed',
+            choices=['SLOW', 'MEDIUM', 'FAST', 'EXTREME'],
+            default='FAST',
+            help='Match speed (default: FAST)'
+        )
+        parser.add_argument(
+            '--clients',
+            type=int,
+            default=8,
+            help='Concurrent HTTP clients, each requesting as fast as it gets answers (default: 8)'
+        )
+        parser.add_argument(
+            '--path',
+            default='/',
+            help='Page the clients request, logged in (default: / , the dashboard)'
+        )
+        parser.add_argument(
+            '--seconds',
+            type=float,
+            default=10,
+            help='Measured time per run (default: 10)'
+        )
+        parser.add_argument(
+            '--warmup',
+            type=float,
+            default=1,
+            help='Unmeasured time before each run (default: 1)'
+        )
+
+    def handle(self, *args, **options):
+        if options['matches'] < 1 or options['bots'] < 2:
+            raise CommandError('Need at least one match of 2 bots')
+
+        # Engines never touch the database here; the HTTP clients use a test database dropped afterwards
+        oldName = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(
+                CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+                GAME_SNAPSHOT_INTERVAL=0,
+                ALLOWED_HOSTS=['*'],
+            ), quiet():
+                user = get_user_model().objects.create_user('bench_split', password=None)
+                runs = [
+                    ('engines alone', async_to_sync(self.runShared)(options, None)),
+                    ('shared loop', async_to_sync(self.runShared)(options, user)),
+                    ('split process', self.runSplit(options, user)),
+                ]
+        finally:
+            connection.creation.destroy_test_db(oldName, verbosity=0)
+        self.printReport(runs, options)
+
+    async def runShared(self, options, user):
+        """Engines and (with a user) HTTP clients on this event loop, as in a daphne that hosts engines"""
+        probes = await self.startEngines(options)
+        clients = [HttpClient(user, options['path']) for _ in range(options['clients'])] if user else []
+        result = await self.measure(options, probes, clients)
+        await self.stopEngines(probes)
+        return result
+
+    def runSplit(self, options, user):
+        """Engines in a forked process with a loop of their own, HTTP clients on this one"""
+        context = multiprocessing.get_context('fork')
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=self.engineProcess, args=(options, sender))
+        process.start()
+        http = async_to_sync(self.runClients)(options, user)
+        engines = receiver.recv()
+        process.join()
+        return {**engines, 'requests': http['requests'], 'latencies': http['latencies']}
+
+    def engineProcess(self, options, sender):
+        async def run():
+            probes = await self.startEngines(options)
+            result = await self.measure(options, probes, [])
+            await self.stopEngines(probes)
+            return result
+        with quiet():
+            sender.send(asyncio.run(run()))
+        sender.close()
+
+    async def runClients(self, options, user):
+        clients = [HttpClient(user, options['path']) for _ in range(options['clients'])]
+        return await self.measure(options, {}, clients)
+
+    async def startEngines(self, options):
+        probes = {}
+        for m in range(options['matches']):
+            harness = EngineHarness(
+                gridSize=options['grid_size'],
+                speed=options['speed'],
+                wallSpawnInterval=2,
+                seed=m,
+                matchId=f'bench_{m}',
+            )
+            harness.addBots(options['bots'])
+            engine = harness.engine
+            tick = engine.tick
+
+            def keptAliveTick(harness=harness, tick=tick):
+                harness.reviveAll()
+                tick()
+
+            engine.tick = keptAliveTick
+            probes[engine.matchId] = MatchProbe(engine)
+            await engine.start(f'bench_{m}', noGameOver)
+        return probes
+
+    async def stopEngines(self, probes):
+        for probe in probes.values():
+            probe.engine.stop()
+        if SCHEDULER.task is not None:
+            await asyncio.gather(SCHEDULER.task, return_exceptions=True)
+        for matchId in probes:
+            SCHEDULER.remove(matchId)
+
+    async def measure(self, options, probes, clients):
+        """Run the clients through warmup and the measured window; engine lags and request latencies"""
+        tasks = [asyncio.create_task(client.run()) for client in clients]
+        await asyncio.sleep(options['warmup'])
+        schedulerStarted = dict(SCHEDULER.stats)
+        for measured in list(probes.values()) + clients:
+            measured.measuring = True
+        await asyncio.sleep(options['seconds'])
+        for measured in list(probes.values()) + clients:
+            measured.measuring = False
+        for task in tasks:
+            task.cancel()
+        for outcome in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(outcome, Exception):
+                raise outcome
+        return {
+            'lags': [lag for probe in probes.values() for lag in probe.lags],
+            'ticks': sum(probe.ticks for probe in probes.values()),
+            'lateTicks': SCHEDULER.stats['lateTicks'] - schedulerStarted['lateTicks'],
+            'requests': sum(client.requests for client in clients),
+            'latencies': [latency for client in clients for latency in client.latencies],
+        }
+
+    def printReport(self, runs, options):
+        self.stdout.write(
+            f'{options["matches"]} matches x {options["bots"]} bots, {options["speed"]}, {options["grid_size"]}x{options["grid_size"]}; '
+            f'{options["clients"]} HTTP clients on {options["path"]}; {options["seconds"]:.0f}s per run, '
+            f'{multiprocessing.cpu_count()} CPUs'
+        )
+        self.stdout.write(
+            f'{"run":<14} {"ticks":>7} {"late":>6} {"lag p50":>9} {"lag p99":>9} {"lag max":>9} {"req/s":>8} {"req p50":>9} {"req p99":>9}'
+        )
+        for name, run in runs:
+            lags, latencies = run['lags'], run['latencies']
+            self.stdout.write(
+                f'{name:<14} {run["ticks"]:>7} {run["lateTicks"]:>6} '
+                f'{percentile(lags, 50) * 1000:>7.1f}ms {percentile(lags, 99) * 1000:>7.1f}ms {max(lags, default=0) * 1000:>7.1f}ms '
+                f'{run["requests"] / options["seconds"]:>8.0f} '
+                f'{percentile(latencies, 50) * 1000:>7.1f}ms {percentile(latencies, 99) * 1000:>7.1f}ms'
+            )
+        if multiprocessing.cpu_count() < 2:
+            self.stdout.write('One CPU: the split process only gains from preemptive OS scheduling, not from a core of its own')
+
+
+async def noGameOver(state):
+    pass
+
+
+class HttpClient:
+    """Requests one page through the ASGI application in a loop, logged in as user"""
+
+    def __init__(self, user, path):
+        self.user = user
+        self.path = path
+        self.requests = 0
+        self.latencies = []
+        self.measuring = False
+
+    async def run(self):
+        client = AsyncClient()
+        await client.aforce_login(self.user)
+        while True:
+            started = time.perf_counter()
+            response = await client.get(self.path)
+            if response.status_code >= 400:
+                raise CommandError(f'{self.path} answered {response.status_code}')
+            if self.measuring:
+                self.requests += 1
+                self.latencies.append(time.perf_counter() - started)
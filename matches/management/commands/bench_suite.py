@@ -0,0 +1,158 @@
+import json
+import platform
+from django.core.management.base import BaseCommand, CommandError
+from matches.harness import EngineHarness
+
+
+def intList(value):
+    return [int(item) for item in value.split(',') if item]
+
+
+def floatList(value):
+    return [float(item) for item in value.split(',') if item]
+
+
+class Command(BaseCommand):
+    help = 'Baseline engine benchmark: ticks/sec, p50/p99 frame latency and allocations across grid sizes, player counts and wall densities'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grid-sizes',
+            type=intList,
+            default=[20, 50, 100, 200],
+            help='Comma-separated board sizes (default: 20,50,100,200)'
+        )
+        parser.add_argument(
+            '--players',
+            type=intList,
+            default=[2, 10, 50, 100],
+            help='Comma-separated player counts (default: 2,10,50,100)'
+        )
+        parser.add_argument(
+            '--densities',
+            type=floatList,
+            default=[0, 0.2, 0.5],
+            help='Comma-separated fractions of the board covered by walls (default: 0,0.2,0.5)'
+        )
+        parser.add_argument(
+            '--humans',
+            type=int,
+            default=1,
+            help='How many of the players are scripted humans turning at random, the rest are bots (default: 1)'
+        )
+        parser.add_argument(
+            '--ticks',
+            type=int,
+            default=200,
+            help='Frames measured per case (default: 200)'
+        )
+        parser.add_argument(
+            '--mode',
+            choices=['dict', 'array'],
+            default='dict',
+            help="Engine implementation: 'dict' or NumPy 'array' (default: dict)"
+        )
+        parser.add_argument(
+            '--replay-format',
+            choices=['inputs', 'frames'],
+            default=None,
+            help='Replay capture during the match (default: GAME_REPLAY_FORMAT)'
+        )
+        parser.add_argument(
+            '--tick-only',
+            action='store_true',
+            help='Time engine.tick() alone, without serializing the gameState message'
+        )
+        parser.add_argument(
+            '--no-allocations',
+            action='store_true',
+            help='Skip the tracemalloc pass'
+        )
+        parser.add_argument(
+            '--output',
+            default=None,
+            help='Write the results as JSON to this file, to compare later runs against'
+        )
+        parser.add_argument(
+            '--baseline',
+            default=None,
+            help='JSON from an earlier --output run; adds a speedup column'
+        )
+
+    def handle(self, *args, **options):
+        if options['mode'] == 'array':
+            from matches.kernel import ArrayGameEngine
+            engineClass = ArrayGameEngine
+        else:
+            from matches.consumers import GameEngine
+            engineClass = GameEngine
+        settings = {}
+        if options['replay_format']:
+            settings['GAME_REPLAY_FORMAT'] = options['replay_format']
+
+        baseline = {}
+        if options['baseline']:
+            try:
+                with open(options['baseline']) as f:
+                    baseline = {self.caseKey(case): case for case in json.load(f)['cases']}
+            except (OSError, ValueError, KeyError) as e:
+                raise CommandError(f'Could not read baseline {options["baseline"]}: {e}')
+
+        self.stdout.write(
+            f'{engineClass.__name__}, {options["ticks"]} frames per case'
+            f'{" (tick only)" if options["tick_only"] else ""}, Python {platform.python_version()}'
+        )
+        header = f'{"grid":>5} {"players":>8} {"walls":>6} {"ticks/s":>10} {"p50 µs":>9} {"p99 µs":>9} {"alloc kB":>9} {"kept B":>8}'
+        if baseline:
+            header += f' {"speedup":>8}'
+        self.stdout.write(header)
+
+        cases = []
+        for gridSize in options['grid_sizes']:
+            for players in options['players']:
+                # Spawns need room; skip boards too small for the player count
+                if players * 4 > gridSize * gridSize:
+                    continue
+                for density in options['densities']:
+                    harness = EngineHarness(
+                        gridSize=gridSize,
+                        speed='EXTREME',
+                        wallSpawnInterval=1,
+                        engineClass=engineClass,
+                        settings=settings,
+                        serialize=not options['tick_only'],
+                    )
+                    humans = min(options['humans'], players)
+                    harness.addHumans(humans, inputRate=0.05)
+                    harness.addBots(players - humans)
+                    harness.addWalls(density)
+                    stats = harness.measure(options['ticks'], allocations=not options['no_allocations'])
+
+                    case = {'gridSize': gridSize, 'players': players, 'density': density, **stats.asDict()}
+                    cases.append(case)
+                    line = (
+                        f'{gridSize:>5} {players:>8} {density:>6.0%} {case["ticksPerSecond"]:>10.0f} '
+                        f'{case["p50Us"]:>9.1f} {case["p99Us"]:>9.1f} '
+                    )
+                    if stats.allocated is None:
+                        line += f'{"-":>9} {"-":>8}'
+                    else:
+                        line += f'{stats.allocated / 1e3:>9.1f} {stats.retained:>8.0f}'
+                    previous = baseline.get(self.caseKey(case))
+                    if previous:
+                        line += f' {case["ticksPerSecond"] / previous["ticksPerSecond"]:>7.2f}x'
+                    self.stdout.write(line)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({
+                    'engine': engineClass.__name__,
+                    'ticks': options['ticks'],
+                    'tickOnly': options['tick_only'],
+                    'python': platform.python_version(),
+                    'cases': cases,
+                }, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'Wrote {len(cases)} cases to {options["output"]}'))
+
+    def caseKey(self, case):
+        return (case['gridSize'], case['players'], case['density'])
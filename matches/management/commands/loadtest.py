@@ -0,0 +1,353 @@
+import asyncio
+import json
+import random
+import struct
+import time
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from matches.consumers import ACTIVE_GAMES, ACTIVE_COUNTDOWNS
+from matches.gamelog import quiet
+from matches.models import MatchType, Match, MatchParticipation
+from matches.protocol import BINARY_SUBPROTOCOL, JSON_SUBPROTOCOL
+from matches.routing import websocket_urlpatterns
+from matches.scheduler import SCHEDULER
+
+DIRECTIONS = ['UP', 'DOWN', 'LEFT', 'RIGHT']
+# Binary keyframes and deltas both start with (frame type, seq, tick)
+BINARY_FRAME_HEAD = struct.Struct('<BII')
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+class MatchProbe:
+    """Instruments one engine: when each tick's frame was built, scheduler lag and engine tick time"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.sentAt = {}
+        self.lags = []
+        self.tickSeconds = 0.0
+        self.ticks = 0
+        self.measuring = False
+
+        buildStateMessage = engine.buildStateMessage
+        tick = engine.tick
+        recordTickTiming = engine.recordTickTiming
+
+        def timedBuildStateMessage():
+            self.sentAt[engine.tickNumber] = time.perf_counter()
+            return buildStateMessage()
+
+        def timedTick():
+            started = time.perf_counter()
+            tick()
+            if self.measuring:
+                self.tickSeconds += time.perf_counter() - started
+                self.ticks += 1
+
+        def sampledRecordTickTiming(now, jitter):
+            if self.measuring:
+                self.lags.append(jitter)
+            recordTickTiming(now, jitter)
+
+        engine.buildStateMessage = timedBuildStateMessage
+        engine.tick = timedTick
+        engine.recordTickTiming = sampledRecordTickTiming
+
+
+class SimulatedPlayer:
+    """One WebSocket client: turns at random (Poisson) intervals and timestamps every frame it receives"""
+
+    def __init__(self, communicator, probe, inputRate, rng):
+        self.communicator = communicator
+        self.probe = probe
+        self.inputRate = inputRate
+        self.rng = rng
+        self.latencies = []
+        self.frames = 0
+        self.dropped = 0
+        self.sent = 0
+        self.lastTick = None
+
+    async def receiveLoop(self):
+        while True:
+            try:
+                message = await self.communicator.receive_output(timeout=5)
+            except asyncio.TimeoutError:
+                continue
+            if message['type'] == 'websocket.close':
+                return
+            receivedAt = time.perf_counter()
+            tick = self.frameTick(message)
+            if tick is None:
+                continue
+            if self.probe.measuring:
+                sentAt = self.probe.sentAt.get(tick)
+                if sentAt is not None:
+                    self.latencies.append(receivedAt - sentAt)
+                self.frames += 1
+                if self.lastTick is not None and tick > self.lastTick + 1:
+                    self.dropped += tick - self.lastTick - 1
+            self.lastTick = tick
+
+    def frameTick(self, message):
+        """Tick number of a gameState frame, None for countdown/gameOver/playerColor messages"""
+        if message.get('bytes') is not None:
+            _, _, tick = BINARY_FRAME_HEAD.unpack_from(message['bytes'])
+            return tick
+        data = json.loads(message['text'])
+        if data.get('type') in ('countdown', 'gameOver', 'playerColor'):
+            return None
+        return data.get('tick')
+
+    async def inputLoop(self):
+        while True:
+            await asyncio.sleep(self.rng.expovariate(self.inputRate))
+            await self.communicator.send_to(text_data=json.dumps({
+                'action': 'changeDirection',
+                'direction': self.rng.choice(DIRECTIONS),
+            }))
+            if self.probe.measuring:
+                self.sent += 1
+
+
+class Command(BaseCommand):
+    help = (
+        'Load-test GameConsumer in this process: N matches of M simulated WebSocket players sending changeDirection, '
+        'on a throwaway test database. Reports tick lag, frame delivery latency, dropped frames and CPU per match. '
+        'The simulated clients run in the same process, so CPU figures include them.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--matches',
+            type=int,
+            default=10,
+            help='Concurrent matches (default: 10)'
+        )
+        parser.add_argument(
+            '--players',
+            type=int,
+            default=4,
+            help='Simulated WebSocket players per match (default: 4)'
+        )
+        parser.add_argument(
+            '--bots',
+            type=int,
+            default=0,
+            help='Server-side bots per match (default: 0)'
+        )
+        parser.add_argument(
+            '--seconds',
+            type=float,
+            default=30,
+            help='Measured time once every match is running, after the 10s countdown (default: 30)'
+        )
+        parser.add_argument(
+            '--input-rate',
+            type=float,
+            default=2.0,
+            help='changeDirection messages per player per second, Poisson distributed (default: 2)'
+        )
+        parser.add_argument(
+            '--speed',
+            choices=['SLOW', 'MEDIUM', 'FAST', 'EXTREME'],
+            default='MEDIUM',
+            help='Match speed (default: MEDIUM)'
+        )
+        parser.add_argument(
+            '--grid-size',
+            type=int,
+            default=30,
+            help='Board size (default: 30)'
+        )
+        parser.add_argument(
+            '--wall-spawn-interval',
+            type=int,
+            default=2,
+            help='Seconds between wall spawns (default: 2)'
+        )
+        parser.add_argument(
+            '--layer',
+            choices=['memory', 'redis'],
+            default='memory',
+            help="Channel layer: in-memory or a local Redis (default: memory)"
+        )
+        parser.add_argument(
+            '--redis-url',
+            default='redis://127.0.0.1:6379',
+            help='Redis for --layer redis (default: redis://127.0.0.1:6379)'
+        )
+        parser.add_argument(
+            '--binary',
+            action='store_true',
+            help='Negotiate binary frames instead of JSON'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=42,
+            help='Seed for the simulated players (default: 42)'
+        )
+
+    def handle(self, *args, **options):
+        if options['players'] + options['bots'] < 2:
+            raise CommandError('A match needs at least 2 players (--players + --bots)')
+        layer = {'BACKEND': 'channels.layers.InMemoryChannelLayer'}
+        if options['layer'] == 'redis':
+            layer = {
+                'BACKEND': 'channels_redis.core.RedisChannelLayer',
+                'CONFIG': {'hosts': [options['redis_url']]},
+            }
+
+        # Never touch real users or matches: everything lives in a test database dropped afterwards
+        # (engine snapshots are off, their test match ids would shadow real ones in the snapshot store)
+        oldName = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(CHANNEL_LAYERS={'default': layer}, GAME_SNAPSHOT_INTERVAL=0), quiet():
+                matchIds = self.createMatches(options)
+                report = async_to_sync(self.run)(matchIds, options)
+        finally:
+            connection.creation.destroy_test_db(oldName, verbosity=0)
+        self.printReport(report, options)
+
+    def createMatches(self, options):
+        User = get_user_model()
+        matchType = MatchType.objects.create(
+            name='Load test',
+            description='loadtest',
+            entryFee=0,
+            gridSize=options['grid_size'],
+            speed=options['speed'],
+            playersRequired=options['players'] + options['bots'],
+            maxPlayers=options['players'] + options['bots'],
+            wallSpawnInterval=options['wall_spawn_interval'],
+            hasBot=options['bots'] > 0,
+        )
+        matchIds = {}
+        for m in range(options['matches']):
+            match = Match.objects.create(
+                matchType=matchType,
+                status='STARTING',
+                gridSize=options['grid_size'],
+                speed=options['speed'],
+                currentPlayers=options['players'] + options['bots'],
+                playersRequired=options['players'] + options['bots'],
+            )
+            users = []
+            for p in range(options['players']):
+                user = User.objects.create_user(f'load_{m}_{p}', password=None)
+                MatchParticipation.objects.create(match=match, player=user, entryFeePaid=0)
+                users.append(user)
+            for b in range(options['bots']):
+                MatchParticipation.objects.create(match=match, username=f'Bot {b}', isBot=True, entryFeePaid=0)
+            matchIds[match.id] = users
+        return matchIds
+
+    async def run(self, matchIds, options):
+        application = URLRouter(websocket_urlpatterns)
+        subprotocols = [BINARY_SUBPROTOCOL, JSON_SUBPROTOCOL] if options['binary'] else [JSON_SUBPROTOCOL]
+        rng = random.Random(options['seed'])
+        probes = {}
+        players = []
+        tasks = []
+
+        for matchId, users in matchIds.items():
+            for user in users:
+                communicator = WebsocketCommunicator(application, f'/ws/match/{matchId}/', subprotocols=subprotocols)
+                communicator.scope['user'] = user
+                connected, _ = await communicator.connect(timeout=30)
+                if not connected:
+                    raise CommandError(f'Player {user.username} could not connect to match {matchId}')
+                # The socket is accepted before the player joins the engine; playerColor follows the join
+                while json.loads((await communicator.receive_output(timeout=30)).get('text') or '{}').get('type') != 'playerColor':
+                    pass
+                if matchId not in probes:
+                    probes[matchId] = MatchProbe(ACTIVE_GAMES[matchId])
+                player = SimulatedPlayer(communicator, probes[matchId], options['input_rate'], random.Random(rng.random()))
+                players.append(player)
+                tasks.append(asyncio.create_task(player.receiveLoop()))
+                tasks.append(asyncio.create_task(player.inputLoop()))
+        self.stdout.write(f'{len(players)} players connected to {len(probes)} matches, waiting for the countdown')
+
+        # Measure only once every match is ticking
+        while ACTIVE_COUNTDOWNS or not all(probe.engine.running for probe in probes.values()):
+            await asyncio.sleep(0.1)
+        for probe in probes.values():
+            probe.measuring = True
+        wallStarted, cpuStarted = time.perf_counter(), time.process_time()
+        schedulerStarted = dict(SCHEDULER.stats)
+        await asyncio.sleep(options['seconds'])
+        for probe in probes.values():
+            probe.measuring = False
+        wall, cpu = time.perf_counter() - wallStarted, time.process_time() - cpuStarted
+        scheduler = {key: SCHEDULER.stats[key] - schedulerStarted[key] for key in ('ticks', 'lateTicks', 'caughtUpTicks', 'skippedTicks')}
+        ended = sum(1 for probe in probes.values() if not probe.engine.running)
+
+        for probe in probes.values():
+            probe.engine.stop()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for player in players:
+            await player.communicator.disconnect()
+        if SCHEDULER.task is not None:
+            await asyncio.gather(SCHEDULER.task, return_exceptions=True)
+        for matchId in probes:
+            SCHEDULER.remove(matchId)
+
+        return {
+            'wall': wall,
+            'cpu': cpu,
+            'ended': ended,
+            'scheduler': scheduler,
+            'probes': probes,
+            'players': players,
+        }
+
+    def printReport(self, report, options):
+        probes, players, wall = report['probes'], report['players'], report['wall']
+        lags = [lag for probe in probes.values() for lag in probe.lags]
+        latencies = [latency for player in players for latency in player.latencies]
+        frames = sum(player.frames for player in players)
+        dropped = sum(player.dropped for player in players)
+        ticks = sum(probe.ticks for probe in probes.values())
+        tickSeconds = sum(probe.tickSeconds for probe in probes.values())
+        expectedTicks = len(probes) * wall / next(iter(probes.values())).engine.tickRate
+
+        self.stdout.write(
+            f'{len(probes)} matches x {options["players"]} players + {options["bots"]} bots, {options["speed"]}, '
+            f'{options["layer"]} layer, {"binary" if options["binary"] else "JSON"} frames, {wall:.1f}s measured'
+        )
+        if report['ended']:
+            self.stdout.write(f'{report["ended"]} matches ended before the measurement finished')
+        self.stdout.write(
+            f'ticks        {ticks} of {expectedTicks:.0f} expected ({ticks / max(1, expectedTicks):.1%}); '
+            f'late {report["scheduler"]["lateTicks"]}, caught up {report["scheduler"]["caughtUpTicks"]}, '
+            f'skipped {report["scheduler"]["skippedTicks"]}'
+        )
+        self.stdout.write(
+            f'tick lag     p50 {percentile(lags, 50) * 1000:.1f}ms  p99 {percentile(lags, 99) * 1000:.1f}ms  '
+            f'max {max(lags, default=0) * 1000:.1f}ms'
+        )
+        self.stdout.write(
+            f'delivery     p50 {percentile(latencies, 50) * 1000:.1f}ms  p99 {percentile(latencies, 99) * 1000:.1f}ms  '
+            f'max {max(latencies, default=0) * 1000:.1f}ms over {frames} frames'
+        )
+        self.stdout.write(f'dropped      {dropped} frames ({dropped / max(1, frames + dropped):.2%})')
+        self.stdout.write(f'inputs       {sum(player.sent for player in players)} changeDirection sent')
+        self.stdout.write(
+            f'CPU          {report["cpu"] / wall:.0%} of one core for the process, '
+            f'{report["cpu"] / wall / len(probes):.1%} per match; '
+            f'engine tick {tickSeconds / max(1, ticks) * 1e6:.0f}µs avg, {tickSeconds / wall / len(probes) * 1000:.1f}ms/s per match'
+        )
@@ -0,0 +1,93 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from matches.models import SoloRun, ProgressiveRun, MatchReplay
+from matches.replaystore import CODECS, BACKENDS, storeReplay
+
+
+class Command(BaseCommand):
+    help = 'Move inline replayData JSON into the compressed replay store, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Rows moved per transaction (default: 100)'
+        )
+        parser.add_argument(
+            '--backend',
+            choices=sorted(BACKENDS),
+            default=None,
+            help='Replay store backend (default: REPLAY_STORE_BACKEND)'
+        )
+        parser.add_argument(
+            '--codec',
+            choices=CODECS,
+            default=None,
+            help='Compression codec (default: REPLAY_COMPRESSION)'
+        )
+        parser.add_argument(
+            '--level',
+            type=int,
+            default=None,
+            help='Compression level (default: REPLAY_COMPRESSION_LEVEL)'
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=None,
+            help='Stop after this many rows per model'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only count the rows that would be moved'
+        )
+
+    def handle(self, *args, **options):
+        totalRaw = totalStored = 0
+        for model in (SoloRun, ProgressiveRun, MatchReplay):
+            pending = model.objects.filter(replayData__isnull=False, storedReplay__isnull=True)
+            if options['dry_run']:
+                self.stdout.write(f'{model.__name__}: {pending.count()} replays to move')
+                continue
+            moved, rawBytes, storedBytes = self.migrateModel(pending, options)
+            totalRaw += rawBytes
+            totalStored += storedBytes
+            self.stdout.write(
+                f'{model.__name__}: moved {moved} replays, '
+                f'{rawBytes / 1e6:.2f}MB JSON -> {storedBytes / 1e6:.2f}MB stored'
+            )
+        if totalStored:
+            self.stdout.write(self.style.SUCCESS(
+                f'Done: {totalRaw / 1e6:.2f}MB -> {totalStored / 1e6:.2f}MB '
+                f'({totalRaw / totalStored:.1f}x smaller)'
+            ))
+
+    def migrateModel(self, pending, options):
+        """Walk pending rows by primary key so each batch is a short transaction"""
+        moved = rawBytes = storedBytes = 0
+        lastId = 0
+        while options['limit'] is None or moved < options['limit']:
+            batchSize = options['batch_size']
+            if options['limit'] is not None:
+                batchSize = min(batchSize, options['limit'] - moved)
+            ids = list(pending.filter(id__gt=lastId).order_by('id').values_list('id', flat=True)[:batchSize])
+            if not ids:
+                break
+            lastId = ids[-1]
+            with transaction.atomic():
+                # Lock the batch so a concurrent writer can't store the same replay twice
+                rows = pending.filter(id__in=ids).select_for_update().only('id', 'replayData')
+                for row in rows:
+                    storedReplay = storeReplay(
+                        row.replayData,
+                        backend=options['backend'],
+                        codec=options['codec'],
+                        level=options['level'],
+                    )
+                    type(row).objects.filter(id=row.id).update(storedReplay=storedReplay, replayData=None)
+                    moved += 1
+                    rawBytes += storedReplay.rawSize
+                    storedBytes += storedReplay.size
+        return moved, rawBytes, storedBytes
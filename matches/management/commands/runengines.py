@@ -0,0 +1,73 @@
+import asyncio
+import os
+import signal
+from channels.layers import get_channel_layer, InMemoryChannelLayer
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from matches.consumers import serveEngineRequest, engineChannel
+from matches.gamelog import logger
+from matches.metrics import startMetricsServer
+from matches.ownership import OWNERSHIP
+from matches.scheduler import SCHEDULER, SLOT_SECONDS, HANDOFF_POLL_SLOTS
+
+
+class Command(BaseCommand):
+    help = (
+        'Host game engines in this process, away from the HTTP and WebSocket handling in daphne. '
+        'With GAME_ENGINE_WORKERS on, consumers hand new and orphaned matches to these workers over '
+        'GAME_ENGINE_CHANNEL and forward inputs to the owning worker; frames reach the sockets through '
+        'the match group. Run as many as needed; SIGUSR1 or SIGTERM hands their matches over and exits. '
+        'daphne\'s /matches/metrics/ and /matches/engines/ only see its own process, so each worker serves '
+        'its metrics at /metrics and /stats on --metrics-port.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--metrics-port', type=int, default=getattr(settings, 'GAME_ENGINE_METRICS_PORT', 0),
+                            help='Serve Prometheus /metrics and JSON /stats on this port (0: off; one port per worker)')
+        parser.add_argument('--metrics-host', default=getattr(settings, 'GAME_ENGINE_METRICS_HOST', '127.0.0.1'),
+                            help='Address the metrics listener binds to')
+
+    def handle(self, *args, **options):
+        if not getattr(settings, 'GAME_ENGINE_WORKERS', False):
+            self.stderr.write('GAME_ENGINE_WORKERS is off: daphne hosts engines itself and sends this worker nothing')
+        if isinstance(get_channel_layer(), InMemoryChannelLayer):
+            raise CommandError('Engine workers need a channel layer shared with daphne (set REDIS_URL)')
+        asyncio.run(self.run(options['metrics_host'], options['metrics_port']))
+
+    async def run(self, metricsHost, metricsPort):
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGUSR1, signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, SCHEDULER.requestDrain)
+        layer = get_channel_layer()
+        channel = engineChannel()
+        await OWNERSHIP.ensure()
+        self.stdout.write(f'Engine worker {os.getpid()} serving {channel} as {OWNERSHIP.channelName}')
+        metricsServer = None
+        if metricsPort:
+            metricsServer = await startMetricsServer(SCHEDULER, metricsHost, metricsPort)
+            self.stdout.write(f'Metrics at http://{metricsHost}:{metricsPort}/metrics')
+
+        pollSeconds = HANDOFF_POLL_SLOTS * SLOT_SECONDS
+        while not SCHEDULER.draining:
+            try:
+                message = await asyncio.wait_for(layer.receive(channel), pollSeconds)
+            except asyncio.TimeoutError:
+                # A running scheduler polls for handoffs itself; an idle worker has to ask
+                if not SCHEDULER.engines and SCHEDULER.snapshotSlots():
+                    await SCHEDULER.adoptHandoffs()
+                continue
+            asyncio.create_task(self.serve(message))
+
+        # The scheduler drains its engines at its next slot
+        if SCHEDULER.task is not None:
+            await asyncio.gather(SCHEDULER.task, return_exceptions=True)
+        if metricsServer is not None:
+            metricsServer.close()
+        self.stdout.write(f'Engine worker {os.getpid()} drained')
+
+    async def serve(self, message):
+        try:
+            await serveEngineRequest(message)
+        except Exception as e:
+            logger.error('[runengines] Error serving %s for match %s: %s',
+                         message.get('type'), message.get('matchId'), e, exc_info=True)
@@ -0,0 +1,58 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from django.utils import timezone
+from matches.models import SettlementJob
+from matches.settlement import runDueSettlements
+
+
+class Command(BaseCommand):
+    help = (
+        'Run queued game-over settlements. Every game worker already runs its own settlement loop; '
+        'this is a dedicated one, or a way to inspect, retry and drain the queue by hand'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Run the jobs that are due, then exit'
+        )
+        parser.add_argument(
+            '--retry-failed',
+            action='store_true',
+            help='Queue FAILED jobs again (attempts reset) before running'
+        )
+        parser.add_argument(
+            '--status',
+            action='store_true',
+            help='Only show the queue: jobs per status and the failed ones'
+        )
+
+    def handle(self, *args, **options):
+        if options['status']:
+            self.showStatus()
+            return
+
+        if options['retry_failed']:
+            count = SettlementJob.objects.filter(status='FAILED').update(status='PENDING', attempts=0, runAfter=timezone.now())
+            self.stdout.write(f'{count} failed settlements queued again')
+
+        pollSeconds = getattr(settings, 'GAME_SETTLEMENT_POLL_SECONDS', 10)
+        total = 0
+        while True:
+            ran = runDueSettlements()
+            total += ran
+            if not ran:
+                if options['once']:
+                    break
+                time.sleep(pollSeconds)
+        self.stdout.write(f'Ran {total} settlements')
+        self.showStatus()
+
+    def showStatus(self):
+        counts = dict(SettlementJob.objects.values_list('status').annotate(count=Count('id')))
+        self.stdout.write(', '.join(f'{status} {counts.get(status, 0)}' for status in ('PENDING', 'DONE', 'FAILED')))
+        for job in SettlementJob.objects.filter(status='FAILED').order_by('updatedAt'):
+            self.stdout.write(f'  match {job.match_id}: {job.attempts} attempts, {job.lastError}')
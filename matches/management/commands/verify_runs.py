@@ -0,0 +1,95 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from django.core.management.base import BaseCommand
+from matches.models import SoloRun, ProgressiveRun
+from matches.simulation import replayOutcome, INPUT_REPLAY_FORMAT
+
+MODELS = {'solo': SoloRun, 'progressive': ProgressiveRun}
+
+
+def verifyReplay(replayData):
+    """Worker: (outcome, None) or (None, error) for one input replay"""
+    try:
+        return replayOutcome(replayData), None
+    except Exception as e:
+        return None, str(e)
+
+
+class Command(BaseCommand):
+    help = 'Re-simulate stored solo/progressive runs from their seed and inputs and report any whose saved result differs'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--mode',
+            choices=sorted(MODELS),
+            default=None,
+            help='Only verify this mode (default: both)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Simulation processes (default: one per CPU)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=200,
+            help='Replays loaded and handed to the pool at a time (default: 200)'
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=None,
+            help='Stop after this many runs per mode'
+        )
+
+    def handle(self, *args, **options):
+        modes = [options['mode']] if options['mode'] else sorted(MODELS)
+        failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            for mode in modes:
+                checked, mismatched = self.verifyModel(MODELS[mode], pool, options)
+                failed += mismatched
+                self.stdout.write(f'{MODELS[mode].__name__}: {checked} runs re-simulated, {mismatched} mismatched')
+        if failed:
+            self.stdout.write(self.style.ERROR(f'{failed} runs do not match their replay'))
+        else:
+            self.stdout.write(self.style.SUCCESS('All runs match their replay'))
+
+    def verifyModel(self, model, pool, options):
+        """Load replays in keyset batches in this process; simulate them in the pool"""
+        runs = model.objects.filter(seed__isnull=False, storedReplay__isnull=False).select_related('storedReplay').order_by('id')
+        checked = mismatched = 0
+        lastId = 0
+        while options['limit'] is None or checked < options['limit']:
+            batchSize = options['batch_size']
+            if options['limit'] is not None:
+                batchSize = min(batchSize, options['limit'] - checked)
+            batch = list(runs.filter(id__gt=lastId)[:batchSize])
+            if not batch:
+                break
+            lastId = batch[-1].id
+
+            replays = [run.storedReplay.load() for run in batch]
+            inputRuns = [
+                (run, replayData) for run, replayData in zip(batch, replays)
+                if replayData.get('format') == INPUT_REPLAY_FORMAT
+            ]
+            chunksize = max(1, len(inputRuns) // (options['workers'] * 4))
+            results = pool.map(verifyReplay, [replayData for _, replayData in inputRuns], chunksize=chunksize)
+            for (run, _), (outcome, error) in zip(inputRuns, results):
+                checked += 1
+                if error:
+                    mismatched += 1
+                    self.stdout.write(f'{model.__name__} {run.id}: replay is invalid ({error})')
+                    continue
+                differences = [
+                    f'{field} saved {getattr(run, field)} != replayed {value}'
+                    for field, value in outcome.items()
+                    if getattr(run, field) != value
+                ]
+                if differences:
+                    mismatched += 1
+                    self.stdout.write(f'{model.__name__} {run.id}: ' + ', '.join(differences))
+        return checked, mismatched
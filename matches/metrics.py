@@ -0,0 +1,199 @@
+import asyncio
+import bisect
+import json
+import secrets
+import time
+from django.conf import settings
+
+# Tick phases timed by every engine, in the order they run
+PHASES = ('botAI', 'movement', 'collision', 'apply', 'recordFrame', 'serialize', 'broadcast')
+
+# Histogram bucket upper bounds in seconds (10µs to 250ms), plus an implicit +Inf bucket
+BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram: one bisect and two additions per observation"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th observation (seconds, capped at the last bound)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return BUCKETS[-1]
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+
+class TickMetrics:
+    """Per-engine phase histograms and broadcast payload sizes.
+
+    start() marks the beginning of a run of phases and each lap(phase) records the time
+    since the previous mark, so a phase costs one perf_counter call to time.
+    """
+
+    def __init__(self):
+        self.phases = {phase: Histogram() for phase in PHASES}
+        self.mark = 0.0
+        self.frames = 0
+        self.payloadBytes = 0
+        self.binaryPayloadBytes = 0
+        self.payloadBytesTotal = 0
+
+    def start(self):
+        self.mark = time.perf_counter()
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.phases[phase].observe(now - self.mark)
+        self.mark = now
+
+    def payload(self, textBytes, binaryBytes=0):
+        self.frames += 1
+        self.payloadBytes = textBytes
+        self.binaryPayloadBytes = binaryBytes
+        self.payloadBytesTotal += textBytes
+
+    def merge(self, other):
+        for phase, histogram in other.phases.items():
+            self.phases[phase].merge(histogram)
+        self.frames += other.frames
+        self.payloadBytesTotal += other.payloadBytesTotal
+
+    def summary(self):
+        """Per-phase count, mean and p50/p99 in milliseconds"""
+        return {
+            phase: {
+                'count': histogram.count,
+                'meanMs': histogram.mean * 1000,
+                'p50Ms': histogram.quantile(0.5) * 1000,
+                'p99Ms': histogram.quantile(0.99) * 1000,
+            }
+            for phase, histogram in self.phases.items()
+        }
+
+
+def labels(**values):
+    return '{' + ','.join(f'{key}="{value}"' for key, value in values.items()) + '}'
+
+
+def prometheusText(scheduler):
+    """Prometheus text exposition (format 0.0.4) of one worker's scheduler and engines"""
+    stats = scheduler.stats
+    lines = []
+
+    def metric(name, kind, helpText, samples):
+        lines.append(f'# HELP {name} {helpText}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labelText, value in samples:
+            lines.append(f'{name}{labelText} {value}')
+
+    metric('dash_scheduler_ticks_total', 'counter', 'Ticks run by this worker', [('', stats['ticks'])])
+    metric('dash_scheduler_late_ticks_total', 'counter', 'Ticks started more than one slot late', [('', stats['lateTicks'])])
+    metric('dash_scheduler_caught_up_ticks_total', 'counter', 'Missed ticks run back-to-back', [('', stats['caughtUpTicks'])])
+    metric('dash_scheduler_skipped_ticks_total', 'counter', 'Missed ticks dropped', [('', stats['skippedTicks'])])
+    metric('dash_scheduler_jitter_max_seconds', 'gauge', 'Worst tick start delay', [('', stats['jitterMaxMs'] / 1000)])
+    metric('dash_scheduler_batch_max_seconds', 'gauge', 'Longest slot batch', [('', stats['maxBatchMs'] / 1000)])
+
+    hosted = scheduler.hostedEngines()
+    engines = [engine for _, engine in hosted]
+    metric('dash_engines_running', 'gauge', 'Engines ticking on this worker',
+           [('', sum(1 for engine in engines if engine.running))])
+
+    # Phase histograms: every engine this worker has run, finished ones included
+    totals = scheduler.phaseMetrics(hosted)
+    lines.append('# HELP dash_engine_phase_seconds Time spent per tick phase')
+    lines.append('# TYPE dash_engine_phase_seconds histogram')
+    for phase, histogram in totals.phases.items():
+        cumulative = 0
+        for bound, count in zip(BUCKETS, histogram.counts):
+            cumulative += count
+            lines.append(f'dash_engine_phase_seconds_bucket{labels(phase=phase, le=repr(bound))} {cumulative}')
+        lines.append(f'dash_engine_phase_seconds_bucket{labels(phase=phase, le="+Inf")} {histogram.count}')
+        lines.append(f'dash_engine_phase_seconds_sum{labels(phase=phase)} {histogram.sum}')
+        lines.append(f'dash_engine_phase_seconds_count{labels(phase=phase)} {histogram.count}')
+    metric('dash_engine_payload_bytes_total', 'counter', 'JSON gameState bytes broadcast', [('', totals.payloadBytesTotal)])
+
+    # Live engines, one series each
+    metric('dash_engine_tick', 'gauge', 'Current tick number',
+           [(labels(match=engine.matchId), engine.tickNumber) for engine in engines])
+    metric('dash_engine_frame_seconds', 'gauge', 'Measured seconds per frame',
+           [(labels(match=engine.matchId), engine.measuredFrameDuration() / 1000) for engine in engines])
+    metric('dash_engine_jitter_avg_seconds', 'gauge', 'Average tick start delay',
+           [(labels(match=engine.matchId), engine.tickTiming['jitterAvgMs'] / 1000) for engine in engines])
+    metric('dash_engine_payload_bytes', 'gauge', 'Size of the last JSON gameState frame',
+           [(labels(match=engine.matchId), engine.metrics.payloadBytes) for engine in engines])
+    return '\n'.join(lines) + '\n'
+
+
+def tokenAuthorized(authorization):
+    """True if an Authorization header carries the GAME_METRICS_TOKEN bearer token"""
+    token = getattr(settings, 'GAME_METRICS_TOKEN', '')
+    return bool(token) and secrets.compare_digest(authorization, f'Bearer {token}')
+
+
+async def startMetricsServer(scheduler, host, port):
+    """Plain HTTP listener for processes without Django's views (runengines): GET /metrics and /stats.
+
+    Runs on the scheduler's own event loop, so it reads the engines between ticks. Needs the bearer token
+    when GAME_METRICS_TOKEN is set, and is open to whoever can reach host otherwise.
+    """
+
+    async def respond(reader, writer):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 5)
+            requestLine, *headerLines = head.decode('latin-1').split('\r\n')
+            method, path = requestLine.split(' ')[:2]
+            headers = {}
+            for line in headerLines:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            path = path.split('?')[0].rstrip('/')
+            if getattr(settings, 'GAME_METRICS_TOKEN', '') and not tokenAuthorized(headers.get('authorization', '')):
+                status, contentType, body = '403 Forbidden', 'text/plain', 'Forbidden'
+            elif method != 'GET':
+                status, contentType, body = '405 Method Not Allowed', 'text/plain', 'Method Not Allowed'
+            elif path == '/metrics':
+                status, contentType, body = '200 OK', 'text/plain; version=0.0.4; charset=utf-8', prometheusText(scheduler)
+            elif path == '/stats':
+                status, contentType, body = '200 OK', 'application/json', json.dumps(scheduler.getStats())
+            else:
+                status, contentType, body = '404 Not Found', 'text/plain', 'Not Found'
+            payload = body.encode()
+            writer.write(
+                f'HTTP/1.1 {status}\r\nContent-Type: {contentType}\r\n'
+                f'Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + payload
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(respond, host, port)
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.14 on 2026-10-18 06:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matches', '0008_privatelobby_privatelobbymember'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MatchReplay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('replayData', models.JSONField()),
+                ('createdAt', models.DateTimeField(auto_now_add=True)),
+                ('match', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='replay', to='matches.match')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='matchparticipation',
+            name='replay',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='participations', to='matches.matchreplay'),
+        ),
+    ]
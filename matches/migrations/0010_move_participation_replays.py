@@ -0,0 +1,28 @@
+from django.db import migrations
+
+def moveReplaysToMatch(apps, schema_editor):
+    MatchParticipation = apps.get_model('matches', 'MatchParticipation')
+    MatchReplay = apps.get_model('matches', 'MatchReplay')
+    withReplay = MatchParticipation.objects.filter(replayData__isnull=False)
+    matchIds = withReplay.values_list('match_id', flat=True).distinct()
+    for matchId in list(matchIds):
+        # Every participation got the same blob; keep one copy per match
+        source = withReplay.filter(match_id=matchId).order_by('id').first()
+        replay = MatchReplay.objects.create(match_id=matchId, replayData=source.replayData)
+        withReplay.filter(match_id=matchId).update(replay=replay, replayData=None)
+
+def copyReplaysToParticipations(apps, schema_editor):
+    MatchParticipation = apps.get_model('matches', 'MatchParticipation')
+    MatchReplay = apps.get_model('matches', 'MatchReplay')
+    for replay in MatchReplay.objects.iterator():
+        MatchParticipation.objects.filter(replay=replay).update(replayData=replay.replayData)
+    MatchReplay.objects.all().delete()
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('matches', '0009_matchreplay'),
+    ]
+
+    operations = [
+        migrations.RunPython(moveReplaysToMatch, copyReplaysToParticipations),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.14 on 2026-10-18 06:38
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matches', '0010_move_participation_replays'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='matchparticipation',
+            name='replayData',
+        ),
+    ]
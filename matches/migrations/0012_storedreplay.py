@@ -0,0 +1,56 @@
+# Generated by Django 5.0.14 on 2026-10-18 06:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matches', '0011_remove_matchparticipation_replaydata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReplayBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('data', models.BinaryField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StoredReplay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('backend', models.CharField(max_length=16)),
+                ('codec', models.CharField(max_length=8)),
+                ('size', models.IntegerField(help_text='Compressed bytes')),
+                ('rawSize', models.IntegerField(help_text='Uncompressed JSON bytes')),
+                ('frameCount', models.IntegerField(default=0)),
+                ('version', models.IntegerField(default=1)),
+                ('createdAt', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='matchreplay',
+            name='replayData',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='matchreplay',
+            name='storedReplay',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='matches.storedreplay'),
+        ),
+        migrations.AddField(
+            model_name='progressiverun',
+            name='storedReplay',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='matches.storedreplay'),
+        ),
+        migrations.AddField(
+            model_name='solorun',
+            name='storedReplay',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='matches.storedreplay'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-18 06:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matches', '0012_storedreplay'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedreplay',
+            name='seekIndex',
+            field=models.JSONField(blank=True, help_text='Keyframe byte offsets and event markers (replay.seekIndex)', null=True),
+        ),
+    ]
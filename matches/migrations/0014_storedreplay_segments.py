@@ -0,0 +1,23 @@
+# Generated by Django 5.0.14 on 2026-10-18 06:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matches', '0013_storedreplay_seekindex'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedreplay',
+            name='complete',
+            field=models.BooleanField(default=True, help_text='False while a match is still streaming segments (or crashed mid-match)'),
+        ),
+        migrations.AddField(
+            model_name='storedreplay',
+            name='segments',
+            field=models.IntegerField(default=0, help_text='Frame segment blobs; 0 when the blob holds the whole replay'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.14 on 2026-10-18 06:56
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matches', '0014_storedreplay_segments'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='progressiverun',
+            name='seed',
+            field=models.BigIntegerField(blank=True, help_text='Server-issued RNG seed the run was played and verified with', null=True),
+        ),
+        migrations.AddField(
+            model_name='solorun',
+            name='seed',
+            field=models.BigIntegerField(blank=True, help_text='Server-issued RNG seed the run was played and verified with', null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='progressiverun',
+            constraint=models.UniqueConstraint(fields=('player', 'seed'), name='unique_progressive_run_seed'),
+        ),
+        migrations.AddConstraint(
+            model_name='solorun',
+            constraint=models.UniqueConstraint(fields=('player', 'seed'), name='unique_solo_run_seed'),
+        ),
+    ]
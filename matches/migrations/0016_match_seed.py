@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-18 06:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matches', '0015_progressiverun_seed_solorun_seed_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='match',
+            name='seed',
+            field=models.BigIntegerField(blank=True, help_text='GameEngine RNG seed; with the ordered inputs it reproduces the match', null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.14 on 2026-10-18 07:38
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matches', '0016_match_seed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SettlementJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('winnerId', models.JSONField(blank=True, help_text="User id, or a bot id like 'bot_280'", null=True)),
+                ('isTie', models.BooleanField(default=False)),
+                ('status', models.CharField(choices=[('PENDING', 'PENDING'), ('DONE', 'DONE'), ('FAILED', 'FAILED')], default='PENDING', max_length=16)),
+                ('attempts', models.IntegerField(default=0)),
+                ('lastError', models.TextField(blank=True, default='')),
+                ('runAfter', models.DateTimeField(default=django.utils.timezone.now, help_text='Not retried before this time')),
+                ('createdAt', models.DateTimeField(auto_now_add=True)),
+                ('updatedAt', models.DateTimeField(auto_now=True)),
+                ('match', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='settlementJob', to='matches.match')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'runAfter'], name='matches_set_status_6e4a4e_idx')],
+            },
+        ),
+    ]
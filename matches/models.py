@@ -1,6 +1,10 @@
 
 from django.db import models
+from django.db.models import Q
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 
 class ReplayView(models.Model):
     user = models.ForeignKey('accounts.Profile', on_delete=models.CASCADE, related_name='replayViews')
@@ -13,6 +17,58 @@ class ReplayView(models.Model):
         unique_together = ('user', 'replay_type', 'replay_id')
 
 
+class StoredReplay(models.Model):
+    """Pointer to a compressed replay blob in a replay store, plus size/frame metadata"""
+    key = models.CharField(max_length=64, unique=True)
+    backend = models.CharField(max_length=16)
+    codec = models.CharField(max_length=8)
+    size = models.IntegerField(help_text="Compressed bytes")
+    rawSize = models.IntegerField(help_text="Uncompressed JSON bytes")
+    frameCount = models.IntegerField(default=0)
+    version = models.IntegerField(default=1)
+    seekIndex = models.JSONField(null=True, blank=True, help_text="Keyframe byte offsets and event markers (replay.seekIndex)")
+    segments = models.IntegerField(default=0, help_text="Frame segment blobs; 0 when the blob holds the whole replay")
+    complete = models.BooleanField(default=True, help_text="False while a match is still streaming segments (or crashed mid-match)")
+    createdAt = models.DateTimeField(auto_now_add=True)
+
+    def load(self):
+        from .replaystore import loadReplay
+        return loadReplay(self)
+
+    @property
+    def etag(self):
+        """Strong validator: finished replays never change, streaming ones change with every segment"""
+        return f'"{self.key}"' if self.complete else f'"{self.key}.{self.segments}"'
+
+    def __str__(self):
+        return f"StoredReplay({self.key}, {self.backend}/{self.codec}, {self.size}B)"
+
+
+class ReplayBlob(models.Model):
+    """Compressed replay bytes for the 'database' replay store"""
+    key = models.CharField(max_length=64, unique=True)
+    data = models.BinaryField()
+
+
+class ReplayHolder(models.Model):
+    """Row that owns a replay: a StoredReplay blob, or inline replayData not yet migrated"""
+    storedReplay = models.OneToOneField('matches.StoredReplay', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    class Meta:
+        abstract = True
+
+    def getReplayData(self):
+        """Replay with frames; input-log replays are re-simulated here"""
+        from .replaystore import loadMaterialized
+        if self.storedReplay_id:
+            return loadMaterialized(self.storedReplay)
+        return self.replayData
+
+
+# Filter for ReplayHolder rows that have a replay in either place
+HAS_REPLAY = Q(storedReplay__isnull=False) | Q(replayData__isnull=False)
+
+
 class MatchType(models.Model):
     name = models.CharField(max_length=50, unique=True)
     description = models.TextField()
@@ -48,11 +104,22 @@ class Match(models.Model):
     completedAt = models.DateTimeField(null=True, blank=True)
     createdAt = models.DateTimeField(auto_now_add=True)
     isSoloMode = models.BooleanField(default=False)
+    seed = models.BigIntegerField(null=True, blank=True, help_text="GameEngine RNG seed; with the ordered inputs it reproduces the match")
 
     def __str__(self):
         return f"Match({self.id})"
 
 
+class MatchReplay(ReplayHolder):
+    """One replay per multiplayer match, shared by every participation in it"""
+    match = models.OneToOneField('matches.Match', on_delete=models.CASCADE, related_name='replay')
+    replayData = models.JSONField(null=True, blank=True)
+    createdAt = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"MatchReplay({self.match_id})"
+
+
 class MatchParticipation(models.Model):
     match = models.ForeignKey('matches.Match', on_delete=models.CASCADE, related_name='participants')
     player = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name='matchParticipations', null=True, blank=True)
@@ -66,7 +133,7 @@ class MatchParticipation(models.Model):
     isBot = models.BooleanField(default=False, help_text="Is this a bot player")
     joinedAt = models.DateTimeField(auto_now_add=True)
     eliminatedAt = models.DateTimeField(null=True, blank=True)
-    replayData = models.JSONField(null=True, blank=True)
+    replay = models.ForeignKey('matches.MatchReplay', on_delete=models.SET_NULL, null=True, blank=True, related_name='participations')
     isPublic = models.BooleanField(default=True)
 
     class Meta:
@@ -79,6 +146,25 @@ class MatchParticipation(models.Model):
         return f"MatchParticipation({self.match_id}, {player_id})"
 
 
+class SettlementJob(models.Model):
+    """Queued game-over settlement for a match (at most one per match), run by settlement.runDueSettlements"""
+    match = models.OneToOneField('matches.Match', on_delete=models.CASCADE, related_name='settlementJob')
+    winnerId = models.JSONField(null=True, blank=True, help_text="User id, or a bot id like 'bot_280'")
+    isTie = models.BooleanField(default=False)
+    status = models.CharField(max_length=16, default='PENDING', choices=[('PENDING','PENDING'),('DONE','DONE'),('FAILED','FAILED')])
+    attempts = models.IntegerField(default=0)
+    lastError = models.TextField(blank=True, default='')
+    runAfter = models.DateTimeField(default=timezone.now, help_text="Not retried before this time")
+    createdAt = models.DateTimeField(auto_now_add=True)
+    updatedAt = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'runAfter'])]
+
+    def __str__(self):
+        return f"SettlementJob({self.match_id}, {self.status})"
+
+
 class GameState(models.Model):
     match = models.ForeignKey('matches.Match', on_delete=models.CASCADE, related_name='gameStates')
     tickNumber = models.IntegerField()
@@ -95,7 +181,7 @@ class GameState(models.Model):
         return f"GameState(match={self.match_id}, tick={self.tickNumber})"
 
 
-class SoloRun(models.Model):
+class SoloRun(ReplayHolder):
     player = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name='soloRuns')
     wallsSurvived = models.IntegerField(default=0)
     wallsHit = models.IntegerField(default=0)
@@ -105,15 +191,21 @@ class SoloRun(models.Model):
     survivalTime = models.IntegerField()
     finalGridState = models.JSONField(null=True, blank=True)
     replayData = models.JSONField(null=True, blank=True)
+    seed = models.BigIntegerField(null=True, blank=True, help_text="Server-issued RNG seed the run was played and verified with")
     isPublic = models.BooleanField(default=True)
     startedAt = models.DateTimeField(auto_now_add=True)
     endedAt = models.DateTimeField(null=True, blank=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['player', 'seed'], name='unique_solo_run_seed'),
+        ]
+
     def __str__(self):
         return f"SoloRun({self.player_id}, {self.startedAt})"
 
 
-class ProgressiveRun(models.Model):
+class ProgressiveRun(ReplayHolder):
     player = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name='progressiveRuns')
     level = models.IntegerField()
     botsEliminated = models.IntegerField(default=0)
@@ -123,10 +215,16 @@ class ProgressiveRun(models.Model):
     coinsEarned = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     finalGridState = models.JSONField(null=True, blank=True)
     replayData = models.JSONField(null=True, blank=True)
+    seed = models.BigIntegerField(null=True, blank=True, help_text="Server-issued RNG seed the run was played and verified with")
     isPublic = models.BooleanField(default=True)
     startedAt = models.DateTimeField(auto_now_add=True)
     endedAt = models.DateTimeField(null=True, blank=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['player', 'seed'], name='unique_progressive_run_seed'),
+        ]
+
 
 class PrivateLobby(models.Model):
     """Private match lobbies created by players with shareable codes"""
@@ -166,4 +264,20 @@ class PrivateLobbyMember(models.Model):
     def __str__(self):
         return f"{self.lobby.code} - {self.user.username}"
     def __str__(self):
-        return f"ProgressiveRun({self.player_id}, Level {self.level})"
\ No newline at end of file
+        return f"ProgressiveRun({self.player_id}, Level {self.level})"
+
+@receiver(post_delete, sender=SoloRun)
+@receiver(post_delete, sender=ProgressiveRun)
+@receiver(post_delete, sender=MatchReplay)
+def deleteStoredReplay(sender, instance, **kwargs):
+    if instance.storedReplay_id:
+        StoredReplay.objects.filter(id=instance.storedReplay_id).delete()
+
+
+@receiver(post_delete, sender=StoredReplay)
+def deleteReplayBlob(sender, instance, **kwargs):
+    from .replaystore import getReplayStore, segmentKey
+    store = getReplayStore(instance.backend)
+    store.delete(instance.key)
+    for segment in range(instance.segments):
+        store.delete(segmentKey(instance.key, segment))
@@ -0,0 +1,223 @@
+import asyncio
+import threading
+import time
+from channels.layers import get_channel_layer
+from django.conf import settings
+from .gamelog import logger
+
+# redis is optional; without it only the in-process registry is available
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# How long a consumer trusts a looked-up owner before asking the registry again
+OWNER_CACHE_SECONDS = 1.0
+
+
+class OwnershipRegistry:
+    """Which worker runs each match: one lease per match, held until released or expired"""
+    name = None
+
+    def acquire(self, matchId, owner, seconds):
+        """True if owner holds the lease for the next seconds (newly taken, or its own and extended)"""
+        raise NotImplementedError
+
+    def release(self, matchId, owner):
+        """Drop the lease if owner still holds it"""
+        raise NotImplementedError
+
+    def owner(self, matchId):
+        """Current lease holder, or None"""
+        raise NotImplementedError
+
+
+class RedisOwnershipRegistry(OwnershipRegistry):
+    """Leases as Redis keys with a TTL, taken and extended atomically by Lua scripts"""
+    name = 'redis'
+
+    ACQUIRE = """
+    local current = redis.call('GET', KEYS[1])
+    if current == false or current == ARGV[1] then
+        redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+        return 1
+    end
+    return 0
+    """
+    RELEASE = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+
+    def __init__(self, url, prefix='dash:owner'):
+        if redis is None:
+            raise RuntimeError('The redis ownership registry needs the redis package')
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.acquireScript = self.client.register_script(self.ACQUIRE)
+        self.releaseScript = self.client.register_script(self.RELEASE)
+
+    def key(self, matchId):
+        return f'{self.prefix}:{matchId}'
+
+    def acquire(self, matchId, owner, seconds):
+        return bool(self.acquireScript(keys=[self.key(matchId)], args=[owner, int(seconds * 1000)]))
+
+    def release(self, matchId, owner):
+        self.releaseScript(keys=[self.key(matchId)], args=[owner])
+
+    def owner(self, matchId):
+        owner = self.client.get(self.key(matchId))
+        return owner.decode() if owner is not None else None
+
+
+class LocalOwnershipRegistry(OwnershipRegistry):
+    """In-process stand-in for a single worker and for tests: the leases are only seen by this process"""
+    name = 'local'
+
+    def __init__(self):
+        self.leases = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, matchId, owner, seconds):
+        now = time.monotonic()
+        with self.lock:
+            current = self.leases.get(matchId)
+            if current is None or current[0] == owner or current[1] <= now:
+                self.leases[matchId] = (owner, now + seconds)
+                return True
+            return False
+
+    def release(self, matchId, owner):
+        with self.lock:
+            current = self.leases.get(matchId)
+            if current is not None and current[0] == owner:
+                del self.leases[matchId]
+
+    def owner(self, matchId):
+        with self.lock:
+            current = self.leases.get(matchId)
+            if current is None or current[1] <= time.monotonic():
+                return None
+            return current[0]
+
+
+BACKENDS = {
+    RedisOwnershipRegistry.name: RedisOwnershipRegistry,
+    LocalOwnershipRegistry.name: LocalOwnershipRegistry,
+}
+
+_registries = {}
+
+
+def getOwnershipRegistry(name=None):
+    """Configured registry instance for a backend name (GAME_OWNERSHIP_BACKEND by default)"""
+    name = name or getattr(settings, 'GAME_OWNERSHIP_BACKEND', 'local')
+    if name not in _registries:
+        if name not in BACKENDS:
+            raise ValueError(f'Unknown ownership registry backend: {name}')
+        options = getattr(settings, 'GAME_OWNERSHIP_OPTIONS', {}).get(name, {})
+        _registries[name] = BACKENDS[name](**options)
+    return _registries[name]
+
+
+class MatchOwnership:
+    """This worker's side of the registry.
+
+    The worker is known by a channel of its own (its owner id in the registry): consumers on
+    other workers send it the inputs, joins and resync requests of matches it owns, and
+    consumers.handleRelayed applies them to the engine. Held leases are renewed every third
+    of GAME_OWNERSHIP_LEASE_SECONDS; a lease found taken over stops the engine here
+    (consumers.ownershipLost) so a match never runs on two workers.
+    """
+
+    def __init__(self):
+        self.channelName = None
+        self.hosted = set()
+        self.owners = {}
+        self.receiver = None
+        self.renewer = None
+        self.loop = None
+
+    @property
+    def leaseSeconds(self):
+        return getattr(settings, 'GAME_OWNERSHIP_LEASE_SECONDS', 10)
+
+    async def ensure(self):
+        """Open this worker's channel and start the receive and renew loops (once per event loop)"""
+        layer = get_channel_layer()
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self.receiver = self.renewer = None
+        if self.channelName is None:
+            self.channelName = await layer.new_channel()
+        if self.receiver is None or self.receiver.done():
+            self.receiver = asyncio.create_task(self.receive(layer))
+        if self.renewer is None or self.renewer.done():
+            self.renewer = asyncio.create_task(self.renew())
+
+    async def acquire(self, matchId):
+        """True if this worker now owns the match"""
+        await self.ensure()
+        registry = getOwnershipRegistry()
+        if await asyncio.to_thread(registry.acquire, matchId, self.channelName, self.leaseSeconds):
+            self.hosted.add(matchId)
+            return True
+        return False
+
+    async def release(self, matchId):
+        self.hosted.discard(matchId)
+        if self.channelName is not None:
+            await asyncio.to_thread(getOwnershipRegistry().release, matchId, self.channelName)
+
+    async def ownerOf(self, matchId):
+        """Owner channel of a match (cached for OWNER_CACHE_SECONDS), or None"""
+        cached = self.owners.get(matchId)
+        if cached is not None and time.monotonic() - cached[1] < OWNER_CACHE_SECONDS:
+            return cached[0]
+        owner = await asyncio.to_thread(getOwnershipRegistry().owner, matchId)
+        if owner is None:
+            self.owners.pop(matchId, None)
+        else:
+            self.owners[matchId] = (owner, time.monotonic())
+        return owner
+
+    async def forward(self, matchId, message):
+        """Send a message to the worker that owns the match; False if nobody does"""
+        owner = await self.ownerOf(matchId)
+        if owner is None:
+            return False
+        await get_channel_layer().send(owner, {**message, 'matchId': matchId})
+        return True
+
+    async def receive(self, layer):
+        from .consumers import handleRelayed
+        while True:
+            message = await layer.receive(self.channelName)
+            try:
+                await handleRelayed(message)
+            except Exception as e:
+                logger.error('[MatchOwnership] Error handling %s: %s', message.get('type'), e, exc_info=True)
+
+    async def renew(self):
+        from .consumers import ownershipLost
+        registry = getOwnershipRegistry()
+        while True:
+            await asyncio.sleep(self.leaseSeconds / 3)
+            for matchId in list(self.hosted):
+                try:
+                    held = await asyncio.to_thread(registry.acquire, matchId, self.channelName, self.leaseSeconds)
+                except Exception as e:
+                    # Keep running; the lease outlives a few missed renewals
+                    logger.error('[MatchOwnership] Failed to renew lease for match %s: %s', matchId, e)
+                    continue
+                if not held and matchId in self.hosted:
+                    self.hosted.discard(matchId)
+                    await ownershipLost(matchId)
+
+
+# One per worker process
+OWNERSHIP = MatchOwnership()
@@ -0,0 +1,358 @@
+import struct
+
+# Player fields clients need; internal fields like botDirectionChangeCounter never leave the server
+STATIC_PLAYER_FIELDS = ('username', 'playerColor', 'isBot')
+DYNAMIC_PLAYER_FIELDS = ('x', 'y', 'direction', 'alive', 'score', 'hits')
+
+
+class DeltaEncoder:
+    """Turns successive engine states into keyframe/delta gameState messages.
+
+    Every message carries a sequence number. A keyframe holds the full public state;
+    a delta holds only what changed since the previous message (moved players,
+    score/hit/alive changes, new walls, countdown walls added/ticked/converted).
+    The encoder keeps the last state it sent as a baseline, so a client that missed
+    a message can be resynced with a keyframe of exactly that baseline.
+    """
+
+    def __init__(self, keyframeInterval=50):
+        self.keyframeInterval = keyframeInterval
+        self.seq = 0
+        self.tick = 0
+        self.gridSize = 0
+        self.players = {}
+        self.walls = []
+        self.countdownWalls = {}
+        self.aliveCount = 0
+
+    def encode(self, engine):
+        """Next broadcast message for the engine's current state"""
+        if self.seq == 0 or self.seq % self.keyframeInterval == 0:
+            self.seq += 1
+            self.capture(engine)
+            return self.keyframe()
+
+        self.seq += 1
+        delta = {'type': 'delta', 'seq': self.seq, 'tick': engine.tickNumber}
+
+        players = {}
+        seen = set()
+        for userId, player in engine.players.items():
+            key = str(userId)
+            seen.add(key)
+            sent = self.players.get(key)
+            if sent is None:
+                sent = self.players[key] = {field: player[field] for field in STATIC_PLAYER_FIELDS + DYNAMIC_PLAYER_FIELDS}
+                players[key] = dict(sent)
+                continue
+            changes = {}
+            for field in DYNAMIC_PLAYER_FIELDS:
+                if player[field] != sent[field]:
+                    changes[field] = sent[field] = player[field]
+            if changes:
+                players[key] = changes
+        removed = [key for key in self.players if key not in seen]
+        for key in removed:
+            del self.players[key]
+        if players:
+            delta['players'] = players
+        if removed:
+            delta['removedPlayers'] = removed
+
+        # Walls only ever get appended, so the new ones are the tail past what was sent
+        if len(engine.walls) > len(self.walls):
+            newWalls = [[w['x'], w['y']] for w in engine.walls[len(self.walls):]]
+            self.walls.extend({'x': x, 'y': y} for x, y in newWalls)
+            delta['walls'] = newWalls
+
+        countdown = self.diffCountdownWalls(engine.countdownWalls)
+        if countdown:
+            delta['countdown'] = countdown
+
+        aliveCount = sum(1 for p in engine.players.values() if p['alive'])
+        if aliveCount != self.aliveCount:
+            self.aliveCount = delta['aliveCount'] = aliveCount
+
+        self.tick = engine.tickNumber
+        return delta
+
+    def diffCountdownWalls(self, countdownWalls):
+        current = {(w['x'], w['y']): w['secondsLeft'] for w in countdownWalls}
+        added, changed = [], []
+        for cell, secondsLeft in current.items():
+            sent = self.countdownWalls.get(cell)
+            if sent is None:
+                added.append([cell[0], cell[1], secondsLeft])
+            elif sent != secondsLeft:
+                changed.append([cell[0], cell[1], secondsLeft])
+        removed = [[x, y] for (x, y) in self.countdownWalls if (x, y) not in current]
+        self.countdownWalls = current
+
+        diff = {}
+        if added:
+            diff['add'] = added
+        if changed:
+            diff['set'] = changed
+        if removed:
+            diff['remove'] = removed
+        return diff
+
+    def capture(self, engine):
+        """Make the engine's current public state the new baseline"""
+        self.tick = engine.tickNumber
+        self.gridSize = engine.gridSize
+        self.players = {
+            str(userId): {field: player[field] for field in STATIC_PLAYER_FIELDS + DYNAMIC_PLAYER_FIELDS}
+            for userId, player in engine.players.items()
+        }
+        self.walls = [{'x': w['x'], 'y': w['y']} for w in engine.walls]
+        self.countdownWalls = {(w['x'], w['y']): w['secondsLeft'] for w in engine.countdownWalls}
+        self.aliveCount = sum(1 for p in engine.players.values() if p['alive'])
+
+    def restore(self, keyframe):
+        """Continue from another encoder's keyframe(): same baseline and sequence (engine snapshots)"""
+        self.seq = keyframe['seq']
+        self.tick = keyframe['tick']
+        self.gridSize = keyframe['gridSize']
+        self.players = {key: dict(player) for key, player in keyframe['players'].items()}
+        self.walls = [{'x': w['x'], 'y': w['y']} for w in keyframe['walls']]
+        self.countdownWalls = {(w['x'], w['y']): w['secondsLeft'] for w in keyframe['countdownWalls']}
+        self.aliveCount = keyframe['aliveCount']
+
+    def keyframe(self):
+        """Full public state as of the last message sent (used for resyncs too)"""
+        return {
+            'type': 'keyframe',
+            'seq': self.seq,
+            'tick': self.tick,
+            'gridSize': self.gridSize,
+            'players': {key: dict(player) for key, player in self.players.items()},
+            'walls': list(self.walls),
+            'countdownWalls': [
+                {'x': x, 'y': y, 'secondsLeft': secondsLeft}
+                for (x, y), secondsLeft in self.countdownWalls.items()
+            ],
+            'aliveCount': self.aliveCount,
+        }
+
+
+# Binary gameState frames (negotiated per socket via the WebSocket subprotocol)
+BINARY_SUBPROTOCOL = 'dash.bin.v1'
+JSON_SUBPROTOCOL = 'dash.json.v1'
+
+FRAME_KEYFRAME = 1
+FRAME_DELTA = 2
+
+DIRECTIONS = ['UP', 'DOWN', 'LEFT', 'RIGHT']
+DIRECTION_CODES = {direction: code for code, direction in enumerate(DIRECTIONS)}
+
+# Delta section flags
+SECTION_ROSTER = 1
+SECTION_PLAYERS = 2
+SECTION_REMOVED = 4
+SECTION_WALLS = 8
+SECTION_COUNTDOWN = 16
+SECTION_ALIVE_COUNT = 32
+
+# Player record fields in wire order with their struct codes (delta records carry a mask of which follow)
+PLAYER_RECORD = (('x', 'B'), ('y', 'B'), ('direction', 'B'), ('alive', '?'), ('score', 'i'), ('hits', 'H'))
+
+
+class BinaryPacker:
+    """Packs DeltaEncoder messages into compact little-endian binary frames.
+
+    Players get a one-byte slot the first time they are seen; their id, username,
+    colour and bot flag go out once in the roster section (again in every keyframe
+    so a resynced client can rebuild it), and every other record refers to the slot.
+    Walls and countdown walls are packed coordinate arrays. Coordinates are one byte,
+    so boards larger than 255 cells per side can't be packed; once any frame fails to
+    pack, pack returns None from then on and clients get JSON for the rest of the match
+    (a binary delta after a JSON one could refer to slots the client never saw).
+    """
+
+    def __init__(self):
+        self.slots = {}
+        self.failed = False
+
+    def slotFor(self, key):
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = self.slots[key] = len(self.slots)
+        return slot
+
+    def pack(self, message):
+        """Binary frame for a keyframe/delta message, or None if it can't be packed"""
+        if self.failed:
+            return None
+        try:
+            if message.get('type') == 'keyframe':
+                return self.packKeyframe(message)
+            if message.get('type') == 'delta':
+                return self.packDelta(message)
+        except (struct.error, OverflowError, ValueError):
+            self.failed = True
+        return None
+
+    def packKeyframe(self, message):
+        if message['gridSize'] > 255:
+            raise ValueError('Board too large for one-byte coordinates')
+        parts = [struct.pack('<BIIHH', FRAME_KEYFRAME, message['seq'], message['tick'], message['gridSize'], message['aliveCount'])]
+        players = message['players']
+        parts.append(struct.pack('<B', len(players)))
+        for key, player in players.items():
+            parts.append(self.packRosterEntry(key, player))
+            parts.append(self.packPlayerRecord(self.slots[key], player, full=True))
+        self.packWalls(parts, [(w['x'], w['y']) for w in message['walls']])
+        countdownWalls = message['countdownWalls']
+        parts.append(struct.pack('<H', len(countdownWalls)))
+        parts.extend(struct.pack('<BBB', w['x'], w['y'], w['secondsLeft']) for w in countdownWalls)
+        return b''.join(parts)
+
+    def packDelta(self, message):
+        players = message.get('players', {})
+        newPlayers = [key for key, player in players.items() if 'username' in player]
+        countdown = message.get('countdown')
+
+        flags = 0
+        if newPlayers:
+            flags |= SECTION_ROSTER
+        if players:
+            flags |= SECTION_PLAYERS
+        if message.get('removedPlayers'):
+            flags |= SECTION_REMOVED
+        if message.get('walls'):
+            flags |= SECTION_WALLS
+        if countdown:
+            flags |= SECTION_COUNTDOWN
+        if 'aliveCount' in message:
+            flags |= SECTION_ALIVE_COUNT
+
+        parts = [struct.pack('<BIIB', FRAME_DELTA, message['seq'], message['tick'], flags)]
+        if newPlayers:
+            parts.append(struct.pack('<B', len(newPlayers)))
+            parts.extend(self.packRosterEntry(key, players[key]) for key in newPlayers)
+        if players:
+            parts.append(struct.pack('<B', len(players)))
+            parts.extend(self.packPlayerRecord(self.slotFor(key), changes) for key, changes in players.items())
+        if flags & SECTION_REMOVED:
+            removed = message['removedPlayers']
+            parts.append(struct.pack('<B', len(removed)))
+            parts.extend(struct.pack('<B', self.slotFor(key)) for key in removed)
+        if flags & SECTION_WALLS:
+            self.packWalls(parts, message['walls'])
+        if countdown:
+            for section, width in (('add', 3), ('set', 3), ('remove', 2)):
+                cells = countdown.get(section, [])
+                parts.append(struct.pack('<H', len(cells)))
+                parts.extend(struct.pack('<' + 'B' * width, *cell) for cell in cells)
+        if flags & SECTION_ALIVE_COUNT:
+            parts.append(struct.pack('<H', message['aliveCount']))
+        return b''.join(parts)
+
+    def packRosterEntry(self, key, player):
+        fields = [key.encode(), (player['username'] or '').encode(), (player['playerColor'] or '').encode()]
+        parts = [struct.pack('<B?', self.slotFor(key), bool(player.get('isBot')))]
+        for field in fields:
+            parts.append(struct.pack('<H', len(field)))
+            parts.append(field)
+        return b''.join(parts)
+
+    def packPlayerRecord(self, slot, player, full=False):
+        mask = 0
+        codes = '<BB'
+        values = []
+        for bit, (field, code) in enumerate(PLAYER_RECORD):
+            if full or field in player:
+                mask |= 1 << bit
+                codes += code
+                value = player[field]
+                values.append(DIRECTION_CODES.get(value, 0) if field == 'direction' else value)
+        return struct.pack(codes, slot, mask, *values)
+
+    def packWalls(self, parts, walls):
+        parts.append(struct.pack('<H', len(walls)))
+        parts.append(bytes(coordinate for wall in walls for coordinate in wall))
+
+
+class BinaryUnpacker:
+    """Inverse of BinaryPacker, like the match page's decodeBinaryFrame: rebuilds the keyframe/delta message.
+
+    Keeps the slot table the roster sections fill in, so one unpacker reads one socket's frames in order.
+    """
+
+    def __init__(self):
+        self.slots = {}
+
+    def unpack(self, frame):
+        reader = FrameReader(frame)
+        frameType, seq, tick = reader.read('<BII')
+        message = {'seq': seq, 'tick': tick}
+        if frameType == FRAME_KEYFRAME:
+            message['type'] = 'keyframe'
+            message['gridSize'], message['aliveCount'] = reader.read('<HH')
+            players = message['players'] = {}
+            for _ in range(reader.read('<B')[0]):
+                key, player = self.unpackRosterEntry(reader)
+                players[key] = player
+                self.unpackPlayerRecord(reader, players)
+            message['walls'] = [{'x': x, 'y': y} for x, y in reader.cells(2)]
+            message['countdownWalls'] = [{'x': x, 'y': y, 'secondsLeft': s} for x, y, s in reader.cells(3)]
+            return message
+
+        message['type'] = 'delta'
+        flags, = reader.read('<B')
+        players = {}
+        if flags & SECTION_ROSTER:
+            for _ in range(reader.read('<B')[0]):
+                key, player = self.unpackRosterEntry(reader)
+                players[key] = player
+        if flags & SECTION_PLAYERS:
+            for _ in range(reader.read('<B')[0]):
+                self.unpackPlayerRecord(reader, players)
+            message['players'] = players
+        if flags & SECTION_REMOVED:
+            message['removedPlayers'] = [self.slots[reader.read('<B')[0]] for _ in range(reader.read('<B')[0])]
+        if flags & SECTION_WALLS:
+            message['walls'] = reader.cells(2)
+        if flags & SECTION_COUNTDOWN:
+            message['countdown'] = {'add': reader.cells(3), 'set': reader.cells(3), 'remove': reader.cells(2)}
+        if flags & SECTION_ALIVE_COUNT:
+            message['aliveCount'], = reader.read('<H')
+        return message
+
+    def unpackRosterEntry(self, reader):
+        slot, isBot = reader.read('<B?')
+        key, username, playerColor = reader.text(), reader.text(), reader.text()
+        self.slots[slot] = key
+        return key, {'username': username, 'playerColor': playerColor, 'isBot': isBot}
+
+    def unpackPlayerRecord(self, reader, into):
+        slot, mask = reader.read('<BB')
+        record = into.setdefault(self.slots[slot], {})
+        for bit, (field, code) in enumerate(PLAYER_RECORD):
+            if mask & (1 << bit):
+                value, = reader.read('<' + code)
+                record[field] = DIRECTIONS[value] if field == 'direction' else value
+
+
+class FrameReader:
+    """Sequential little-endian reads from a binary frame"""
+
+    def __init__(self, frame):
+        self.frame = frame
+        self.offset = 0
+
+    def read(self, codes):
+        values = struct.unpack_from(codes, self.frame, self.offset)
+        self.offset += struct.calcsize(codes)
+        return values
+
+    def text(self):
+        length, = self.read('<H')
+        value = self.frame[self.offset:self.offset + length].decode()
+        self.offset += length
+        return value
+
+    def cells(self, width):
+        count, = self.read('<H')
+        return [list(self.read('<' + 'B' * width)) for _ in range(count)]
@@ -0,0 +1,425 @@
+import json
+import math
+from .protocol import DeltaEncoder, STATIC_PLAYER_FIELDS, DIRECTIONS, DIRECTION_CODES
+from .simulation import INPUT_REPLAY_FORMAT
+
+# Replay formats: v1 = {'frames': [full state per tick]}, v2 = header + keyframes + per-tick deltas
+REPLAY_VERSION = 2
+
+# Seek index spacing for v1 replays, whose frames can all be played from
+V1_SEEK_INTERVAL = 100
+
+
+def playerRow(player):
+    """Dynamic player state as a compact row: [x, y, direction code, alive, score, hits]"""
+    return [
+        player['x'],
+        player['y'],
+        DIRECTION_CODES.get(player['direction'], 0),
+        1 if player['alive'] else 0,
+        player['score'],
+        player['hits'],
+    ]
+
+
+class ReplayRecorder:
+    """Records an engine's ticks as a v2 replay.
+
+    Player names, colours and bot flags go in the header once. Walls only ever get
+    appended, so the header also holds every wall in order of appearance and frames
+    just carry the wall count ('wc'). Every keyframeInterval frames is a keyframe
+    ('k') with all player rows and countdown walls; the frames in between only hold
+    changed player rows ('p'), removed players ('r'), the new wall count and
+    countdown wall changes ('c'). Diffing is done by a DeltaEncoder of its own.
+
+    With streamTo(), frames are handed to a segment writer every segmentFrames frames
+    instead of piling up, so memory stays flat however long the match runs.
+    """
+
+    def __init__(self, keyframeInterval=100, seed=None):
+        self.keyframeInterval = keyframeInterval
+        self.seed = seed
+        self.encoder = DeltaEncoder(keyframeInterval)
+        self.players = {}
+        self.walls = []
+        self.frames = []
+        self.flushedFrames = 0
+        self.gridSize = 0
+        self.segments = None
+        self.segmentFrames = 0
+
+    @property
+    def frameCount(self):
+        return self.flushedFrames + len(self.frames)
+
+    def streamTo(self, segments, segmentFrames):
+        """Flush frames to segments (a replaystore.SegmentedReplay) every segmentFrames frames"""
+        self.segments = segments
+        # Segments start on a keyframe so each one decodes on its own
+        self.segmentFrames = max(1, -(-segmentFrames // self.keyframeInterval)) * self.keyframeInterval
+
+    def record(self, engine):
+        message = self.encoder.encode(engine)
+        self.gridSize = engine.gridSize
+        for key, player in message.get('players', {}).items():
+            if key not in self.players and 'username' in player:
+                self.players[key] = {field: player[field] for field in STATIC_PLAYER_FIELDS}
+
+        # Every wall the encoder has sent is in its baseline, in order
+        wallCount = len(self.encoder.walls)
+        for wall in self.encoder.walls[len(self.walls):]:
+            self.walls.append([wall['x'], wall['y']])
+
+        baseline = self.encoder.players
+        if message['type'] == 'keyframe':
+            frame = {
+                'k': 1,
+                'p': {key: playerRow(player) for key, player in baseline.items()},
+                'wc': wallCount,
+                'c': [[w['x'], w['y'], w['secondsLeft']] for w in message['countdownWalls']],
+            }
+        else:
+            frame = {}
+            if 'players' in message:
+                frame['p'] = {key: playerRow(baseline[key]) for key in message['players']}
+            if 'removedPlayers' in message:
+                frame['r'] = message['removedPlayers']
+            if 'walls' in message:
+                frame['wc'] = wallCount
+            if 'countdown' in message:
+                frame['c'] = message['countdown']
+        self.frames.append(frame)
+        if self.segments is not None and len(self.frames) >= self.segmentFrames:
+            self.flush(engine.measuredFrameDuration())
+
+    def header(self, frameDuration, mode='multiplayer'):
+        """Everything but the frames. Players and walls are copied: segment writers read them off-thread"""
+        return {
+            'version': REPLAY_VERSION,
+            'mode': mode,
+            'frameDuration': frameDuration,
+            'frameCount': self.frameCount,
+            'keyframeInterval': self.keyframeInterval,
+            'gridSize': self.gridSize,
+            'seed': self.seed,
+            'players': dict(self.players),
+            'walls': list(self.walls),
+        }
+
+    def build(self, frameDuration, mode='multiplayer'):
+        """replayData dict for storage"""
+        replayData = self.header(frameDuration, mode)
+        replayData['frames'] = self.frames
+        return replayData
+
+    def flush(self, frameDuration, final=False):
+        """Hand the buffered frames to the segment writer; returns its future"""
+        header = self.header(frameDuration)
+        frames, self.frames = self.frames, []
+        self.flushedFrames += len(frames)
+        return self.segments.submit(header, frames, final)
+
+
+class InputLog:
+    """Records a match as its seed, roster and inputs instead of frames.
+
+    Everything that changes an engine between ticks is an event stamped with the
+    tickNumber it was applied at: joins ('j'), leaves ('l'), direction changes ('d'),
+    countdown wall steps ('c') and wall spawns ('s'). Players that joined before
+    anything else happened are the roster. Bots and collisions are left out: they
+    follow from the seed, so replayMatch() re-runs the engine to get the frames back.
+    """
+
+    def __init__(self):
+        self.roster = []
+        self.events = []
+
+    def join(self, tick, userId, username, playerColor, isBot):
+        entry = [userId, username, playerColor, 1 if isBot else 0]
+        if tick == 0 and not self.events:
+            self.roster.append(entry)
+        else:
+            self.events.append([tick, 'j'] + entry)
+
+    def leave(self, tick, userId):
+        self.events.append([tick, 'l', userId])
+
+    def direction(self, tick, userId, direction):
+        self.events.append([tick, 'd', userId, DIRECTION_CODES[direction]])
+
+    def countdown(self, tick):
+        self.events.append([tick, 'c'])
+
+    def spawn(self, tick):
+        self.events.append([tick, 's'])
+
+    def build(self, engine, frameDuration):
+        """replayData dict for storage"""
+        return {
+            'version': REPLAY_VERSION,
+            'format': INPUT_REPLAY_FORMAT,
+            'mode': 'multiplayer',
+            'matchId': engine.matchId,
+            'seed': engine.seed,
+            'gridSize': engine.gridSize,
+            'speed': engine.speed,
+            'wallSpawnInterval': engine.wallSpawnInterval,
+            'bots': [engine.botDifficulty, engine.botReactionSpeed, engine.botRandomness],
+            'keyframeInterval': engine.replay.keyframeInterval,
+            'frameDuration': frameDuration,
+            'frameCount': engine.tickNumber,
+            'ticks': engine.tickNumber,
+            'roster': self.roster,
+            'events': self.events,
+        }
+
+
+def replayMatch(replayData):
+    """Re-simulate an input-log match replay into a v2 replay with frames"""
+    from .consumers import GameEngine
+    engine = GameEngine(
+        replayData.get('matchId'),
+        replayData['gridSize'],
+        replayData['speed'],
+        replayData['wallSpawnInterval'],
+        seed=replayData['seed'],
+        replayFormat='frames',
+        botSettings=replayData['bots'],
+    )
+    engine.replay = ReplayRecorder(replayData['keyframeInterval'], engine.seed)
+    for userId, username, playerColor, isBot in replayData['roster']:
+        engine.addPlayer(userId, username, playerColor, bool(isBot))
+
+    events = replayData['events']
+    nextEvent = 0
+    for tick in range(replayData['ticks']):
+        # Events were applied between ticks, in the order they are logged
+        while nextEvent < len(events) and events[nextEvent][0] <= tick:
+            applyEvent(engine, events[nextEvent])
+            nextEvent += 1
+        engine.tick()
+    return engine.replay.build(replayData['frameDuration'])
+
+
+def applyEvent(engine, event):
+    kind = event[1]
+    if kind == 'd':
+        engine.updateDirection(event[2], DIRECTIONS[event[3]])
+    elif kind == 'c':
+        engine.updateCountdownWalls()
+    elif kind == 's':
+        engine.spawnWall()
+    elif kind == 'j':
+        engine.addPlayer(event[2], event[3], event[4], bool(event[5]))
+    elif kind == 'l':
+        engine.removePlayer(event[2])
+
+
+def expandFrames(replayData):
+    """Yield v1-style full frames for a replay in either format"""
+    if not replayData:
+        return
+    if replayData.get('version', 1) < 2:
+        yield from replayData.get('frames', [])
+        return
+
+    gridSize = replayData['gridSize']
+    header = replayData['players']
+    allWalls = [{'x': x, 'y': y} for x, y in replayData['walls']]
+    players = {}
+    wallCount = 0
+    countdown = {}
+
+    for frame in replayData['frames']:
+        if frame.get('k'):
+            players = {}
+            countdown = {}
+        for key, row in frame.get('p', {}).items():
+            players[key] = row
+        for key in frame.get('r', []):
+            players.pop(key, None)
+        wallCount = frame.get('wc', wallCount)
+        changes = frame.get('c')
+        if isinstance(changes, list):
+            countdown = {(x, y): secondsLeft for x, y, secondsLeft in changes}
+        elif changes:
+            for x, y in changes.get('remove', []):
+                countdown.pop((x, y), None)
+            for x, y, secondsLeft in changes.get('add', []) + changes.get('set', []):
+                countdown[(x, y)] = secondsLeft
+
+        yield {
+            'gridSize': gridSize,
+            'players': {
+                key: {
+                    'x': row[0],
+                    'y': row[1],
+                    'direction': DIRECTIONS[row[2]],
+                    'alive': bool(row[3]),
+                    'score': row[4],
+                    'hits': row[5],
+                    'username': header.get(key, {}).get('username', 'Unknown'),
+                    'playerColor': header.get(key, {}).get('playerColor', '#ffffff'),
+                }
+                for key, row in players.items()
+            },
+            'walls': allWalls[:wallCount],
+            'countdownWalls': [
+                {'x': x, 'y': y, 'secondsLeft': secondsLeft}
+                for (x, y), secondsLeft in countdown.items()
+            ],
+        }
+
+
+def replayHeader(replayData):
+    """Everything but the frames, with frameCount filled in for v1 replays"""
+    header = {key: value for key, value in replayData.items() if key != 'frames'}
+    header.setdefault('frameCount', len(replayData.get('frames', [])))
+    return header
+
+
+def encodeLine(value):
+    return (json.dumps(value, separators=(',', ':')) + '\n').encode()
+
+
+def replayChunks(replayData, firstFrame=0, endFrame=None, framesPerChunk=100):
+    """Replay as NDJSON bytes: a header line, then one line per frame, framesPerChunk lines per chunk.
+
+    A window (firstFrame > 0 or endFrame) only carries frames firstFrame..endFrame-1 and
+    its header says where it starts ('firstFrame'); the full stream's header doesn't.
+    """
+    header = replayHeader(replayData)
+    if firstFrame or endFrame is not None:
+        header['firstFrame'] = firstFrame
+    yield encodeLine(header)
+    frames = replayData.get('frames', [])
+    endFrame = len(frames) if endFrame is None else min(endFrame, len(frames))
+    for start in range(firstFrame, endFrame, framesPerChunk):
+        yield b''.join(encodeLine(frame) for frame in frames[start:min(start + framesPerChunk, endFrame)])
+
+
+def replayWindow(replayData, startSeconds, endSeconds=None):
+    """(firstFrame, endFrame) covering a time window, widened back to the nearest keyframe"""
+    frames = replayData.get('frames', [])
+    frameDuration = replayData.get('frameDuration') or 150
+    # The epsilon keeps start = frame * frameDuration / 1000 from rounding down a frame
+    firstFrame = min(max(0, int(startSeconds * 1000 / frameDuration + 1e-6)), max(0, len(frames) - 1))
+    if replayData.get('version', 1) >= 2:
+        while firstFrame > 0 and not frames[firstFrame].get('k'):
+            firstFrame -= 1
+    endFrame = None
+    if endSeconds is not None:
+        endFrame = max(firstFrame, int(math.ceil(endSeconds * 1000 / frameDuration)) + 1)
+    return firstFrame, endFrame
+
+
+class SeekIndexBuilder:
+    """Builds a seek index one frame at a time, so a replay written in segments never needs every frame at once.
+
+    Keyframe offsets are counted from the first frame line and shifted past the header in build(),
+    since the header (which lists every wall) is only final when the replay is.
+    """
+
+    def __init__(self, version=1):
+        self.version = version
+        self.frameCount = 0
+        self.size = 0
+        self.keyframes = []
+        self.events = []
+        self.rows = {}
+        self.previous = {}
+
+    def add(self, frame):
+        frameIndex = self.frameCount
+        if self.isSeekPoint(frameIndex, frame):
+            self.keyframes.append([frameIndex, self.size])
+        self.size += len(encodeLine(frame))
+        actors = self.actorStates(frame)
+        self.addEvents(frameIndex, actors, frame)
+        self.previous = actors
+        self.frameCount += 1
+
+    def isSeekPoint(self, frameIndex, frame):
+        """Whether playback can start at this frame without the ones before it"""
+        if self.version >= 2:
+            return bool(frame.get('k'))
+        # v1 frames are all full frames; only index every V1_SEEK_INTERVAL of them
+        return frameIndex % V1_SEEK_INTERVAL == 0
+
+    def actorStates(self, frame):
+        """{actor: (alive, hits, score)}: multiplayer players by id, or 'player' and 'bot<i>'"""
+        if self.version >= 2:
+            if frame.get('k'):
+                self.rows = {}
+            self.rows.update(frame.get('p', {}))
+            for key in frame.get('r', []):
+                self.rows.pop(key, None)
+            return {key: (bool(row[3]), row[5], row[4]) for key, row in self.rows.items()}
+        if 'players' in frame:
+            return {
+                key: (player['alive'], player.get('hits', 0), player.get('score', 0))
+                for key, player in frame['players'].items()
+            }
+        actors = {}
+        player = frame.get('player')
+        if player:
+            # Solo counts wall hits, progressive counts eliminated bots
+            actors['player'] = (player.get('alive', True), frame.get('wallsHit', 0), frame.get('botsEliminated', 0))
+        for i, bot in enumerate(frame.get('bots', [])):
+            actors[f'bot{i}'] = (bot.get('alive', True), 0, 0)
+        return actors
+
+    def addEvents(self, frameIndex, actors, frame):
+        """Hit, death and kill markers: {'frame', 'type', 'actor'} (+ 'victim' for kills)"""
+        previous = self.previous
+        gains = {
+            key: state[2] - previous[key][2]
+            for key, state in actors.items()
+            if key in previous and state[0]
+        }
+        for key, (alive, hits, score) in actors.items():
+            if key not in previous:
+                continue
+            wasAlive, previousHits, previousScore = previous[key]
+            if hits > previousHits:
+                self.events.append({'frame': frameIndex, 'type': 'hit', 'actor': key})
+            if wasAlive and not alive:
+                self.events.append({'frame': frameIndex, 'type': 'death', 'actor': key})
+                killer = findKiller(key, gains, frame)
+                if killer is not None:
+                    self.events.append({'frame': frameIndex, 'type': 'kill', 'actor': killer, 'victim': key})
+
+    def build(self, header):
+        """Index for the replay with this header line"""
+        headerSize = len(encodeLine(header))
+        return {
+            'frameCount': self.frameCount,
+            'frameDuration': header.get('frameDuration') or 150,
+            'headerSize': headerSize,
+            'size': headerSize + self.size,
+            'keyframes': [[frameIndex, headerSize + offset] for frameIndex, offset in self.keyframes],
+            'events': list(self.events),
+        }
+
+
+def findKiller(victim, gains, frame):
+    """Who eliminated victim this frame: the one survivor whose score jumped above everyone else's"""
+    if victim == 'player' and frame.get('killerBotIndex') is not None:
+        return f'bot{frame["killerBotIndex"]}'
+    others = {key: gain for key, gain in gains.items() if key != victim}
+    if not others:
+        return None
+    killer = max(others, key=others.get)
+    # Wall spawns raise every survivor's score together, so only a unique lead counts
+    rest = [gain for key, gain in others.items() if key != killer]
+    if others[killer] > 0 and (not rest or others[killer] > max(rest)):
+        return killer
+    return None
+
+
+def seekIndex(replayData):
+    """Byte offsets of seek points in the full NDJSON stream (replayChunks), plus event markers"""
+    builder = SeekIndexBuilder(replayData.get('version', 1))
+    for frame in replayData.get('frames', []):
+        builder.add(frame)
+    return builder.build(replayHeader(replayData))
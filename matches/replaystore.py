@@ -0,0 +1,298 @@
+import gzip
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from .gamelog import logger
+from .replay import seekIndex, SeekIndexBuilder, REPLAY_VERSION
+from .simulation import materializeReplay, INPUT_REPLAY_FORMAT
+
+# zstd is optional; without the zstandard package replays are gzip-compressed
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODECS = ('gzip', 'zstd')
+
+
+class ReplayStore:
+    """Where compressed replay blobs live, keyed by StoredReplay.key"""
+    name = None
+
+    def save(self, key, blob):
+        raise NotImplementedError
+
+    def load(self, key):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+
+class DatabaseReplayStore(ReplayStore):
+    """Blobs in the ReplayBlob table (bytea on PostgreSQL, stored out of line by TOAST)"""
+    name = 'database'
+
+    def save(self, key, blob):
+        from .models import ReplayBlob
+        ReplayBlob.objects.update_or_create(key=key, defaults={'data': blob})
+
+    def load(self, key):
+        from .models import ReplayBlob
+        return bytes(ReplayBlob.objects.values_list('data', flat=True).get(key=key))
+
+    def delete(self, key):
+        from .models import ReplayBlob
+        ReplayBlob.objects.filter(key=key).delete()
+
+
+class FileSystemReplayStore(ReplayStore):
+    """One file per blob under root, fanned out by key prefix"""
+    name = 'filesystem'
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def save(self, key, blob):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so readers never see a partial blob
+        tmpPath = path + '.tmp'
+        with open(tmpPath, 'wb') as f:
+            f.write(blob)
+        os.replace(tmpPath, path)
+
+    def load(self, key):
+        with open(self.path(key), 'rb') as f:
+            return f.read()
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+
+class StorageReplayStore(ReplayStore):
+    """Blobs in a Django storage backend (object stores via django-storages, Cloudinary, ...)"""
+    name = 'storage'
+
+    def __init__(self, alias='default', prefix='replays'):
+        self.alias = alias
+        self.prefix = prefix
+
+    @property
+    def storage(self):
+        from django.core.files.storage import storages
+        return storages[self.alias]
+
+    def path(self, key):
+        return f'{self.prefix}/{key}'
+
+    def save(self, key, blob):
+        from django.core.files.base import ContentFile
+        storage = self.storage
+        if storage.exists(self.path(key)):
+            storage.delete(self.path(key))
+        storage.save(self.path(key), ContentFile(blob))
+
+    def load(self, key):
+        with self.storage.open(self.path(key), 'rb') as f:
+            return f.read()
+
+    def delete(self, key):
+        self.storage.delete(self.path(key))
+
+
+BACKENDS = {
+    DatabaseReplayStore.name: DatabaseReplayStore,
+    FileSystemReplayStore.name: FileSystemReplayStore,
+    StorageReplayStore.name: StorageReplayStore,
+}
+
+_stores = {}
+
+
+def getReplayStore(name=None):
+    """Configured store instance for a backend name (REPLAY_STORE_BACKEND by default)"""
+    name = name or getattr(settings, 'REPLAY_STORE_BACKEND', 'database')
+    if name not in _stores:
+        if name not in BACKENDS:
+            raise ValueError(f'Unknown replay store backend: {name}')
+        options = getattr(settings, 'REPLAY_STORE_OPTIONS', {}).get(name, {})
+        _stores[name] = BACKENDS[name](**options)
+    return _stores[name]
+
+
+def resolveCodec(codec=None):
+    codec = codec or getattr(settings, 'REPLAY_COMPRESSION', 'gzip')
+    if codec not in CODECS:
+        raise ValueError(f'Unknown replay compression: {codec}')
+    if codec == 'zstd' and zstandard is None:
+        logger.warning('zstandard is not installed, compressing replays with gzip')
+        return 'gzip'
+    return codec
+
+
+def compress(raw, codec, level=None):
+    level = level if level is not None else getattr(settings, 'REPLAY_COMPRESSION_LEVEL', 6)
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compress(raw)
+    return gzip.compress(raw, compresslevel=level)
+
+
+def decompress(blob, codec):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('Replay is zstd-compressed but zstandard is not installed')
+        return zstandard.ZstdDecompressor().decompress(blob)
+    return gzip.decompress(blob)
+
+
+def frameCount(replayData):
+    return replayData.get('frameCount') or len(replayData.get('frames', []))
+
+
+def storeReplay(replayData, backend=None, codec=None, level=None):
+    """Compress replayData into the replay store and return its StoredReplay pointer row"""
+    from .models import StoredReplay
+    store = getReplayStore(backend)
+    codec = resolveCodec(codec)
+    raw = json.dumps(replayData, separators=(',', ':')).encode()
+    blob = compress(raw, codec, level)
+    key = uuid.uuid4().hex
+    store.save(key, blob)
+    return StoredReplay.objects.create(
+        key=key,
+        backend=store.name,
+        codec=codec,
+        size=len(blob),
+        rawSize=len(raw),
+        frameCount=frameCount(replayData),
+        version=replayData.get('version', 1),
+        # Input-log replays are indexed when first watched, so storing one never re-simulates it
+        seekIndex=None if replayData.get('format') == INPUT_REPLAY_FORMAT else seekIndex(replayData),
+    )
+
+
+def segmentKey(key, segment):
+    return f'{key}-{segment:05d}'
+
+
+def loadReplay(storedReplay):
+    """replayData dict for a StoredReplay"""
+    store = getReplayStore(storedReplay.backend)
+    replayData = json.loads(decompress(store.load(storedReplay.key), storedReplay.codec))
+    if storedReplay.segments:
+        # Segmented: the main blob is the header, frames are in the segment blobs
+        replayData['frames'] = []
+        for segment in range(storedReplay.segments):
+            blob = store.load(segmentKey(storedReplay.key, segment))
+            replayData['frames'].extend(json.loads(decompress(blob, storedReplay.codec)))
+    return replayData
+
+
+def loadMaterialized(storedReplay):
+    """replayData with frames for a StoredReplay; re-simulated input-log replays are cached"""
+    cacheKey = f'replay:frames:{storedReplay.key}'
+    replayData = cache.get(cacheKey)
+    if replayData is None:
+        replayData = loadReplay(storedReplay)
+        if replayData.get('format') == INPUT_REPLAY_FORMAT:
+            replayData = materializeReplay(replayData)
+            cache.set(cacheKey, replayData, getattr(settings, 'REPLAY_MATERIALIZED_CACHE_TIMEOUT', 600))
+    return replayData
+
+
+class ReplayWriter:
+    """One background thread that writes replay segments (and engine snapshots), so the tick loop never waits on compression or I/O"""
+
+    def __init__(self):
+        self.executor = None
+
+    def submit(self, fn, *args):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='replay-writer')
+        return self.executor.submit(self.run, fn, *args)
+
+    def run(self, fn, *args):
+        close_old_connections()
+        try:
+            return fn(*args)
+        except Exception as e:
+            logger.error('Replay writer task %s failed: %s', getattr(fn, '__name__', fn), e, exc_info=True)
+            raise
+        finally:
+            close_old_connections()
+
+
+REPLAY_WRITER = ReplayWriter()
+
+
+class SegmentedReplay:
+    """A replay written to the replay store segment by segment while the match runs.
+
+    Each segment is one compressed blob of frames; the StoredReplay's own blob holds the
+    header and is rewritten with every segment, so after a crash the replay is still
+    readable up to the last segment. attach(storedReplay) runs once, on the writer
+    thread, when the StoredReplay row is created.
+    """
+
+    def __init__(self, attach=None, backend=None, codec=None, level=None):
+        self.key = uuid.uuid4().hex
+        self.store = getReplayStore(backend)
+        self.codec = resolveCodec(codec)
+        self.level = level
+        self.attach = attach
+        self.segments = 0
+        self.size = 0
+        self.rawSize = 0
+        self.index = SeekIndexBuilder(REPLAY_VERSION)
+        self.storedReplay = None
+
+    def submit(self, header, frames, final=False):
+        return REPLAY_WRITER.submit(self.write, header, frames, final)
+
+    def write(self, header, frames, final):
+        """Store one segment and the updated header (writer thread); returns the StoredReplay"""
+        from .models import StoredReplay
+        if frames:
+            raw = json.dumps(frames, separators=(',', ':')).encode()
+            blob = compress(raw, self.codec, self.level)
+            self.store.save(segmentKey(self.key, self.segments), blob)
+            self.segments += 1
+            self.size += len(blob)
+            self.rawSize += len(raw)
+            for frame in frames:
+                self.index.add(frame)
+
+        raw = json.dumps(header, separators=(',', ':')).encode()
+        blob = compress(raw, self.codec, self.level)
+        self.store.save(self.key, blob)
+        fields = {
+            'backend': self.store.name,
+            'codec': self.codec,
+            'size': self.size + len(blob),
+            'rawSize': self.rawSize + len(raw),
+            'frameCount': header['frameCount'],
+            'version': header['version'],
+            'segments': self.segments,
+            'complete': final,
+            'seekIndex': self.index.build(header),
+        }
+        if self.storedReplay is None:
+            self.storedReplay = StoredReplay.objects.create(key=self.key, **fields)
+            if self.attach:
+                self.attach(self.storedReplay)
+        else:
+            StoredReplay.objects.filter(id=self.storedReplay.id).update(**fields)
+            for field, value in fields.items():
+                setattr(self.storedReplay, field, value)
+        return self.storedReplay
@@ -0,0 +1,317 @@
+import asyncio
+import os
+import signal
+import time
+from .gamelog import logger
+from .metrics import TickMetrics
+from .snapshot import saveSnapshot, getSnapshotStore, WORKER_ID
+from .ownership import OWNERSHIP
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+# Timing wheel resolution: 25 ms divides every speedMap tick rate (75/100/150/200 ms)
+SLOT_SECONDS = 0.025
+SLOTS_PER_SECOND = round(1 / SLOT_SECONDS)
+# Slots per wheel revolution; jobs due further out simply stay in their bucket for another lap
+WHEEL_SIZE = 512
+
+# Jobs due in the same slot run countdowns first, then spawns, then ticks, then snapshots (once the
+# slot's ticks have finished, so a snapshot holds the state its rescheduled jobs follow on from)
+JOB_ORDER = {'countdown': 0, 'spawn': 1, 'tick': 2, 'snapshot': 3}
+# How often a worker checks the snapshot store for matches handed off by a draining worker
+HANDOFF_POLL_SLOTS = 2
+
+
+class TickScheduler:
+    """Drives every GameEngine in this worker from a single asyncio task.
+
+    Engines register when their match starts; the scheduler wakes once per wheel slot
+    (anchored to a monotonic clock so sleeps never accumulate drift), runs every due
+    tick/countdown/spawn job in one batch, and reschedules each job relative to its due
+    slot so the effective tick rate matches speedMap even when a batch runs late.
+    
+    Ticks are fixed-timestep: when an engine falls a whole tick period or more behind,
+    GAME_TICK_POLICY decides whether the missed ticks are run back-to-back ('catchup',
+    at most GAME_TICK_MAX_CATCHUP per batch) or dropped ('skip').
+
+    Every GAME_SNAPSHOT_INTERVAL seconds each engine is snapshotted to the snapshot store.
+    On SIGUSR1 the worker drains: its engines stop, their final snapshots are offered, and
+    any other worker with a running scheduler claims and resumes them within a tick or two.
+    """
+
+    def __init__(self):
+        # Hosted engines {matchId: GameEngine}, exported as consumers.ACTIVE_GAMES
+        self.engines = {}
+        self.wheel = [[] for _ in range(WHEEL_SIZE)]
+        self.currentSlot = 0
+        self.origin = None
+        self.task = None
+        self.policy = None
+        self.maxCatchUp = None
+        self.draining = False
+        self.adopting = None
+        # Phase timings of engines that have finished, so worker totals never go backwards
+        self.retiredMetrics = TickMetrics()
+        self.stats = {
+            'batches': 0,
+            'ticks': 0,
+            'lateTicks': 0,
+            'caughtUpTicks': 0,
+            'skippedTicks': 0,
+            'jitterAvgMs': 0.0,
+            'jitterMaxMs': 0.0,
+            'lastBatchMs': 0.0,
+            'maxBatchMs': 0.0,
+            'avgBatchMs': 0.0,
+        }
+
+    def schedule(self, engine, kind, delaySlots):
+        """Queue a job delaySlots after the current slot (never in a slot already processed)"""
+        dueSlot = self.currentSlot + max(1, delaySlots)
+        self.wheel[dueSlot % WHEEL_SIZE].append((dueSlot, engine, kind))
+
+    def start(self, engine, jobs=None):
+        """Begin ticking a started engine (tick now, countdown after 1s, spawns every interval).
+
+        A resumed engine passes the slots its snapshot had left until each job instead, and is
+        snapshotted right away so the store shows it is live again.
+        """
+        jobs = jobs or {}
+        self.engines[engine.matchId] = engine
+        self.schedule(engine, 'tick', jobs.get('tick', 1))
+        self.schedule(engine, 'countdown', jobs.get('countdown', SLOTS_PER_SECOND))
+        # Only spawn walls if wallSpawnInterval > 0
+        if engine.wallSpawnInterval > 0:
+            self.schedule(engine, 'spawn', jobs.get('spawn', engine.wallSpawnInterval * SLOTS_PER_SECOND))
+        if self.snapshotSlots():
+            self.schedule(engine, 'snapshot', 1 if 'tick' in jobs else self.snapshotSlots())
+
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    def remove(self, matchId):
+        """Forget a finished engine (its queued jobs are dropped when they come due)"""
+        engine = self.engines.pop(matchId, None)
+        if engine is not None:
+            self.retiredMetrics.merge(engine.metrics)
+
+    def hostedEngines(self):
+        """(matchId, engine) pairs copied in one step, safe to walk from the sync views while the loop adds and removes engines"""
+        return list(self.engines.items())
+
+    def phaseMetrics(self, engines=None):
+        """Phase timings of every engine this worker has run"""
+        totals = TickMetrics()
+        totals.merge(self.retiredMetrics)
+        for _, engine in engines if engines is not None else self.hostedEngines():
+            totals.merge(engine.metrics)
+        return totals
+
+    def tickSlots(self, engine):
+        return max(1, round(engine.tickRate / SLOT_SECONDS))
+
+    def snapshotSlots(self):
+        return getattr(settings, 'GAME_SNAPSHOT_INTERVAL', 0) * SLOTS_PER_SECOND
+
+    def pendingJobs(self, engine):
+        """Slots until each of the engine's queued jobs comes due (carried over by its snapshot)"""
+        jobs = {}
+        for bucket in self.wheel:
+            for dueSlot, queued, kind in bucket:
+                if queued is engine and kind != 'snapshot':
+                    jobs[kind] = dueSlot - self.currentSlot
+        return jobs
+
+    def requestDrain(self, *args):
+        """Signal handler: hand every engine over to other workers at the next slot"""
+        self.draining = True
+
+    async def drain(self, channelLayer):
+        """Stop every running engine, offer its final snapshot and close its sockets on this worker"""
+        engines = [engine for engine in self.engines.values() if engine.running]
+        writes = []
+        for engine in engines:
+            writes.append(asyncio.wrap_future(saveSnapshot(engine, self.pendingJobs(engine), handoff=True)))
+            engine.stop()
+            self.remove(engine.matchId)
+        await asyncio.gather(*writes, return_exceptions=True)
+        for engine in engines:
+            # Only once the handoff snapshot is written, so the next owner resumes from it
+            await OWNERSHIP.release(engine.matchId)
+            # Clients connected here reconnect, and land on a worker that is not draining
+            await channelLayer.group_send(engine.roomGroupName, {'type': 'engineMoved', 'worker': WORKER_ID})
+        logger.info('[TickScheduler] Drained %d engines from worker %s', len(engines), WORKER_ID)
+
+    async def adoptHandoffs(self):
+        """Resume matches offered by draining workers"""
+        from .consumers import resumeMatch
+        try:
+            matchIds = await asyncio.to_thread(getSnapshotStore().pending)
+            for matchId in matchIds:
+                # A poll already in flight when a drain starts must not take the matches back
+                if self.draining:
+                    return
+                if matchId not in self.engines:
+                    await resumeMatch(matchId)
+        except Exception as e:
+            logger.error('[TickScheduler] Error adopting handed-off matches: %s', e, exc_info=True)
+
+    def configure(self):
+        """Read the tick policy settings (each time the scheduler starts)"""
+        self.policy = getattr(settings, 'GAME_TICK_POLICY', 'catchup')
+        self.maxCatchUp = getattr(settings, 'GAME_TICK_MAX_CATCHUP', 3)
+
+    async def run(self):
+        self.configure()
+        loop = asyncio.get_running_loop()
+        # Re-anchor so slot numbering continues across idle periods
+        self.origin = loop.time() - self.currentSlot * SLOT_SECONDS
+        channelLayer = get_channel_layer()
+
+        while any(engine.running for engine in self.engines.values()):
+            if self.draining:
+                await self.drain(channelLayer)
+                break
+
+            self.currentSlot += 1
+            wakeAt = self.origin + self.currentSlot * SLOT_SECONDS
+            delay = wakeAt - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            if self.snapshotSlots() and self.currentSlot % HANDOFF_POLL_SLOTS == 0:
+                if self.adopting is None or self.adopting.done():
+                    self.adopting = asyncio.create_task(self.adoptHandoffs())
+
+            try:
+                await self.runSlot(self.currentSlot, loop.time(), channelLayer)
+            except Exception as e:
+                logger.error('[TickScheduler] Error in slot %d: %s', self.currentSlot, e, exc_info=True)
+
+    async def runSlot(self, slot, now, channelLayer):
+        bucket = self.wheel[slot % WHEEL_SIZE]
+        if not bucket:
+            return
+        due = [job for job in bucket if job[0] <= slot]
+        if not due:
+            return
+        bucket[:] = [job for job in bucket if job[0] > slot]
+        due.sort(key=lambda job: JOB_ORDER[job[2]])
+
+        started = time.perf_counter()
+        frames = []
+        snapshots = []
+        for dueSlot, engine, kind in due:
+            if not engine.running:
+                continue
+            try:
+                if kind == 'tick':
+                    runs, nextDue = self.planTicks(engine, dueSlot, slot, now)
+                    frames.append(self.runFrames(engine, runs, channelLayer))
+                    # Reschedule from the due slot, not from now, so lateness doesn't drift the rate
+                    self.schedule(engine, 'tick', nextDue - slot)
+                elif kind == 'countdown':
+                    engine.updateCountdownWalls()
+                    self.schedule(engine, 'countdown', dueSlot + SLOTS_PER_SECOND - slot)
+                elif kind == 'spawn':
+                    engine.spawnWall()
+                    self.schedule(engine, 'spawn', dueSlot + engine.wallSpawnInterval * SLOTS_PER_SECOND - slot)
+                elif kind == 'snapshot':
+                    snapshots.append((dueSlot, engine))
+            except Exception as e:
+                engine.log.error('scheduler', 'Error in scheduled %s: %s', kind, e)
+
+        # Broadcasts for every engine ticked in this slot go out concurrently
+        if frames:
+            await asyncio.gather(*frames, return_exceptions=True)
+
+        # The ticks above only run in the gather, so snapshots wait for it
+        for dueSlot, engine in snapshots:
+            if not engine.running:
+                continue
+            try:
+                saveSnapshot(engine, self.pendingJobs(engine))
+                self.schedule(engine, 'snapshot', dueSlot + self.snapshotSlots() - slot)
+            except Exception as e:
+                engine.log.error('scheduler', 'Error in scheduled snapshot: %s', e)
+
+        batchMs = (time.perf_counter() - started) * 1000
+        stats = self.stats
+        stats['batches'] += 1
+        stats['lastBatchMs'] = batchMs
+        stats['maxBatchMs'] = max(stats['maxBatchMs'], batchMs)
+        stats['avgBatchMs'] += (batchMs - stats['avgBatchMs']) * 0.05
+
+    def planTicks(self, engine, dueSlot, slot, now):
+        """Record tick jitter and apply the catch-up/skip policy: returns (ticks to run, next due slot)"""
+        period = self.tickSlots(engine)
+        jitter = now - (self.origin + dueSlot * SLOT_SECONDS)
+        engine.recordTickTiming(now, jitter)
+
+        stats = self.stats
+        jitterMs = jitter * 1000
+        stats['jitterAvgMs'] += (jitterMs - stats['jitterAvgMs']) * 0.05
+        stats['jitterMaxMs'] = max(stats['jitterMaxMs'], jitterMs)
+        # A tick that starts more than one slot after its due time is late
+        if jitter > SLOT_SECONDS:
+            stats['lateTicks'] += 1
+
+        # Whole tick periods missed since this tick was due, by the clock rather than by
+        # slot number (a blocked loop works through its backlog of slots back-to-back)
+        clockSlot = int((now - self.origin) / SLOT_SECONDS)
+        missed = max(0, clockSlot - dueSlot) // period
+        caughtUp = min(missed, self.maxCatchUp) if self.policy == 'catchup' else 0
+        skipped = missed - caughtUp
+        stats['caughtUpTicks'] += caughtUp
+        stats['skippedTicks'] += skipped
+        engine.tickTiming['caughtUp'] += caughtUp
+        engine.tickTiming['skipped'] += skipped
+        return 1 + caughtUp, dueSlot + (missed + 1) * period
+
+    async def runFrames(self, engine, runs, channelLayer):
+        for _ in range(runs):
+            if not engine.running:
+                break
+            self.stats['ticks'] += 1
+            await engine.runFrame(channelLayer)
+
+    def getStats(self):
+        """Per-worker scheduler stats"""
+        engines = self.hostedEngines()
+        return {
+            'pid': os.getpid(),
+            'enginesHosted': len(engines),
+            'enginesRunning': sum(1 for _, engine in engines if engine.running),
+            'currentSlot': self.currentSlot,
+            'slotMs': SLOT_SECONDS * 1000,
+            'policy': self.policy,
+            **self.stats,
+            'phases': self.phaseMetrics(engines).summary(),
+            'engines': {
+                str(matchId): {
+                    'speed': engine.speed,
+                    'running': engine.running,
+                    'tick': engine.tickNumber,
+                    'frameDurationMs': engine.measuredFrameDuration(),
+                    'jitterAvgMs': engine.tickTiming['jitterAvgMs'],
+                    'jitterMaxMs': engine.tickTiming['jitterMaxMs'],
+                    'caughtUp': engine.tickTiming['caughtUp'],
+                    'skipped': engine.tickTiming['skipped'],
+                    'payloadBytes': engine.metrics.payloadBytes,
+                    'binaryPayloadBytes': engine.metrics.binaryPayloadBytes,
+                    'phases': engine.metrics.summary(),
+                    'events': dict(engine.log.counters),
+                }
+                for matchId, engine in engines
+            },
+        }
+
+
+# One scheduler per worker process
+SCHEDULER = TickScheduler()
+
+
+def installDrainSignal():
+    """SIGUSR1 drains this worker (call from the server's main thread, e.g. in the ASGI module)"""
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, SCHEDULER.requestDrain)
@@ -0,0 +1,211 @@
+import asyncio
+from datetime import timedelta
+from decimal import Decimal
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from accounts.models import Profile
+from shop.models import Transaction
+from .gamelog import MatchLog, logger
+from .models import Match, MatchParticipation, MatchReplay, SettlementJob
+from .replaystore import storeReplay
+
+CENT = Decimal('0.01')
+
+
+def settleMatch(matchId, winnerId=None, isTie=False):
+    """Pay out a finished match and complete it, in one transaction.
+
+    Every profile, participation and Transaction change is worked out in memory first. Rows
+    getting the same change share one UPDATE (in a tie every player gets the same share, in
+    a win everyone but the winner gets nothing), so a settlement is about ten statements
+    whatever the player count. Locks are taken in one order everywhere a match's profiles are
+    touched: the players' profiles by primary key, then the match row (the views lock a
+    profile before the match rows they update), so two settlements, or a settlement and a
+    purchase, never wait on each other in a cycle. A match that is already COMPLETED is left
+    alone, so settling twice pays out once; returns False in that case.
+    """
+    log = MatchLog(matchId)
+    with transaction.atomic():
+        participants = list(MatchParticipation.objects.filter(match_id=matchId).order_by('id'))
+        userIds = sorted({p.player_id for p in participants if p.player_id is not None})
+        profiles = {
+            profile.user_id: profile
+            for profile in Profile.objects.select_for_update().filter(user_id__in=userIds).order_by('pk')
+        }
+        match = Match.objects.select_for_update().select_related('matchType').get(id=matchId)
+        if match.status == 'COMPLETED':
+            log.warning('settlement', 'Match already settled, skipping')
+            return False
+
+        # Bot ids are strings like 'bot_280'; only a participating user can win the pot
+        winnerUserId = winnerId if isinstance(winnerId, int) and winnerId in profiles else None
+        rewards = {}
+        payouts = {}
+        wins = {}
+        # Stored when the settlement was queued (or attached by the first streamed segment)
+        replay = MatchReplay.objects.filter(match_id=matchId).first()
+        if replay is None:
+            log.warning('settlement', 'NO REPLAY DATA for this match')
+
+        if isTie and participants:
+            share = (match.totalPot / len(participants)).quantize(CENT)
+            for participation in participants:
+                # All tied for first place; bots get nothing
+                rewards[participation.id] = (share if participation.player_id is not None else 0, 1)
+            payouts = {userId: (share, f'Tie - Split pot: {match.matchType.name}') for userId in profiles}
+        elif winnerId:
+            for participation in participants:
+                won = participation.player_id is not None and participation.player_id == winnerId
+                rewards[participation.id] = (match.totalPot, 1) if won else (0, 2)
+            if winnerUserId is not None:
+                payouts[winnerUserId] = (match.totalPot, f'Won match: {match.matchType.name}')
+                wins[winnerUserId] = 1
+
+        transactions = []
+        for userId, (amount, description) in payouts.items():
+            balanceBefore = profiles[userId].coins
+            transactions.append(Transaction(
+                user_id=userId,
+                amount=amount,
+                transactionType='MATCH_WIN',
+                relatedMatch=match,
+                description=description,
+                balanceBefore=balanceBefore,
+                balanceAfter=balanceBefore + amount,
+            ))
+
+        for (amount, won), pks in groupBy(profiles, lambda userId: (payouts.get(userId, (0,))[0], wins.get(userId, 0))):
+            Profile.objects.filter(pk__in=pks).update(
+                coins=F('coins') + amount,
+                totalWins=F('totalWins') + won,
+                totalMatches=F('totalMatches') + 1,
+            )
+        replayFields = {'replay': replay} if replay is not None else {}
+        for (coinReward, placement), ids in groupBy(rewards, rewards.get):
+            MatchParticipation.objects.filter(id__in=ids).update(coinReward=coinReward, placement=placement, **replayFields)
+        Transaction.objects.bulk_create(transactions)
+
+        match.status = 'COMPLETED'
+        match.completedAt = timezone.now()
+        match.winner_id = winnerUserId
+        match.save(update_fields=['status', 'completedAt', 'winner'])
+
+    log.info('settlement', 'Settled: isTie=%s, winnerId=%s, %d players, %d transactions',
+             isTie, winnerId, len(profiles), len(transactions))
+    return True
+
+
+def groupBy(keys, change):
+    """(change, [keys]) pairs, one per distinct change"""
+    groups = {}
+    for key in keys:
+        groups.setdefault(change(key), []).append(key)
+    return groups.items()
+
+
+def saveMatchReplay(matchId, replayData, log):
+    """Store the match's one replay row"""
+    storedReplay = storeReplay(replayData)
+    MatchReplay.objects.update_or_create(
+        match_id=matchId,
+        defaults={'storedReplay': storedReplay, 'replayData': None}
+    )
+    log.debug('settlement', 'Saved replay data (%d frames, %d bytes)', storedReplay.frameCount, storedReplay.size)
+
+
+def enqueueSettlement(matchId, winnerId=None, isTie=False, replayData=None):
+    """Store the match's replay and queue its settlement; a match is only ever queued once"""
+    log = MatchLog(matchId)
+    with transaction.atomic():
+        if replayData:
+            saveMatchReplay(matchId, replayData, log)
+        job, created = SettlementJob.objects.get_or_create(
+            match_id=matchId,
+            defaults={'winnerId': winnerId, 'isTie': isTie}
+        )
+    if not created:
+        log.warning('settlement', 'Settlement already queued (%s), not queueing it again', job.status)
+    return job
+
+
+def runDueSettlements(limit=20):
+    """Run up to limit due settlement jobs, each in its own transaction; returns how many ran.
+
+    A job's row stays locked while it runs (other workers skip it), and a worker that dies
+    mid-settlement rolls the whole transaction back, leaving the job pending for the next.
+    A failed settlement is retried after GAME_SETTLEMENT_RETRY_SECONDS, doubling each time,
+    and marked FAILED after GAME_SETTLEMENT_MAX_ATTEMPTS attempts.
+    """
+    maxAttempts = getattr(settings, 'GAME_SETTLEMENT_MAX_ATTEMPTS', 5)
+    retrySeconds = getattr(settings, 'GAME_SETTLEMENT_RETRY_SECONDS', 5)
+    ran = 0
+    while ran < limit:
+        with transaction.atomic():
+            job = (
+                SettlementJob.objects.select_for_update(skip_locked=True)
+                .filter(status='PENDING', runAfter__lte=timezone.now())
+                .order_by('runAfter', 'id')
+                .first()
+            )
+            if job is None:
+                break
+            ran += 1
+            job.attempts += 1
+            try:
+                with transaction.atomic():
+                    settleMatch(job.match_id, job.winnerId, job.isTie)
+            except Exception as e:
+                job.lastError = f'{type(e).__name__}: {e}'
+                if job.attempts >= maxAttempts:
+                    job.status = 'FAILED'
+                else:
+                    job.runAfter = timezone.now() + timedelta(seconds=retrySeconds * 2 ** (job.attempts - 1))
+                MatchLog(job.match_id).error('settlement', 'Settlement attempt %d failed: %s', job.attempts, e, exc_info=True)
+            else:
+                job.status = 'DONE'
+                job.lastError = ''
+            job.save(update_fields=['status', 'attempts', 'lastError', 'runAfter', 'updatedAt'])
+    return ran
+
+
+class SettlementWorker:
+    """Runs queued settlements on this process's event loop, in the database thread, never on the tick path.
+
+    Woken as soon as a match ends; otherwise polls every GAME_SETTLEMENT_POLL_SECONDS for
+    retries and for jobs queued by a worker that died before settling them.
+    """
+
+    def __init__(self):
+        self.task = None
+        self.wakeup = None
+        self.loop = None
+
+    def wake(self):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self.wakeup = asyncio.Event()
+            self.task = None
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+        self.wakeup.set()
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            try:
+                while await database_sync_to_async(runDueSettlements)():
+                    pass
+            except Exception as e:
+                logger.error('[SettlementWorker] Error running settlements: %s', e, exc_info=True)
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), getattr(settings, 'GAME_SETTLEMENT_POLL_SECONDS', 10))
+            except asyncio.TimeoutError:
+                pass
+
+
+# One per worker process
+SETTLEMENTS = SettlementWorker()
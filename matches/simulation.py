@@ -0,0 +1,416 @@
+"""Headless solo and progressive game rules, ported from game.html and gameProgressive.html.
+
+The browser plays a run from a server-issued seed and submits only that seed and its
+input log; the server replays the inputs here to get the authoritative score and, on
+demand, the replay frames. Both sides draw from mulberry32 and step everything on the
+single 150ms tick, so the same seed and inputs always produce the same run. This module
+has no Django imports so verify_runs can use it from worker processes.
+"""
+import math
+
+# Bump when the rules change; stored input replays record the rules they were played under
+RULES_VERSION = 1
+INPUT_REPLAY_FORMAT = 'inputs'
+
+TICK_RATE = 150  # ms
+GRID_SIZES = (15, 18, 20)
+MAX_RUN_TICKS = 2 * 60 * 60 * 1000 // TICK_RATE
+
+DIRECTIONS = ('UP', 'DOWN', 'LEFT', 'RIGHT')
+MOVES = {'UP': (0, -1), 'DOWN': (0, 1), 'LEFT': (-1, 0), 'RIGHT': (1, 0)}
+OPPOSITE = {'UP': 'DOWN', 'DOWN': 'UP', 'LEFT': 'RIGHT', 'RIGHT': 'LEFT'}
+
+MASK32 = 0xFFFFFFFF
+
+
+class SimulationError(ValueError):
+    """Submitted run can't be replayed (bad seed, grid size, level or input log)"""
+
+
+class Mulberry32:
+    """The same 32-bit generator as mulberry32() in the game templates"""
+
+    def __init__(self, seed):
+        self.state = seed & MASK32
+
+    def random(self):
+        self.state = (self.state + 0x6D2B79F5) & MASK32
+        a = self.state
+        t = ((a ^ (a >> 15)) * (a | 1)) & MASK32
+        t = ((t + (((t ^ (t >> 7)) * (t | 61)) & MASK32)) & MASK32) ^ t
+        return (t ^ (t >> 14)) / 4294967296
+
+    def below(self, n):
+        """Math.floor(rng() * n)"""
+        return int(self.random() * n)
+
+
+def crossed(tick, interval):
+    """Whether an `interval` ms timer fires on this tick"""
+    return tick * TICK_RATE // interval != (tick - 1) * TICK_RATE // interval
+
+
+def validateInputs(inputs, ticks):
+    """[[tick, direction], ...] with increasing ticks inside the run"""
+    if not isinstance(inputs, list):
+        raise SimulationError('inputs must be a list')
+    lastTick = 0
+    for entry in inputs:
+        if not isinstance(entry, (list, tuple)) or len(entry) != 2:
+            raise SimulationError('Each input must be [tick, direction]')
+        tick, direction = entry
+        if type(tick) is not int or not lastTick < tick <= ticks:
+            raise SimulationError('Input ticks must increase and fall inside the run')
+        if direction not in MOVES:
+            raise SimulationError(f'Unknown direction: {direction}')
+        lastTick = tick
+
+
+class Simulation:
+    """One seeded run, stepped tick by tick; subclasses hold the mode's rules"""
+    mode = None
+
+    def __init__(self, seed, gridSize, recordFrames=False):
+        if type(seed) is not int or not 0 <= seed <= MASK32:
+            raise SimulationError('seed must be a 32-bit unsigned integer')
+        if gridSize not in GRID_SIZES:
+            raise SimulationError(f'gridSize must be one of {GRID_SIZES}')
+        self.seed = seed
+        self.rng = Mulberry32(seed)
+        self.gridSize = gridSize
+        center = gridSize // 2
+        self.player = {'x': center, 'y': center, 'direction': 'UP', 'alive': True}
+        self.nextDirection = 'UP'
+        self.tickNumber = 0
+        self.over = False
+        self.inputs = []
+        self.recordFrames = recordFrames
+        self.frames = []
+
+    def run(self, inputs, ticks):
+        """Apply the input log for up to `ticks` ticks (the client stops there on ESC); ends early on game over"""
+        if type(ticks) is not int or not 0 <= ticks <= MAX_RUN_TICKS:
+            raise SimulationError(f'ticks must be between 0 and {MAX_RUN_TICKS}')
+        validateInputs(inputs, ticks)
+        self.inputs = [list(entry) for entry in inputs]
+        pending = iter(self.inputs)
+        nextInput = next(pending, None)
+        while not self.over and self.tickNumber < ticks:
+            self.tickNumber += 1
+            if nextInput is not None and nextInput[0] == self.tickNumber:
+                self.nextDirection = nextInput[1]
+                nextInput = next(pending, None)
+            self.step()
+        return self
+
+    def step(self):
+        raise NotImplementedError
+
+    def recordFrame(self):
+        if self.recordFrames:
+            self.frames.append(self.frame())
+
+    def movePlayer(self):
+        """Turn the player to the latest input; returns the cell it is heading into"""
+        self.player['direction'] = self.nextDirection
+        dx, dy = MOVES[self.nextDirection]
+        return self.player['x'] + dx, self.player['y'] + dy
+
+    def inBounds(self, x, y):
+        return 0 <= x < self.gridSize and 0 <= y < self.gridSize
+
+    @property
+    def survivalTime(self):
+        return self.tickNumber * TICK_RATE // 1000
+
+    def replayData(self):
+        """v1 replay (one full frame per tick), as the browser used to record it"""
+        return {'frames': self.frames, 'frameDuration': TICK_RATE, 'mode': self.mode}
+
+    def inputReplay(self):
+        """Compact replay: everything needed to re-simulate the frames"""
+        return {
+            'format': INPUT_REPLAY_FORMAT,
+            'rules': RULES_VERSION,
+            'mode': self.mode,
+            'seed': self.seed,
+            'gridSize': self.gridSize,
+            'ticks': self.tickNumber,
+            # Inputs logged after the game ended never applied
+            'inputs': [entry for entry in self.inputs if entry[0] <= self.tickNumber],
+            'frameDuration': TICK_RATE,
+            'frameCount': self.tickNumber,
+        }
+
+
+class SoloSimulation(Simulation):
+    """game.html: walls drop after a 3 second countdown; each one survived scores, each bump costs"""
+    mode = 'solo'
+    WALL_SPAWN_INTERVAL = 3000  # ms
+    COUNTDOWN_INTERVAL = 1000  # ms
+    MIN_SCORE = -50
+
+    def __init__(self, seed, gridSize, recordFrames=False):
+        super().__init__(seed, gridSize, recordFrames)
+        self.walls = []
+        self.countdownWalls = []
+        self.wallCells = set()
+        self.countdownCells = set()
+        self.wallsSurvived = 0
+        self.wallsHit = 0
+        self.score = 0
+
+    def step(self):
+        self.updateGame()
+        if self.over:
+            return
+        if crossed(self.tickNumber, self.COUNTDOWN_INTERVAL):
+            self.updateCountdownWalls()
+        if crossed(self.tickNumber, self.WALL_SPAWN_INTERVAL):
+            self.spawnWall()
+
+    def updateGame(self):
+        newX, newY = self.movePlayer()
+        if not self.inBounds(newX, newY) or (newX, newY) in self.wallCells:
+            self.wallsHit += 1
+            self.score -= 1
+            if self.score <= self.MIN_SCORE:
+                self.over = True
+        else:
+            self.player['x'] = newX
+            self.player['y'] = newY
+        self.recordFrame()
+
+    def spawnWall(self):
+        attempts = 0
+        while True:
+            x = self.rng.below(self.gridSize)
+            y = self.rng.below(self.gridSize)
+            attempts += 1
+            taken = (x, y) in self.wallCells or (x, y) in self.countdownCells or (
+                x == self.player['x'] and y == self.player['y']
+            )
+            if not (attempts < 100 and taken):
+                break
+        if attempts < 100:
+            self.countdownWalls.append({'x': x, 'y': y, 'secondsLeft': 3})
+            self.countdownCells.add((x, y))
+
+    def updateCountdownWalls(self):
+        remaining = []
+        for wall in self.countdownWalls:
+            wall['secondsLeft'] -= 1
+            if wall['secondsLeft'] <= 0:
+                self.walls.append({'x': wall['x'], 'y': wall['y']})
+                self.wallCells.add((wall['x'], wall['y']))
+                self.countdownCells.discard((wall['x'], wall['y']))
+                self.wallsSurvived += 1
+                self.score += 1
+            else:
+                remaining.append(wall)
+        self.countdownWalls = remaining
+
+    def frame(self):
+        return {
+            'gridSize': self.gridSize,
+            'player': dict(self.player),
+            'walls': [dict(w) for w in self.walls],
+            'countdownWalls': [dict(w) for w in self.countdownWalls],
+            'score': self.score,
+            'wallsSurvived': self.wallsSurvived,
+            'wallsHit': self.wallsHit,
+        }
+
+    def outcome(self):
+        return {
+            'wallsSurvived': self.wallsSurvived,
+            'wallsHit': self.wallsHit,
+            'survivalTime': self.survivalTime,
+        }
+
+    def finalGridState(self):
+        return {'walls': self.walls, 'score': self.score}
+
+
+class ProgressiveSimulation(Simulation):
+    """gameProgressive.html: take out `level` chasing bots from the side or back before one gets you"""
+    mode = 'progressive'
+    BOT_MOVE_EVERY = 3
+
+    def __init__(self, seed, gridSize, level, recordFrames=False):
+        super().__init__(seed, gridSize, recordFrames)
+        if type(level) is not int or not 1 <= level < gridSize * gridSize:
+            raise SimulationError('level out of range')
+        self.level = level
+        self.bots = []
+        self.botsEliminated = 0
+        self.won = False
+        self.killerBotIndex = None
+        self.botMoveCounter = 0
+        for _ in range(level):
+            self.spawnBot()
+
+    def spawnBot(self):
+        attempts = 0
+        while True:
+            x = self.rng.below(self.gridSize)
+            y = self.rng.below(self.gridSize)
+            attempts += 1
+            if not (attempts < 100 and self.isPositionOccupied(x, y)):
+                break
+        if attempts < 100:
+            self.bots.append({'x': x, 'y': y, 'direction': DIRECTIONS[self.rng.below(4)], 'alive': True})
+
+    def isPositionOccupied(self, x, y):
+        if self.player['x'] == x and self.player['y'] == y:
+            return True
+        return any(bot['alive'] and bot['x'] == x and bot['y'] == y for bot in self.bots)
+
+    def step(self):
+        self.updateGame()
+        self.recordFrame()
+
+    def updateGame(self):
+        player = self.player
+        newX, newY = self.movePlayer()
+        direction = player['direction']
+        if not self.inBounds(newX, newY):
+            return
+        # Moving into a bot that faces us is a head-on block
+        for bot in self.bots:
+            if bot['alive'] and bot['x'] == newX and bot['y'] == newY and bot['direction'] == OPPOSITE[direction]:
+                return
+        player['x'] = newX
+        player['y'] = newY
+        # Anything else we land on was hit from the side or back
+        for bot in self.bots:
+            if bot['alive'] and bot['x'] == newX and bot['y'] == newY:
+                bot['alive'] = False
+                self.botsEliminated += 1
+        if not any(bot['alive'] for bot in self.bots):
+            self.won = True
+            self.over = True
+            return
+
+        self.botMoveCounter += 1
+        if self.botMoveCounter < self.BOT_MOVE_EVERY:
+            return
+        self.botMoveCounter = 0
+        moves = [self.calculateBotMove(i) if bot['alive'] else None for i, bot in enumerate(self.bots)]
+        for i, bot in enumerate(self.bots):
+            move = moves[i]
+            if not bot['alive'] or move is None:
+                continue
+            mx, my, moveDirection = move
+            if mx == player['x'] and my == player['y']:
+                dx, dy = mx - bot['x'], my - bot['y']
+                if (dx, dy) == MOVES[OPPOSITE[player['direction']]]:
+                    # Head-on: the bot is blocked too
+                    continue
+                player['alive'] = False
+                self.killerBotIndex = i
+                self.over = True
+                return
+            collision = any(
+                j != i and other['alive'] and other['x'] == mx and other['y'] == my
+                for j, other in enumerate(self.bots)
+            )
+            if not collision:
+                bot['x'] = mx
+                bot['y'] = my
+                bot['direction'] = moveDirection
+
+    def calculateBotMove(self, index):
+        """Greedy chase: the first non-reversing free move that gets closest, else the first free move"""
+        bot = self.bots[index]
+        playerX, playerY = self.player['x'], self.player['y']
+        distance = math.sqrt((playerX - bot['x']) ** 2 + (playerY - bot['y']) ** 2)
+        best = None
+        bestPriority = None
+        for direction in DIRECTIONS:
+            if direction == OPPOSITE[bot['direction']]:
+                continue
+            dx, dy = MOVES[direction]
+            newX, newY = bot['x'] + dx, bot['y'] + dy
+            if not self.inBounds(newX, newY):
+                continue
+            if any(
+                j != index and other['alive'] and other['x'] == newX and other['y'] == newY
+                for j, other in enumerate(self.bots)
+            ):
+                continue
+            newDistance = math.sqrt((playerX - newX) ** 2 + (playerY - newY) ** 2)
+            priority = 100 - newDistance if newDistance < distance else 10
+            # Strictly greater keeps the first of equal moves, like the template's stable sort
+            if bestPriority is None or priority > bestPriority:
+                best = (newX, newY, direction)
+                bestPriority = priority
+        if best is None:
+            return bot['x'], bot['y'], bot['direction']
+        return best
+
+    def frame(self):
+        return {
+            'gridSize': self.gridSize,
+            'player': dict(self.player),
+            'bots': [dict(bot) for bot in self.bots],
+            'level': self.level,
+            'botsEliminated': self.botsEliminated,
+            'killerBotIndex': self.killerBotIndex,
+        }
+
+    def outcome(self):
+        return {
+            'level': self.level,
+            'botsEliminated': self.botsEliminated,
+            'won': self.won,
+            'survivalTime': self.survivalTime,
+        }
+
+    def finalGridState(self):
+        return {'player': self.player, 'bots': self.bots}
+
+    def inputReplay(self):
+        replayData = super().inputReplay()
+        replayData['level'] = self.level
+        return replayData
+
+
+def simulateRun(mode, seed, gridSize, inputs, ticks, level=None, recordFrames=False):
+    """Replay a submitted run; raises SimulationError if it isn't a valid one"""
+    if mode == 'solo':
+        simulation = SoloSimulation(seed, gridSize, recordFrames)
+    elif mode == 'progressive':
+        simulation = ProgressiveSimulation(seed, gridSize, level, recordFrames)
+    else:
+        raise SimulationError(f'Unknown mode: {mode}')
+    return simulation.run(inputs, ticks)
+
+
+def replayInputs(replayData, recordFrames=False):
+    """Re-simulate a stored input replay"""
+    return simulateRun(
+        replayData['mode'],
+        replayData['seed'],
+        replayData['gridSize'],
+        replayData['inputs'],
+        replayData['ticks'],
+        replayData.get('level'),
+        recordFrames,
+    )
+
+
+def materializeReplay(replayData):
+    """Frames for any replay: input replays are re-simulated, recorded ones pass through"""
+    if replayData is None or replayData.get('format') != INPUT_REPLAY_FORMAT:
+        return replayData
+    if replayData.get('mode') == 'multiplayer':
+        # Multiplayer matches are re-run on the real engine (needs Django)
+        from .replay import replayMatch
+        return replayMatch(replayData)
+    return replayInputs(replayData, recordFrames=True).replayData()
+
+
+def replayOutcome(replayData):
+    """Authoritative score fields for a stored input replay (verify_runs worker)"""
+    return replayInputs(replayData).outcome()
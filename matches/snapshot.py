@@ -0,0 +1,451 @@
+import gzip
+import json
+import os
+import socket
+import time
+import uuid
+from django.conf import settings
+from .replaystore import REPLAY_WRITER, SegmentedReplay
+
+# redis is optional; without it snapshots go to the filesystem stand-in
+try:
+    import redis
+except ImportError:
+    redis = None
+
+SNAPSHOT_VERSION = 2
+
+# Identifies this worker process in snapshots and drain messages
+WORKER_ID = f'{socket.gethostname()}:{os.getpid()}'
+
+
+class SnapshotStore:
+    """Where engine snapshots live, keyed by match id, plus the matches offered to other workers.
+
+    A snapshot's input events (or recorded frames) only ever grow, so they are kept as an
+    append-only log of chunks next to it, one chunk per snapshot with whatever is new since the last.
+    """
+    name = None
+
+    def save(self, matchId, blob):
+        raise NotImplementedError
+
+    def load(self, matchId):
+        """Snapshot blob, or None"""
+        raise NotImplementedError
+
+    def append(self, matchId, index, blob):
+        """Store chunk number index of the match's log"""
+        raise NotImplementedError
+
+    def loadLog(self, matchId, count):
+        """The first count log chunks, or None if any of them is missing"""
+        raise NotImplementedError
+
+    def delete(self, matchId):
+        raise NotImplementedError
+
+    def offer(self, matchId):
+        """Hand the match off: any worker may claim it"""
+        raise NotImplementedError
+
+    def withdraw(self, matchId):
+        raise NotImplementedError
+
+    def pending(self):
+        """Match ids offered by draining workers"""
+        raise NotImplementedError
+
+    def claim(self, matchId, token):
+        """True for exactly one caller per (match, snapshot token)"""
+        raise NotImplementedError
+
+
+class RedisSnapshotStore(SnapshotStore):
+    """Snapshots in Redis, shared by every worker; keys expire after ttl seconds"""
+    name = 'redis'
+
+    def __init__(self, url, prefix='dash:snapshot', ttl=3600):
+        if redis is None:
+            raise RuntimeError('The redis snapshot store needs the redis package')
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def key(self, matchId):
+        return f'{self.prefix}:{matchId}'
+
+    def save(self, matchId, blob):
+        self.client.set(self.key(matchId), blob, ex=self.ttl)
+
+    def load(self, matchId):
+        return self.client.get(self.key(matchId))
+
+    def append(self, matchId, index, blob):
+        key = f'{self.key(matchId)}:log'
+        self.client.hset(key, index, blob)
+        self.client.expire(key, self.ttl)
+
+    def loadLog(self, matchId, count):
+        if not count:
+            return []
+        chunks = self.client.hmget(f'{self.key(matchId)}:log', list(range(count)))
+        return None if None in chunks else chunks
+
+    def delete(self, matchId):
+        self.client.delete(self.key(matchId), f'{self.key(matchId)}:log')
+        self.withdraw(matchId)
+
+    def offer(self, matchId):
+        self.client.sadd(f'{self.prefix}:handoff', matchId)
+
+    def withdraw(self, matchId):
+        self.client.srem(f'{self.prefix}:handoff', matchId)
+
+    def pending(self):
+        return [int(matchId) for matchId in self.client.smembers(f'{self.prefix}:handoff')]
+
+    def claim(self, matchId, token):
+        return bool(self.client.set(f'{self.prefix}:claim:{matchId}:{token}', WORKER_ID, nx=True, ex=self.ttl))
+
+
+class FileSystemSnapshotStore(SnapshotStore):
+    """Local stand-in: files under root, shared by the workers of one host"""
+    name = 'filesystem'
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def save(self, matchId, blob):
+        os.makedirs(self.root, exist_ok=True)
+        # Write then rename so readers never see a partial snapshot
+        path = self.path(f'{matchId}.snapshot')
+        tmpPath = f'{path}.{os.getpid()}.tmp'
+        with open(tmpPath, 'wb') as f:
+            f.write(blob)
+        os.replace(tmpPath, path)
+
+    def load(self, matchId):
+        try:
+            with open(self.path(f'{matchId}.snapshot'), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def append(self, matchId, index, blob):
+        os.makedirs(self.path('log'), exist_ok=True)
+        path = self.path('log', f'{matchId}-{index}')
+        tmpPath = f'{path}.{os.getpid()}.tmp'
+        with open(tmpPath, 'wb') as f:
+            f.write(blob)
+        os.replace(tmpPath, path)
+
+    def loadLog(self, matchId, count):
+        chunks = []
+        for index in range(count):
+            try:
+                with open(self.path('log', f'{matchId}-{index}'), 'rb') as f:
+                    chunks.append(f.read())
+            except FileNotFoundError:
+                return None
+        return chunks
+
+    def delete(self, matchId):
+        self.withdraw(matchId)
+        for path in [self.path(f'{matchId}.snapshot')] + [
+            self.path(folder, name) for folder in ('claims', 'log')
+            for name in self.listdir(folder) if name.startswith(f'{matchId}-')
+        ]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def offer(self, matchId):
+        os.makedirs(self.path('handoff'), exist_ok=True)
+        open(self.path('handoff', str(matchId)), 'wb').close()
+
+    def withdraw(self, matchId):
+        try:
+            os.remove(self.path('handoff', str(matchId)))
+        except FileNotFoundError:
+            pass
+
+    def pending(self):
+        return [int(name) for name in self.listdir('handoff')]
+
+    def claim(self, matchId, token):
+        os.makedirs(self.path('claims'), exist_ok=True)
+        try:
+            # O_EXCL: creating the marker succeeds for one process only
+            os.close(os.open(self.path('claims', f'{matchId}-{token}'), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            return False
+        return True
+
+    def listdir(self, name):
+        try:
+            return os.listdir(self.path(name))
+        except FileNotFoundError:
+            return []
+
+
+BACKENDS = {
+    RedisSnapshotStore.name: RedisSnapshotStore,
+    FileSystemSnapshotStore.name: FileSystemSnapshotStore,
+}
+
+_stores = {}
+
+
+def getSnapshotStore(name=None):
+    """Configured store instance for a backend name (GAME_SNAPSHOT_BACKEND by default)"""
+    name = name or getattr(settings, 'GAME_SNAPSHOT_BACKEND', 'filesystem')
+    if name not in _stores:
+        if name not in BACKENDS:
+            raise ValueError(f'Unknown snapshot store backend: {name}')
+        options = getattr(settings, 'GAME_SNAPSHOT_OPTIONS', {}).get(name, {})
+        _stores[name] = BACKENDS[name](**options)
+    return _stores[name]
+
+
+def engineSnapshot(engine, jobs=None, handoff=False):
+    """Everything needed to resume an engine on another worker, copied so the engine can keep ticking.
+
+    jobs holds the slots until the engine's next scheduler jobs ({'tick': 2, 'countdown': 17, ...}) so
+    the resumed match keeps its tick, countdown and spawn cadence. Input events (or, for a replay that
+    isn't streamed to segments, recorded frames) past engine.snapshotLog go in a 'chunk' for the
+    store's log and the cursor moves past them, so a snapshot costs the same however long the match runs.
+    """
+    version, internalState, gauss = engine.rng.getstate()
+    snapshot = {
+        'version': SNAPSHOT_VERSION,
+        'id': uuid.uuid4().hex,
+        'matchId': engine.matchId,
+        'engine': 'array' if hasattr(engine, 'rebuildArrays') else 'dict',
+        'gridSize': engine.gridSize,
+        'speed': engine.speed,
+        'wallSpawnInterval': engine.wallSpawnInterval,
+        'seed': engine.seed,
+        'rng': [version, list(internalState), gauss],
+        'bots': [engine.botDifficulty, engine.botReactionSpeed, engine.botRandomness],
+        'tickNumber': engine.tickNumber,
+        # [userId, player] pairs keep int user ids apart from 'bot_<id>' keys, in join order
+        'players': [[userId, dict(player)] for userId, player in engine.players.items()],
+        'walls': [[w['x'], w['y']] for w in engine.walls],
+        'countdownWalls': [[w['x'], w['y'], w['secondsLeft']] for w in engine.countdownWalls],
+        'roomGroupName': engine.roomGroupName,
+        'jobs': jobs or {},
+        'worker': WORKER_ID,
+        'savedAt': time.time(),
+        'handoff': handoff,
+    }
+    cursor = engine.snapshotLog
+    chunk = {}
+    if engine.inputLog is not None:
+        snapshot['inputLog'] = {'roster': list(engine.inputLog.roster)}
+        chunk['events'] = engine.inputLog.events[cursor['events']:]
+    else:
+        # The recorder's delta baseline, and the frames since the last segment when the replay is streamed
+        replay = engine.replay
+        snapshot['replay'] = {
+            'keyframeInterval': replay.keyframeInterval,
+            'gridSize': replay.gridSize,
+            'players': dict(replay.players),
+            'walls': list(replay.walls),
+            'flushedFrames': replay.flushedFrames,
+            'encoder': replay.encoder.keyframe() if replay.encoder.seq else None,
+            'segmentFrames': replay.segmentFrames,
+        }
+        if replay.segments is not None:
+            snapshot['replay']['frames'] = list(replay.frames)
+        else:
+            chunk['frames'] = replay.frames[cursor['frames']:]
+    if any(chunk.values()):
+        snapshot['chunk'] = chunk
+        cursor['chunks'] += 1
+        cursor['events'] += len(chunk.get('events', ()))
+        cursor['frames'] += len(chunk.get('frames', ()))
+    snapshot['log'] = dict(cursor)
+    return snapshot
+
+
+def saveSnapshot(engine, jobs=None, handoff=False):
+    """Snapshot the engine now and write it from the replay writer thread; returns the writer's future.
+
+    The writer runs segment writes in order, so the segment cursor it adds matches the frames in the snapshot.
+    """
+    return REPLAY_WRITER.submit(writeSnapshot, engineSnapshot(engine, jobs, handoff), engine.replay.segments)
+
+
+def writeSnapshot(snapshot, segments=None):
+    """Store a snapshot and its new log chunk (writer thread); a handoff snapshot is also offered to other workers"""
+    if segments is not None:
+        snapshot['replay']['segments'] = segmentCursor(segments)
+    store = getSnapshotStore()
+    chunk = snapshot.pop('chunk', None)
+    if chunk is not None:
+        store.append(snapshot['matchId'], snapshot['log']['chunks'] - 1, encodeSnapshot(chunk))
+    store.save(snapshot['matchId'], encodeSnapshot(snapshot))
+    if snapshot['handoff']:
+        store.offer(snapshot['matchId'])
+
+
+def discardSnapshot(matchId):
+    """Forget a finished match's snapshot (after any snapshot write still queued for it)"""
+    return REPLAY_WRITER.submit(getSnapshotStore().delete, matchId)
+
+
+def encodeSnapshot(value):
+    return gzip.compress(json.dumps(value, separators=(',', ':')).encode(), compresslevel=1)
+
+
+def loadSnapshot(matchId):
+    """Snapshot with its log chunks put back into the events or frames, or None (missing or with a gap in its log)"""
+    store = getSnapshotStore()
+    blob = store.load(matchId)
+    if blob is None:
+        return None
+    snapshot = json.loads(gzip.decompress(blob))
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        return snapshot
+    cursor = snapshot['log']
+    chunks = store.loadLog(matchId, cursor['chunks'])
+    if chunks is None:
+        return None
+    events, frames = [], []
+    for chunk in chunks:
+        chunk = json.loads(gzip.decompress(chunk))
+        events.extend(chunk.get('events', ()))
+        frames.extend(chunk.get('frames', ()))
+    if len(events) != cursor['events'] or len(frames) != cursor['frames']:
+        return None
+    if 'inputLog' in snapshot:
+        snapshot['inputLog']['events'] = events
+    else:
+        snapshot['replay']['frames'] = snapshot['replay'].get('frames', []) + frames
+    return snapshot
+
+
+def claimSnapshot(matchId):
+    """The match's snapshot, for the worker that now holds its ownership lease (blocking store I/O).
+
+    The lease already keeps a live owner's match from being resumed twice; the claim (one per
+    snapshot) also covers a worker whose lease lapsed while it was still writing.
+    """
+    snapshot = loadSnapshot(matchId)
+    if snapshot is None or snapshot.get('version') != SNAPSHOT_VERSION:
+        return None
+    store = getSnapshotStore()
+    if not store.claim(matchId, snapshot['id']):
+        return None
+    store.withdraw(matchId)
+    return snapshot
+
+
+def segmentCursor(segments):
+    """Where a streamed replay's segment writer is up to (writer thread)"""
+    index = segments.index
+    return {
+        'key': segments.key,
+        'backend': segments.store.name,
+        'codec': segments.codec,
+        'level': segments.level,
+        'segments': segments.segments,
+        'size': segments.size,
+        'rawSize': segments.rawSize,
+        'storedReplay': segments.storedReplay.id if segments.storedReplay else None,
+        'index': {
+            'frameCount': index.frameCount,
+            'size': index.size,
+            'keyframes': index.keyframes,
+            'events': index.events,
+            'rows': index.rows,
+            'previous': index.previous,
+        },
+    }
+
+
+def restoreSegments(matchId, cursor):
+    """SegmentedReplay that carries on writing a streamed replay from a segment cursor"""
+    from .consumers import attachMatchReplay
+    from .models import StoredReplay
+    segments = SegmentedReplay(
+        attach=lambda storedReplay: attachMatchReplay(matchId, storedReplay),
+        backend=cursor['backend'],
+        codec=cursor['codec'],
+        level=cursor['level'],
+    )
+    segments.key = cursor['key']
+    segments.segments = cursor['segments']
+    segments.size = cursor['size']
+    segments.rawSize = cursor['rawSize']
+    if cursor['storedReplay'] is not None:
+        # Only its id is used (updates are filtered by id), so no query
+        segments.storedReplay = StoredReplay(id=cursor['storedReplay'], key=cursor['key'])
+    index = segments.index
+    index.frameCount = cursor['index']['frameCount']
+    index.size = cursor['index']['size']
+    index.keyframes = cursor['index']['keyframes']
+    index.events = cursor['index']['events']
+    index.rows = cursor['index']['rows']
+    index.previous = {key: tuple(state) for key, state in cursor['index']['previous'].items()}
+    return segments
+
+
+def restoreEngine(snapshot):
+    """Rebuild an engine from a snapshot; it carries on exactly where the snapshotted one stopped"""
+    from .consumers import GameEngine, CELL_COUNTDOWN
+    engineClass = GameEngine
+    if snapshot['engine'] == 'array':
+        from .kernel import ArrayGameEngine
+        engineClass = ArrayGameEngine
+    engine = engineClass(
+        snapshot['matchId'],
+        snapshot['gridSize'],
+        snapshot['speed'],
+        snapshot['wallSpawnInterval'],
+        seed=snapshot['seed'],
+        replayFormat='inputs' if 'inputLog' in snapshot else 'frames',
+        botSettings=tuple(snapshot['bots']),
+    )
+    version, internalState, gauss = snapshot['rng']
+    engine.rng.setstate((version, tuple(internalState), gauss))
+    engine.tickNumber = snapshot['tickNumber']
+    engine.roomGroupName = snapshot['roomGroupName']
+    # The next snapshot appends to the same log
+    engine.snapshotLog = dict(snapshot['log'])
+
+    engine.players = {userId: player for userId, player in snapshot['players']}
+    for player in engine.players.values():
+        if player['alive']:
+            engine.headCounts[engine.cellIndex(player['x'], player['y'])] += 1
+    for x, y in snapshot['walls']:
+        engine.addWall(x, y)
+    for x, y, secondsLeft in snapshot['countdownWalls']:
+        engine.countdownWalls.append({'x': x, 'y': y, 'secondsLeft': secondsLeft})
+        engine.occupancy[engine.cellIndex(x, y)] = CELL_COUNTDOWN
+
+    if 'inputLog' in snapshot:
+        engine.inputLog.roster = snapshot['inputLog']['roster']
+        engine.inputLog.events = snapshot['inputLog']['events']
+    else:
+        state = snapshot['replay']
+        replay = engine.replay
+        replay.gridSize = state['gridSize']
+        replay.players = state['players']
+        replay.walls = state['walls']
+        replay.frames = state['frames']
+        replay.flushedFrames = state['flushedFrames']
+        if state['encoder'] is not None:
+            replay.encoder.restore(state['encoder'])
+        if 'segments' in state:
+            replay.streamTo(restoreSegments(engine.matchId, state['segments']), state['segmentFrames'])
+
+    # Broadcasts restart with a keyframe: clients reconnecting to this worker have no baseline
+    if hasattr(engine, 'rebuildArrays'):
+        engine.rebuildArrays()
+    return engine
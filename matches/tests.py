@@ -1,3 +1,1050 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import os
+import tempfile
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import AsyncMock, patch
+from asgiref.sync import async_to_sync
+from channels.layers import InMemoryChannelLayer
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from accounts.models import Profile
+from shop.models import Transaction
+from .consumers import GameConsumer, GameEngine, frameGroupName, REFUSED_CLOSE_CODE
+from .harness import EngineHarness
+from .kernel import ArrayGameEngine
+from .metrics import prometheusText, startMetricsServer, BUCKETS, PHASES
+from .ownership import LocalOwnershipRegistry, MatchOwnership, getOwnershipRegistry
+from .gamelog import quiet
+from .protocol import DeltaEncoder, BinaryPacker, BinaryUnpacker, STATIC_PLAYER_FIELDS, DYNAMIC_PLAYER_FIELDS
+from .models import Match, MatchType, MatchParticipation, SettlementJob, SoloRun, ProgressiveRun, ReplayView, StoredReplay
+from .replay import replayMatch, expandFrames, seekIndex
+from .replaystore import getReplayStore, loadMaterialized, loadReplay, segmentKey, storeReplay, SegmentedReplay
+from .scheduler import TickScheduler, SLOT_SECONDS
+from .snapshot import engineSnapshot, getSnapshotStore, loadSnapshot, restoreEngine, writeSnapshot
+from .settlement import settleMatch, enqueueSettlement, runDueSettlements
+from .simulation import Mulberry32, simulateRun
+from .views import readRunSeed
 
-# Create your tests here.
+
+def replayFrames(count):
+    return [
+        {'player': {'x': i, 'y': 0, 'alive': True}, 'bots': [], 'wallsHit': 0, 'botsEliminated': 0}
+        for i in range(count)
+    ]
+
+
+class ReplayAccessTests(TestCase):
+    """Replay data only reaches the run's owner and users who paid to watch it"""
+
+    def setUp(self):
+        User = get_user_model()
+        self.owner = User.objects.create_user('owner', password='pw')
+        self.viewer = User.objects.create_user('viewer', password='pw')
+        replayData = {'frames': replayFrames(30), 'frameDuration': 150, 'mode': 'solo'}
+        self.run = SoloRun.objects.create(player=self.owner, survivalTime=4, storedReplay=storeReplay(replayData))
+        self.streamUrl = reverse('matches:replayStream', args=['solo', self.run.id])
+        self.indexUrl = reverse('matches:replayIndex', args=['solo', self.run.id])
+
+    def testOwnerCanStream(self):
+        self.client.force_login(self.owner)
+        response = self.client.get(self.streamUrl)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 31)
+
+    def testUnpaidViewerIsRefused(self):
+        self.client.force_login(self.viewer)
+        for headers in ({}, {'Range': 'bytes=0-99'}, {'If-None-Match': self.run.storedReplay.etag}):
+            response = self.client.get(self.streamUrl, headers=headers)
+            self.assertEqual(response.status_code, 403)
+            self.assertNotIn('ETag', response)
+        self.assertEqual(self.client.get(self.streamUrl + '?start=1').status_code, 403)
+
+    def testPaidViewerCanStream(self):
+        ReplayView.objects.create(user=self.viewer.profile, replay_type='solo', replay_id=self.run.id, paid=True)
+        self.client.force_login(self.viewer)
+        response = self.client.get(self.streamUrl, headers={'Range': 'bytes=0-9'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(len(response.content), 10)
+
+    def testUnpaidViewerGetsNoIndex(self):
+        self.client.force_login(self.viewer)
+        response = self.client.get(self.indexUrl)
+        self.assertEqual(response.status_code, 403)
+        self.assertNotIn('keyframes', response.json())
+
+    def testOwnerAndPaidViewerGetIndex(self):
+        ReplayView.objects.create(user=self.viewer.profile, replay_type='solo', replay_id=self.run.id, paid=True)
+        for user in (self.owner, self.viewer):
+            self.client.force_login(user)
+            response = self.client.get(self.indexUrl)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['frameCount'], 30)
+
+
+class ReplayStoreTests(TestCase):
+    """Replays round-trip through each store as gzip blobs, and migrate_replays moves inline ones there"""
+
+    BACKENDS = ('database', 'filesystem')
+
+    def setUp(self):
+        root = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(REPLAY_STORE_OPTIONS={'filesystem': {'root': root}}))
+        self.enterContext(patch.dict('matches.replaystore._stores', clear=True))
+        cache.clear()
+        self.player = get_user_model().objects.create_user('recorder', password='pw')
+
+    def testRecordedReplayRoundTrip(self):
+        replayData = {'frames': replayFrames(30), 'frameDuration': 150, 'mode': 'solo'}
+        for backend in self.BACKENDS:
+            with self.subTest(backend=backend):
+                storedReplay = storeReplay(replayData, backend=backend, codec='gzip')
+                self.assertEqual((storedReplay.backend, storedReplay.codec, storedReplay.frameCount), (backend, 'gzip', 30))
+                blob = getReplayStore(backend).load(storedReplay.key)
+                self.assertEqual(len(blob), storedReplay.size)
+                self.assertEqual(json.loads(gzip.decompress(blob)), replayData)
+                self.assertEqual(loadReplay(storedReplay), replayData)
+                self.assertEqual(loadMaterialized(storedReplay), replayData)
+                self.assertIsNotNone(storedReplay.seekIndex)
+
+    def testInputReplayIsMaterialized(self):
+        inputReplay = simulateRun('solo', 123456789, 15, SimulationTests.SOLO_INPUTS, 200).inputReplay()
+        for backend in self.BACKENDS:
+            with self.subTest(backend=backend):
+                storedReplay = storeReplay(inputReplay, backend=backend, codec='gzip')
+                self.assertIsNone(storedReplay.seekIndex)
+                self.assertEqual(loadReplay(storedReplay), inputReplay)
+                materialized = loadMaterialized(storedReplay)
+                self.assertEqual(len(materialized['frames']), 118)
+                # Served from the cache the second time, without re-simulating
+                with patch('matches.replaystore.materializeReplay') as materialize:
+                    self.assertEqual(loadMaterialized(storedReplay), materialized)
+                materialize.assert_not_called()
+
+    def testDeletingTheRowDeletesTheBlob(self):
+        storedReplay = storeReplay({'frames': replayFrames(3)}, backend='filesystem', codec='gzip')
+        path = getReplayStore('filesystem').path(storedReplay.key)
+        self.assertTrue(os.path.exists(path))
+        storedReplay.delete()
+        self.assertFalse(os.path.exists(path))
+
+    def testMigrateReplays(self):
+        legacy = {'frames': replayFrames(12), 'frameDuration': 150, 'mode': 'solo'}
+        run = SoloRun.objects.create(player=self.player, survivalTime=2, replayData=legacy)
+        out = StringIO()
+        call_command('migrate_replays', backend='filesystem', codec='gzip', stdout=out)
+        self.assertIn('SoloRun: moved 1 replays', out.getvalue())
+        run.refresh_from_db()
+        self.assertIsNone(run.replayData)
+        self.assertEqual(run.storedReplay.backend, 'filesystem')
+        self.assertEqual(loadReplay(run.storedReplay), legacy)
+        self.assertEqual(run.getReplayData(), legacy)
+
+        # Nothing left to move the second time
+        out = StringIO()
+        call_command('migrate_replays', stdout=out)
+        self.assertIn('SoloRun: moved 0 replays', out.getvalue())
+
+
+class SegmentedReplayTests(TransactionTestCase):
+    """A replay streamed in segments from the writer thread loads back as the whole replay"""
+
+    def setUp(self):
+        root = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(REPLAY_STORE_OPTIONS={'filesystem': {'root': root}}))
+        self.enterContext(patch.dict('matches.replaystore._stores', clear=True))
+        self.enterContext(quiet())
+
+    def record(self, segments=None):
+        harness = EngineHarness(
+            gridSize=20, speed='FAST', wallSpawnInterval=1, seed=8, serialize=False,
+            settings={'GAME_REPLAY_FORMAT': 'frames', 'GAME_REPLAY_KEYFRAME_INTERVAL': 25},
+        )
+        harness.addHumans(2, inputRate=0.1)
+        harness.addBots(6)
+        replay = harness.engine.replay
+        if segments is not None:
+            replay.streamTo(segments, 40)
+        for _ in range(230):
+            harness.step()
+        return replay
+
+    def testSegmentsReassemble(self):
+        whole = self.record().build(100)
+        segments = SegmentedReplay(backend='filesystem', codec='gzip')
+        replay = self.record(segments)
+        # 40 frames round up to whole keyframe intervals: 50-frame segments, four flushed during the match
+        self.assertEqual((replay.segmentFrames, replay.flushedFrames, len(replay.frames)), (50, 200, 30))
+        storedReplay = replay.flush(100, final=True).result()
+
+        self.assertEqual((storedReplay.segments, storedReplay.frameCount, storedReplay.complete), (5, 230, True))
+        store = getReplayStore('filesystem')
+        for segment in range(5):
+            self.assertTrue(os.path.exists(store.path(segmentKey(storedReplay.key, segment))))
+        storedReplay.refresh_from_db()
+        self.assertEqual(loadReplay(storedReplay), whole)
+        self.assertEqual(storedReplay.seekIndex, seekIndex(whole))
+
+
+class HeadCountTests(TestCase):
+    """Alive heads per cell, for any number of players on one cell"""
+
+    engineClass = GameEngine
+
+    def testCountsPast255(self):
+        # Every spawn on a 3x3 board is the centre cell
+        engine = self.engineClass('heads', 3, 'FAST', 0, seed=1, botSettings=(5, 5, 5))
+        for i in range(300):
+            engine.addPlayer(f'bot_{i}', f'Bot {i}', '#ef4444', isBot=True)
+        centre = engine.cellIndex(1, 1)
+        self.assertEqual(engine.headCounts[centre], 300)
+        engine.removePlayer('bot_0')
+        self.assertEqual(engine.headCounts[centre], 299)
+        engine.tick()
+        self.assertCountsMatch(engine)
+
+    def testEliminationsClearTheHead(self):
+        engine = self.engineClass('heads', 12, 'FAST', 0, seed=1, botSettings=(5, 5, 5))
+        for i in range(4):
+            engine.addPlayer(f'bot_{i}', f'Bot {i}', '#ef4444', isBot=True)
+        engine.handlePlayerCollision('bot_0', 'bot_1')
+        engine.handlePlayerCollision('bot_0', 'bot_1')
+        self.assertCountsMatch(engine)
+        for _ in range(51):
+            engine.handleWallHit('bot_2')
+        self.assertFalse(engine.players['bot_2']['alive'])
+        self.assertCountsMatch(engine)
+        self.assertEqual(sum(engine.headCounts), 2)
+
+    def assertCountsMatch(self, engine):
+        for index in range(engine.gridSize * engine.gridSize):
+            alive = sum(1 for p in engine.players.values() if p['alive'] and engine.cellIndex(p['x'], p['y']) == index)
+            self.assertEqual(engine.headCounts[index], alive)
+
+
+class ArrayHeadCountTests(HeadCountTests):
+    engineClass = ArrayGameEngine
+
+
+PLAYER_FIELDS = ('x', 'y', 'direction', 'alive', 'score', 'hits')
+
+
+def engineState(engine):
+    """Everything a tick can change, comparable across engine implementations"""
+    return (
+        {userId: tuple(player[field] for field in PLAYER_FIELDS) for userId, player in engine.players.items()},
+        [(wall['x'], wall['y']) for wall in engine.walls],
+        [(wall['x'], wall['y'], wall['secondsLeft']) for wall in engine.countdownWalls],
+        bytes(engine.occupancy),
+        engine.headCounts.tobytes(),
+    )
+
+
+class ArrayEngineEquivalenceTests(TestCase):
+    """ArrayGameEngine is a drop-in GameEngine: same seed and inputs, same game, tick for tick"""
+
+    def harness(self, engineClass, seed):
+        harness = EngineHarness(gridSize=24, speed='FAST', wallSpawnInterval=1, seed=seed, engineClass=engineClass)
+        harness.addHumans(4, inputRate=0.2)
+        harness.addBots(12)
+        harness.direct(5, 1, 'LEFT')
+        harness.direct(5, 2, 'LEFT')
+        return harness
+
+    def testSameGameEveryTick(self):
+        for seed in (1, 7, 42):
+            with self.subTest(seed=seed):
+                dictRun, arrayRun = self.harness(GameEngine, seed), self.harness(ArrayGameEngine, seed)
+                self.assertEqual(engineState(dictRun.engine), engineState(arrayRun.engine))
+                for tick in range(1, 301):
+                    running = dictRun.step()
+                    self.assertEqual(arrayRun.step(), running, f'tick {tick}')
+                    self.assertEqual(engineState(dictRun.engine), engineState(arrayRun.engine), f'tick {tick}')
+                    if not running:
+                        break
+
+
+class FrameBroadcastTests(TestCase):
+    """Each socket's frame group gets a tick frame in one encoding"""
+
+    def receiveFrames(self, engine):
+        async def run():
+            layer = InMemoryChannelLayer()
+            engine.roomGroupName = 'match_frames'
+            engine.running = True
+            textChannel, binaryChannel = await layer.new_channel(), await layer.new_channel()
+            await layer.group_add(frameGroupName(engine.roomGroupName, False), textChannel)
+            await layer.group_add(frameGroupName(engine.roomGroupName, True), binaryChannel)
+            await engine.runFrame(layer)
+            return await layer.receive(textChannel), await layer.receive(binaryChannel)
+        return async_to_sync(run)()
+
+    def engine(self):
+        engine = GameEngine('frames', 20, 'FAST', 0, seed=3, botSettings=(5, 5, 5))
+        engine.addPlayer('bot_0', 'Bot 0', '#ef4444', isBot=True)
+        engine.addPlayer('bot_1', 'Bot 1', '#ef4444', isBot=True)
+        return engine
+
+    def testOneEncodingPerGroup(self):
+        text, binary = self.receiveFrames(self.engine())
+        self.assertEqual(set(text), {'type', 'text'})
+        self.assertEqual(set(binary), {'type', 'bytes'})
+
+    def testBinaryGroupFallsBackToText(self):
+        engine = self.engine()
+        engine.statePacker.failed = True
+        text, binary = self.receiveFrames(engine)
+        self.assertEqual(binary, text)
+
+    def testBoardTooLargeToPackStaysOnJson(self):
+        engine = GameEngine('frames', 300, 'FAST', 0, seed=3, botSettings=(5, 5, 5))
+        engine.addPlayer('bot_0', 'Bot 0', '#ef4444', isBot=True)
+        engine.addPlayer('bot_1', 'Bot 1', '#ef4444', isBot=True)
+        for _ in range(3):
+            text, binary = self.receiveFrames(engine)
+            self.assertEqual(binary, text)
+            self.assertTrue(engine.statePacker.failed)
+
+
+def applyDelta(state, delta):
+    """The match page's applyDelta: the next state from the previous one plus a delta message"""
+    players = dict(state['players'])
+    for key, changes in delta.get('players', {}).items():
+        players[key] = {**players.get(key, {}), **changes}
+    for key in delta.get('removedPlayers', ()):
+        del players[key]
+    countdownWalls = {(w['x'], w['y']): w for w in state['countdownWalls']}
+    countdown = delta.get('countdown', {})
+    for x, y in countdown.get('remove', ()):
+        del countdownWalls[x, y]
+    for x, y, secondsLeft in countdown.get('add', []) + countdown.get('set', []):
+        countdownWalls[x, y] = {'x': x, 'y': y, 'secondsLeft': secondsLeft}
+    return {
+        'tick': delta['tick'],
+        'gridSize': state['gridSize'],
+        'players': players,
+        'walls': state['walls'] + [{'x': x, 'y': y} for x, y in delta.get('walls', ())],
+        'countdownWalls': list(countdownWalls.values()),
+        'aliveCount': delta.get('aliveCount', state['aliveCount']),
+    }
+
+
+def publicState(state):
+    """The parts of getState() (or a client's rebuilt state) that gameState messages carry"""
+    return {
+        'tick': state['tick'],
+        'gridSize': state['gridSize'],
+        'players': {
+            key: {field: player[field] for field in STATIC_PLAYER_FIELDS + DYNAMIC_PLAYER_FIELDS}
+            for key, player in state['players'].items()
+        },
+        'walls': [(w['x'], w['y']) for w in state['walls']],
+        'countdownWalls': sorted((w['x'], w['y'], w['secondsLeft']) for w in state['countdownWalls']),
+        'aliveCount': state['aliveCount'],
+    }
+
+
+class DeltaEncoderTests(TestCase):
+    """Deltas applied to the last keyframe rebuild exactly the engine's state, through joins, deaths and walls"""
+
+    def setUp(self):
+        self.enterContext(quiet())
+
+    def match(self):
+        harness = EngineHarness(gridSize=16, speed='FAST', wallSpawnInterval=1, seed=21, serialize=False)
+        harness.addHumans(3, inputRate=0.2)
+        harness.addBots(6)
+        return harness
+
+    def play(self, harness, encoder, state, ticks, seen):
+        engine = harness.engine
+        for _ in range(ticks):
+            if engine.tickNumber == 30:
+                engine.addPlayer(50, 'Late', '#f59e0b')
+            if engine.tickNumber == 45:
+                engine.removePlayer('bot_1')
+            harness.step()
+            message = encoder.encode(engine)
+            seen.update(message.get('countdown', {}))
+            seen.update(key for key in ('removedPlayers', 'walls', 'aliveCount') if key in message)
+            if message['type'] == 'delta' and any('username' in p for p in message.get('players', {}).values()):
+                seen.add('join')
+            state = message if message['type'] == 'keyframe' else applyDelta(state, message)
+            self.assertEqual(publicState(state), publicState(engine.getState()), f'tick {engine.tickNumber}')
+        return state
+
+    def testDeltasRebuildTheState(self):
+        harness, encoder, seen = self.match(), DeltaEncoder(keyframeInterval=25), set()
+        self.play(harness, encoder, None, 120, seen)
+        self.assertEqual(seen, {'join', 'add', 'set', 'remove', 'removedPlayers', 'walls', 'aliveCount'})
+
+    def testResyncFromKeyframe(self):
+        harness, encoder, seen = self.match(), DeltaEncoder(keyframeInterval=1000), set()
+        state = self.play(harness, encoder, None, 40, seen)
+        # A client that missed messages takes the encoder's baseline and carries on from there
+        resynced = json.loads(json.dumps(encoder.keyframe()))
+        self.assertEqual(resynced['seq'], encoder.seq)
+        self.assertEqual(publicState(resynced), publicState(state))
+        self.play(harness, encoder, resynced, 40, seen)
+
+    def testRestoredEncoderContinuesTheSequence(self):
+        harness, encoder, seen = self.match(), DeltaEncoder(keyframeInterval=1000), set()
+        state = self.play(harness, encoder, None, 40, seen)
+        restored = DeltaEncoder(keyframeInterval=1000)
+        restored.restore(json.loads(json.dumps(encoder.keyframe())))
+        harness.step()
+        delta = restored.encode(harness.engine)
+        self.assertEqual((delta['type'], delta['seq']), ('delta', encoder.seq + 1))
+        state = applyDelta(state, delta)
+        self.assertEqual(publicState(state), publicState(harness.engine.getState()))
+        self.play(harness, restored, state, 40, seen)
+
+
+class BinaryPackerTests(TestCase):
+    """Binary frames unpack to the keyframe/delta messages they were packed from"""
+
+    def setUp(self):
+        self.enterContext(quiet())
+
+    def expected(self, message):
+        """The message as JSON clients get it, in the shape an unpacked frame has"""
+        message = json.loads(json.dumps(message))
+        if 'countdown' in message:
+            message['countdown'] = {section: message['countdown'].get(section, []) for section in ('add', 'set', 'remove')}
+        return message
+
+    def testRoundTrip(self):
+        harness = EngineHarness(gridSize=16, speed='FAST', wallSpawnInterval=1, seed=21, serialize=False)
+        harness.addHumans(3, inputRate=0.2)
+        harness.addBots(6)
+        encoder, packer, unpacker = DeltaEncoder(keyframeInterval=25), BinaryPacker(), BinaryUnpacker()
+        kinds = set()
+        for tick in range(1, 121):
+            if tick == 30:
+                harness.engine.addPlayer(50, 'Late', '#f59e0b')
+            if tick == 45:
+                harness.engine.removePlayer('bot_1')
+            harness.step()
+            message = encoder.encode(harness.engine)
+            kinds.add(message['type'])
+            frame = packer.pack(message)
+            self.assertIsNotNone(frame, f'tick {tick}')
+            self.assertEqual(unpacker.unpack(frame), self.expected(message), f'tick {tick}')
+        self.assertEqual(kinds, {'keyframe', 'delta'})
+        # A resync keyframe rebuilds the roster for an unpacker that has seen nothing
+        self.assertEqual(BinaryUnpacker().unpack(packer.pack(encoder.keyframe())), self.expected(encoder.keyframe()))
+
+    def testOversizedBoardFailsForGood(self):
+        packer = BinaryPacker()
+        keyframe = {'type': 'keyframe', 'seq': 1, 'tick': 0, 'gridSize': 256, 'players': {}, 'walls': [],
+                    'countdownWalls': [], 'aliveCount': 0}
+        self.assertIsNone(packer.pack(keyframe))
+        self.assertTrue(packer.failed)
+        # Later frames that would fit still aren't packed: the client never got the keyframe they build on
+        self.assertIsNone(packer.pack({**keyframe, 'gridSize': 16}))
+        self.assertIsNone(packer.pack({'type': 'delta', 'seq': 2, 'tick': 1}))
+
+
+class RunSeedTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('runner', password='pw')
+        self.client.force_login(self.user)
+        self.url = reverse('matches:runSeed')
+
+    def testIssuesSignedSeed(self):
+        response = self.client.post(self.url, '{"mode": "progressive"}', content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(readRunSeed(response.json()['token'], self.user, 'progressive'), response.json()['seed'])
+
+    def testRejectsBadBodies(self):
+        for body in ('', 'not json', '[]', '{}', '{"mode": "multiplayer"}'):
+            with self.subTest(body=body):
+                response = self.client.post(self.url, body, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.json())
+
+
+class SaveRunCleanupTests(TestCase):
+    """A run that fails to save leaves no replay behind"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('saver', password='pw')
+        self.client.force_login(self.user)
+
+    def save(self, mode, **fields):
+        token = self.client.post(reverse('matches:runSeed'), json.dumps({'mode': mode}), content_type='application/json').json()['token']
+        body = {'seedToken': token, 'gridSize': 15, 'inputs': [], 'ticks': 40, **fields}
+        view = 'matches:saveSoloRun' if mode == 'solo' else 'matches:saveProgressiveRun'
+        with patch('matches.views.Transaction.objects.create', side_effect=RuntimeError('ledger down')):
+            return self.client.post(reverse(view), json.dumps(body), content_type='application/json').json()
+
+    def testFailedSaveDeletesTheReplay(self):
+        for mode, fields in (('solo', {}), ('progressive', {'level': 1})):
+            with self.subTest(mode=mode):
+                self.assertEqual(self.save(mode, **fields), {'success': False, 'error': 'ledger down'})
+                self.assertFalse(StoredReplay.objects.exists())
+        self.assertFalse(SoloRun.objects.exists())
+        self.assertFalse(ProgressiveRun.objects.exists())
+
+
+class RefusedSocketTests(TransactionTestCase):
+    """Sockets that may not join a match are closed with a code the client doesn't retry on"""
+
+    def closeCode(self, user):
+        async def run():
+            communicator = WebsocketCommunicator(GameConsumer.as_asgi(), '/ws/match/999/')
+            communicator.scope['user'] = user
+            communicator.scope['url_route'] = {'kwargs': {'matchId': 999}}
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            output = await communicator.receive_output()
+            await communicator.wait()
+            return output
+        return async_to_sync(run)()
+
+    def testAnonymousUser(self):
+        self.assertEqual(self.closeCode(AnonymousUser()), {'type': 'websocket.close', 'code': REFUSED_CLOSE_CODE})
+
+    def testNonParticipant(self):
+        user = get_user_model().objects.create_user('stranger', password='pw')
+        self.assertEqual(self.closeCode(user), {'type': 'websocket.close', 'code': REFUSED_CLOSE_CODE})
+
+
+class SnapshotOrderTests(TestCase):
+    """A snapshot due in the same slot as a tick is taken after that tick has run"""
+
+    def testSnapshotFollowsTheSlotsTick(self):
+        scheduler = TickScheduler()
+        scheduler.origin, scheduler.policy, scheduler.maxCatchUp = 0.0, 'catchup', 3
+        engine = GameEngine('snapshot', 20, 'FAST', 0, seed=5, botSettings=(5, 5, 5))
+        engine.addPlayer('bot_0', 'Bot 0', '#ef4444', isBot=True)
+        engine.addPlayer('bot_1', 'Bot 1', '#ef4444', isBot=True)
+        engine.running, engine.roomGroupName = True, 'match_snapshot'
+        scheduler.engines[engine.matchId] = engine
+        scheduler.schedule(engine, 'tick', 1)
+        scheduler.schedule(engine, 'snapshot', 1)
+        scheduler.currentSlot = 1
+
+        taken = []
+        with override_settings(GAME_SNAPSHOT_INTERVAL=5), \
+                patch('matches.scheduler.saveSnapshot', lambda engine, jobs: taken.append((engine.tickNumber, jobs))):
+            async_to_sync(scheduler.runSlot)(1, SLOT_SECONDS, InMemoryChannelLayer())
+        # FAST ticks every 4 slots: the snapshot holds tick 1 and the next tick 4 slots on
+        self.assertEqual(taken, [(1, {'tick': 4})])
+
+
+class MetricsTests(TestCase):
+    """Prometheus exposition of the tick phase histograms, and who may scrape it"""
+
+    def setUp(self):
+        self.enterContext(quiet())
+
+    def samples(self, text, name):
+        """(labels, value) pairs of one metric, in exposition order"""
+        return [
+            (line[len(name):line.rindex(' ')], float(line[line.rindex(' ') + 1:]))
+            for line in text.splitlines() if line.startswith(name + '{')
+        ]
+
+    def testPhaseHistograms(self):
+        harness = EngineHarness(gridSize=20, speed='FAST', wallSpawnInterval=1, seed=4)
+        harness.addBots(6)
+        for _ in range(12):
+            harness.step()
+        scheduler = TickScheduler()
+        scheduler.engines[harness.engine.matchId] = harness.engine
+        for retired in (False, True):
+            if retired:
+                # A finished engine's timings stay in the worker totals
+                scheduler.remove(harness.engine.matchId)
+            text = prometheusText(scheduler)
+            counts = dict(self.samples(text, 'dash_engine_phase_seconds_count'))
+            for phase in PHASES:
+                with self.subTest(phase=phase, retired=retired):
+                    buckets = [(labels, value) for labels, value in self.samples(text, 'dash_engine_phase_seconds_bucket')
+                               if f'phase="{phase}"' in labels]
+                    self.assertEqual(len(buckets), len(BUCKETS) + 1)
+                    values = [value for _, value in buckets]
+                    self.assertEqual(values, sorted(values))
+                    self.assertTrue(buckets[-1][0].endswith('le="+Inf"}'))
+                    self.assertEqual(buckets[-1][1], counts[f'{{phase="{phase}"}}'])
+            self.assertEqual(counts['{phase="movement"}'], 12)
+
+    def testMetricsNeedStaffOrToken(self):
+        url = reverse('matches:engineMetrics')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        User = get_user_model()
+        self.client.force_login(User.objects.create_user('player', password='pw'))
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.logout()
+        with self.settings(GAME_METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+        # No token configured: an empty bearer doesn't match it
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+        self.client.force_login(User.objects.create_user('admin', password='pw', is_staff=True))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('dash_scheduler_ticks_total', response.content.decode())
+
+
+class MetricsServerTests(TestCase):
+    """runengines workers serve their own metrics over plain HTTP"""
+
+    def get(self, path, authorization=None):
+        async def run():
+            server = await startMetricsServer(TickScheduler(), '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            header = f'Authorization: {authorization}\r\n' if authorization else ''
+            writer.write(f'GET {path} HTTP/1.1\r\nHost: worker\r\n{header}\r\n'.encode())
+            response = await reader.read()
+            writer.close()
+            server.close()
+            await server.wait_closed()
+            return response.decode()
+        return async_to_sync(run)()
+
+    def testServesMetricsAndStats(self):
+        self.assertIn('dash_scheduler_ticks_total 0', self.get('/metrics'))
+        response = self.get('/stats')
+        self.assertTrue(response.startswith('HTTP/1.1 200 OK'))
+        self.assertEqual(json.loads(response.split('\r\n\r\n', 1)[1])['enginesHosted'], 0)
+        self.assertTrue(self.get('/other').startswith('HTTP/1.1 404'))
+
+    @override_settings(GAME_METRICS_TOKEN='secret')
+    def testNeedsTheTokenWhenSet(self):
+        self.assertTrue(self.get('/metrics').startswith('HTTP/1.1 403'))
+        self.assertTrue(self.get('/metrics', 'Bearer wrong').startswith('HTTP/1.1 403'))
+        self.assertTrue(self.get('/metrics', 'Bearer secret').startswith('HTTP/1.1 200'))
+
+
+class SnapshotLogTests(TestCase):
+    """Snapshots store only the events or frames since the previous one, and still resume the whole match"""
+
+    def setUp(self):
+        root = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(
+            GAME_SNAPSHOT_BACKEND='filesystem', GAME_SNAPSHOT_OPTIONS={'filesystem': {'root': root}},
+        ))
+        self.enterContext(patch.dict('matches.snapshot._stores', clear=True))
+        self.enterContext(quiet())
+
+    def harness(self, replayFormat):
+        harness = EngineHarness(
+            gridSize=24, speed='FAST', wallSpawnInterval=1, seed=9, matchId=77,
+            settings={'GAME_REPLAY_FORMAT': replayFormat, 'GAME_REPLAY_SEGMENT_FRAMES': 0},
+        )
+        harness.addHumans(2, inputRate=0.2)
+        harness.addBots(4)
+        return harness
+
+    def recorded(self, engine):
+        return engine.inputLog.events if engine.inputLog is not None else engine.replay.frames
+
+    def testSnapshotsAppendAndResume(self):
+        for replayFormat in ('inputs', 'frames'):
+            with self.subTest(replayFormat=replayFormat):
+                live, resumed = self.harness(replayFormat), self.harness(replayFormat)
+                stored = 0
+                for _ in range(4):
+                    for _ in range(40):
+                        live.step()
+                        resumed.step()
+                    snapshot = engineSnapshot(resumed.engine)
+                    recorded = self.recorded(resumed.engine)
+                    self.assertEqual(sum(map(len, snapshot['chunk'].values())), len(recorded) - stored)
+                    stored = len(recorded)
+                    writeSnapshot(snapshot)
+                    self.assertNotIn('events', snapshot.get('inputLog', {}))
+                    self.assertNotIn('frames', snapshot.get('replay', {}))
+
+                resumed.engine = restoreEngine(loadSnapshot(77))
+                self.assertEqual(self.recorded(resumed.engine), self.recorded(live.engine))
+                for _ in range(60):
+                    live.step()
+                    resumed.step()
+                self.assertEqual(resumed.engine.getState(), live.engine.getState())
+                writeSnapshot(engineSnapshot(resumed.engine))
+                self.assertEqual(self.recorded(restoreEngine(loadSnapshot(77))), self.recorded(live.engine))
+
+    def testGapInTheLogRefusesTheSnapshot(self):
+        harness = self.harness('inputs')
+        for _ in range(2):
+            for _ in range(40):
+                harness.step()
+            writeSnapshot(engineSnapshot(harness.engine))
+        self.assertEqual(loadSnapshot(77)['log']['chunks'], 2)
+        os.remove(getSnapshotStore().path('log', '77-0'))
+        self.assertIsNone(loadSnapshot(77))
+
+
+class TickPolicyTests(TestCase):
+    """Late ticks are caught up to GAME_TICK_MAX_CATCHUP or skipped, and the tick cadence holds either way"""
+
+    def scheduler(self, policy, maxCatchUp=3):
+        scheduler = TickScheduler()
+        with override_settings(GAME_TICK_POLICY=policy, GAME_TICK_MAX_CATCHUP=maxCatchUp):
+            scheduler.configure()
+        scheduler.origin = 0.0
+        engine = GameEngine('policy', 20, 'FAST', 0, seed=5, botSettings=(5, 5, 5))
+        engine.addPlayer('bot_0', 'Bot 0', '#ef4444', isBot=True)
+        engine.addPlayer('bot_1', 'Bot 1', '#ef4444', isBot=True)
+        engine.running, engine.roomGroupName = True, 'match_policy'
+        return scheduler, engine
+
+    def plan(self, scheduler, engine, dueSlot, lateSlots):
+        # Halfway into the slot, so float rounding never moves the clock slot
+        now = (dueSlot + lateSlots + 0.5) * SLOT_SECONDS
+        return scheduler.planTicks(engine, dueSlot, dueSlot + lateSlots, now)
+
+    def counts(self, scheduler, engine):
+        stats = scheduler.stats
+        return stats['lateTicks'], stats['caughtUpTicks'], stats['skippedTicks'], engine.tickTiming['caughtUp'], engine.tickTiming['skipped']
+
+    def testOnTime(self):
+        scheduler, engine = self.scheduler('catchup')
+        self.assertEqual(scheduler.tickSlots(engine), 4)
+        self.assertEqual(self.plan(scheduler, engine, 8, 0), (1, 12))
+        self.assertEqual(self.counts(scheduler, engine), (0, 0, 0, 0, 0))
+
+    def testLateByLessThanATick(self):
+        scheduler, engine = self.scheduler('catchup')
+        self.assertEqual(self.plan(scheduler, engine, 8, 3), (1, 12))
+        self.assertEqual(self.counts(scheduler, engine), (1, 0, 0, 0, 0))
+
+    def testCatchUp(self):
+        scheduler, engine = self.scheduler('catchup')
+        # Two whole ticks missed: run them back-to-back with this one
+        self.assertEqual(self.plan(scheduler, engine, 8, 9), (3, 20))
+        self.assertEqual(self.counts(scheduler, engine), (1, 2, 0, 2, 0))
+
+    def testCatchUpIsCapped(self):
+        scheduler, engine = self.scheduler('catchup', maxCatchUp=3)
+        # Ten missed: three caught up, seven dropped, and the next tick stays on the original cadence
+        self.assertEqual(self.plan(scheduler, engine, 8, 40), (4, 52))
+        self.assertEqual(self.counts(scheduler, engine), (1, 3, 7, 3, 7))
+
+    def testSkip(self):
+        scheduler, engine = self.scheduler('skip')
+        self.assertEqual(self.plan(scheduler, engine, 8, 9), (1, 20))
+        self.assertEqual(self.counts(scheduler, engine), (1, 0, 2, 0, 2))
+
+    def testRunSlotRunsTheCaughtUpTicks(self):
+        scheduler, engine = self.scheduler('catchup', maxCatchUp=3)
+        scheduler.engines[engine.matchId] = engine
+        scheduler.schedule(engine, 'tick', 1)
+        scheduler.currentSlot = 1
+        with self.settings(GAME_SNAPSHOT_INTERVAL=0):
+            async_to_sync(scheduler.runSlot)(1, (1 + 40 + 0.5) * SLOT_SECONDS, InMemoryChannelLayer())
+        self.assertEqual((engine.tickNumber, scheduler.stats['ticks']), (4, 4))
+        self.assertEqual(scheduler.pendingJobs(engine), {'tick': 44})
+
+
+class LocalOwnershipRegistryTests(TestCase):
+    """One lease per match: kept and extended by its holder, refused to others until released or expired"""
+
+    def setUp(self):
+        self.now = 100.0
+        self.enterContext(patch('matches.ownership.time.monotonic', lambda: self.now))
+        self.registry = LocalOwnershipRegistry()
+
+    def testAcquireAndRelease(self):
+        registry = self.registry
+        self.assertTrue(registry.acquire(1, 'worker-a', 10))
+        self.assertTrue(registry.acquire(1, 'worker-a', 10))
+        self.assertFalse(registry.acquire(1, 'worker-b', 10))
+        self.assertEqual(registry.owner(1), 'worker-a')
+        # Only the holder can release
+        registry.release(1, 'worker-b')
+        self.assertEqual(registry.owner(1), 'worker-a')
+        registry.release(1, 'worker-a')
+        self.assertIsNone(registry.owner(1))
+        self.assertTrue(registry.acquire(1, 'worker-b', 10))
+        self.assertEqual(registry.owner(1), 'worker-b')
+
+    def testLeaseExpires(self):
+        registry = self.registry
+        registry.acquire(1, 'worker-a', 10)
+        self.now = 105.0
+        # Re-acquiring extends the lease from now
+        registry.acquire(1, 'worker-a', 10)
+        self.now = 114.9
+        self.assertFalse(registry.acquire(1, 'worker-b', 10))
+        self.now = 115.0
+        self.assertIsNone(registry.owner(1))
+        self.assertTrue(registry.acquire(1, 'worker-b', 10))
+
+
+@override_settings(GAME_OWNERSHIP_BACKEND='local', GAME_OWNERSHIP_LEASE_SECONDS=0.06)
+class MatchOwnershipTests(TestCase):
+    """Workers take leases through MatchOwnership, relay to the owner, and stop a match whose lease was taken"""
+
+    def setUp(self):
+        self.enterContext(patch.dict('matches.ownership._registries', clear=True))
+        self.handleRelayed = self.enterContext(patch('matches.consumers.handleRelayed', AsyncMock()))
+        self.ownershipLost = self.enterContext(patch('matches.consumers.ownershipLost', AsyncMock()))
+
+    def workers(self, test):
+        async def run():
+            here, there = MatchOwnership(), MatchOwnership()
+            try:
+                await test(here, there)
+            finally:
+                for worker in (here, there):
+                    for task in (worker.receiver, worker.renewer):
+                        if task is not None:
+                            task.cancel()
+        async_to_sync(run)()
+
+    def testAcquireRelayAndRelease(self):
+        async def test(here, there):
+            self.assertTrue(await here.acquire(5))
+            self.assertFalse(await there.acquire(5))
+            self.assertEqual(getOwnershipRegistry().owner(5), here.channelName)
+            self.assertTrue(await there.forward(5, {'type': 'engine.input', 'direction': 'LEFT'}))
+            await asyncio.sleep(0.05)
+            self.handleRelayed.assert_awaited_once_with({'type': 'engine.input', 'direction': 'LEFT', 'matchId': 5})
+            self.assertFalse(await there.forward(6, {'type': 'engine.input'}))
+
+            await here.release(5)
+            self.assertNotIn(5, here.hosted)
+            self.assertTrue(await there.acquire(5))
+        self.workers(test)
+
+    def testLeaseKeptWhileRenewed(self):
+        async def test(here, there):
+            await here.acquire(5)
+            # Several lease lengths later the renewals still hold it
+            await asyncio.sleep(0.2)
+            self.assertFalse(await there.acquire(5))
+            self.ownershipLost.assert_not_awaited()
+        self.workers(test)
+
+    def testLostLeaseStopsTheMatch(self):
+        async def test(here, there):
+            await here.acquire(5)
+            # Another worker takes the match over, as after a renewal went missing
+            getOwnershipRegistry().leases[5] = ('elsewhere', time.monotonic() + 60)
+            await asyncio.sleep(0.1)
+            self.ownershipLost.assert_awaited_once_with(5)
+            self.assertNotIn(5, here.hosted)
+        self.workers(test)
+
+
+class SettlementTestCase(TestCase):
+    """A match in progress with two human players and a bot, 10 coins entry each"""
+
+    def setUp(self):
+        self.enterContext(quiet())
+        User = get_user_model()
+        self.alice = User.objects.create_user('alice', password='pw')
+        self.bob = User.objects.create_user('bob', password='pw')
+        matchType = MatchType.objects.create(
+            name='Arena', description='', entryFee=10, gridSize=30, speed='FAST', playersRequired=3, maxPlayers=3,
+        )
+        self.match = Match.objects.create(
+            matchType=matchType, status='IN_PROGRESS', gridSize=30, speed='FAST', currentPlayers=3, playersRequired=3,
+            totalPot=Decimal('30.01'),
+        )
+        for user in (self.alice, self.bob):
+            MatchParticipation.objects.create(match=self.match, player=user, entryFeePaid=10)
+        MatchParticipation.objects.create(match=self.match, username='Viper', entryFeePaid=10, isBot=True)
+
+    def profile(self, user):
+        profile = Profile.objects.get(user=user)
+        return profile.coins, profile.totalWins, profile.totalMatches
+
+    def results(self):
+        """(placement, coinReward) per participation, humans first in join order"""
+        return [(p.placement, p.coinReward) for p in self.match.participants.order_by('isBot', 'id')]
+
+
+class SettleMatchTests(SettlementTestCase):
+    def testHumanWinnerTakesThePot(self):
+        self.assertTrue(settleMatch(self.match.id, self.alice.id))
+        self.match.refresh_from_db()
+        self.assertEqual(self.match.status, 'COMPLETED')
+        self.assertEqual(self.match.winner, self.alice)
+        self.assertIsNotNone(self.match.completedAt)
+        self.assertEqual(self.profile(self.alice), (Decimal('130.01'), 1, 1))
+        self.assertEqual(self.profile(self.bob), (Decimal('100'), 0, 1))
+        self.assertEqual(self.results(), [(1, Decimal('30.01')), (2, 0), (2, 0)])
+        transaction = Transaction.objects.get(relatedMatch=self.match)
+        self.assertEqual(
+            (transaction.user, transaction.transactionType, transaction.amount, transaction.balanceBefore, transaction.balanceAfter),
+            (self.alice, 'MATCH_WIN', Decimal('30.01'), Decimal('100'), Decimal('130.01')),
+        )
+
+    def testBotWinnerPaysNobody(self):
+        self.assertTrue(settleMatch(self.match.id, 'bot_2'))
+        self.match.refresh_from_db()
+        self.assertEqual(self.match.status, 'COMPLETED')
+        self.assertIsNone(self.match.winner)
+        self.assertEqual(self.profile(self.alice), (Decimal('100'), 0, 1))
+        self.assertEqual(self.profile(self.bob), (Decimal('100'), 0, 1))
+        self.assertEqual(self.results(), [(2, 0), (2, 0), (2, 0)])
+        self.assertFalse(Transaction.objects.filter(relatedMatch=self.match).exists())
+
+    def testTieSplitsThePotAcrossEveryPlayer(self):
+        self.assertTrue(settleMatch(self.match.id, isTie=True))
+        self.match.refresh_from_db()
+        self.assertIsNone(self.match.winner)
+        # 30.01 over three players, bot included; the bot's share is paid to nobody
+        self.assertEqual(self.profile(self.alice), (Decimal('110'), 0, 1))
+        self.assertEqual(self.profile(self.bob), (Decimal('110'), 0, 1))
+        self.assertEqual(self.results(), [(1, Decimal('10')), (1, Decimal('10')), (1, 0)])
+        self.assertEqual(
+            sorted(Transaction.objects.filter(relatedMatch=self.match).values_list('user', 'amount', 'balanceAfter')),
+            [(self.alice.id, Decimal('10'), Decimal('110')), (self.bob.id, Decimal('10'), Decimal('110'))],
+        )
+
+    def testSettlingTwicePaysOnce(self):
+        self.assertTrue(settleMatch(self.match.id, self.alice.id))
+        self.assertFalse(settleMatch(self.match.id, self.alice.id))
+        self.assertFalse(settleMatch(self.match.id, isTie=True))
+        self.assertEqual(self.profile(self.alice), (Decimal('130.01'), 1, 1))
+        self.assertEqual(self.profile(self.bob), (Decimal('100'), 0, 1))
+        self.assertEqual(Transaction.objects.filter(relatedMatch=self.match).count(), 1)
+
+
+@override_settings(GAME_SETTLEMENT_MAX_ATTEMPTS=2, GAME_SETTLEMENT_RETRY_SECONDS=5)
+class SettlementQueueTests(SettlementTestCase):
+    def testEnqueueingTwiceQueuesOneJob(self):
+        first = enqueueSettlement(self.match.id, self.alice.id)
+        second = enqueueSettlement(self.match.id, self.bob.id)
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(SettlementJob.objects.filter(match=self.match).count(), 1)
+        self.assertEqual(SettlementJob.objects.get(match=self.match).winnerId, self.alice.id)
+
+    def testDueJobSettles(self):
+        enqueueSettlement(self.match.id, self.alice.id)
+        self.assertEqual(runDueSettlements(), 1)
+        job = SettlementJob.objects.get(match=self.match)
+        self.assertEqual((job.status, job.attempts), ('DONE', 1))
+        self.assertEqual(self.profile(self.alice), (Decimal('130.01'), 1, 1))
+        self.assertEqual(runDueSettlements(), 0)
+
+    def testFailedAttemptsRetryThenFail(self):
+        job = enqueueSettlement(self.match.id, self.alice.id)
+        with patch('matches.settlement.settleMatch', side_effect=RuntimeError('database went away')):
+            before = timezone.now()
+            self.assertEqual(runDueSettlements(), 1)
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts), ('PENDING', 1))
+            self.assertEqual(job.lastError, 'RuntimeError: database went away')
+            self.assertGreaterEqual(job.runAfter, before + timedelta(seconds=5))
+            # Not due again until the retry delay has passed
+            self.assertEqual(runDueSettlements(), 0)
+
+            SettlementJob.objects.filter(pk=job.pk).update(runAfter=timezone.now())
+            self.assertEqual(runDueSettlements(), 1)
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts), ('FAILED', 2))
+            self.assertEqual(runDueSettlements(), 0)
+
+        self.match.refresh_from_db()
+        self.assertEqual(self.match.status, 'IN_PROGRESS')
+        self.assertEqual(self.profile(self.alice), (Decimal('100'), 0, 0))
+
+
+class SimulationTests(TestCase):
+    """The server's re-simulation agrees with the game templates (expected values come from their JS)"""
+
+    SOLO_INPUTS = [[5, 'LEFT'], [12, 'DOWN'], [30, 'RIGHT'], [55, 'UP'], [90, 'LEFT'], [140, 'DOWN']]
+    PROGRESSIVE_INPUTS = [
+        [4, 'RIGHT'], [7, 'UP'], [9, 'LEFT'], [10, 'DOWN'], [12, 'UP'], [14, 'RIGHT'],
+        [22, 'UP'], [24, 'DOWN'], [25, 'LEFT'], [26, 'RIGHT'], [29, 'UP'], [31, 'DOWN'],
+    ]
+
+    def testMulberry32MatchesJs(self):
+        for seed, expected in (
+            (0, [0.26642920868471265, 0.0003297457005828619, 0.2232720274478197]),
+            (42, [0.6011037519201636, 0.44829055899754167, 0.8524657934904099]),
+            (4294967295, [0.8964226141106337, 0.189478256739676, 0.7156526781618595]),
+        ):
+            rng = Mulberry32(seed)
+            self.assertEqual([rng.random() for _ in range(3)], expected)
+
+    def testSoloRun(self):
+        simulation = simulateRun('solo', 123456789, 15, self.SOLO_INPUTS, 200)
+        # Bumping the top-left corner takes the score to -50, which ends the run at tick 118
+        self.assertEqual(simulation.tickNumber, 118)
+        self.assertEqual(simulation.outcome(), {'wallsSurvived': 4, 'wallsHit': 54, 'survivalTime': 17})
+        self.assertEqual(simulation.score, -50)
+        self.assertEqual(simulation.player, {'x': 0, 'y': 0, 'direction': 'LEFT', 'alive': True})
+        self.assertEqual(simulation.walls, [{'x': 3, 'y': 14}, {'x': 11, 'y': 3}, {'x': 4, 'y': 11}, {'x': 11, 'y': 4}])
+        self.assertEqual(simulation.countdownWalls, [{'x': 0, 'y': 2, 'secondsLeft': 1}])
+        # The input after the run ended is not part of its replay
+        self.assertEqual(simulation.inputReplay()['inputs'], self.SOLO_INPUTS[:-1])
+
+    def testProgressiveRun(self):
+        simulation = simulateRun('progressive', 987654321, 15, self.PROGRESSIVE_INPUTS, 400, level=3)
+        self.assertEqual(simulation.tickNumber, 33)
+        self.assertEqual(simulation.outcome(), {'level': 3, 'botsEliminated': 1, 'won': False, 'survivalTime': 4})
+        self.assertEqual(simulation.killerBotIndex, 1)
+        self.assertEqual(simulation.player, {'x': 11, 'y': 3, 'direction': 'DOWN', 'alive': False})
+        self.assertEqual(simulation.bots, [
+            {'x': 10, 'y': 1, 'direction': 'UP', 'alive': False},
+            {'x': 12, 'y': 3, 'direction': 'UP', 'alive': True},
+            {'x': 9, 'y': 1, 'direction': 'RIGHT', 'alive': True},
+        ])
+
+    def testVerifyRuns(self):
+        player = get_user_model().objects.create_user('verifier', password='pw')
+        simulation = simulateRun('solo', 123456789, 15, self.SOLO_INPUTS, 200)
+        outcome = simulation.outcome()
+        honest = SoloRun.objects.create(player=player, seed=123456789, storedReplay=storeReplay(simulation.inputReplay()), **outcome)
+        tampered = SoloRun.objects.create(
+            player=player, seed=1, storedReplay=storeReplay(simulation.inputReplay()), **{**outcome, 'wallsSurvived': 40},
+        )
+
+        out = StringIO()
+        call_command('verify_runs', mode='solo', workers=1, stdout=out)
+        report = out.getvalue()
+        self.assertIn('SoloRun: 2 runs re-simulated, 1 mismatched', report)
+        self.assertIn(f'SoloRun {tampered.id}: wallsSurvived saved 40 != replayed 4', report)
+        self.assertNotIn(f'SoloRun {honest.id}:', report)
+
+
+class InputReplayTests(TestCase):
+    """replayMatch re-runs an input-log replay into the frames the live match recorded"""
+
+    def play(self, engineClass, replayFormat, seed):
+        harness = EngineHarness(
+            gridSize=24, speed='FAST', wallSpawnInterval=1, seed=seed, engineClass=engineClass,
+            settings={'GAME_REPLAY_FORMAT': replayFormat},
+        )
+        harness.addHumans(3, inputRate=0.1)
+        harness.addBots(5)
+        engine = harness.engine
+        with quiet():
+            for tick in range(1, 401):
+                if tick == 60:
+                    engine.addPlayer(99, 'Late', '#f59e0b')
+                if tick == 120:
+                    engine.removePlayer('bot_2')
+                if not harness.step():
+                    break
+        return engine
+
+    def testReplayReproducesLiveFrames(self):
+        for engineClass in (GameEngine, ArrayGameEngine):
+            for seed in (3, 11):
+                with self.subTest(engine=engineClass.__name__, seed=seed):
+                    live = self.play(GameEngine, 'frames', seed).replay.build(100)
+                    logged = self.play(engineClass, 'inputs', seed)
+                    replayData = json.loads(json.dumps(logged.inputLog.build(logged, 100)))
+                    replayed = replayMatch(replayData)
+                    self.assertEqual(replayed['frameCount'], logged.tickNumber)
+                    self.assertEqual(list(expandFrames(replayed)), list(expandFrames(live)))
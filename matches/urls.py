@@ -6,6 +6,7 @@ app_name = 'matches'
 urlpatterns = [
     path('solo/', views.solo, name='solo'),
     path('progressive/', views.progressive, name='progressive'),
+    path('run-seed/', views.runSeed, name='runSeed'),
     path('save-solo-run/', views.saveSoloRun, name='saveSoloRun'),
     path('save-progressive-run/', views.saveProgressiveRun, name='saveProgressiveRun'),
     path('matchmaking/', views.matchmaking, name='matchmaking'),
@@ -16,11 +17,16 @@ urlpatterns = [
     path('force-start/', views.forceStart, name='forceStart'),
     path('check-auto-start/', views.checkAutoStart, name='checkAutoStart'),
     path('check-activity/', views.checkActivity, name='checkActivity'),
+    path('engine-stats/', views.engineStats, name='engineStats'),
+    path('engines/', views.engineDebug, name='engineDebug'),
+    path('metrics/', views.engineMetrics, name='engineMetrics'),
     
     # Replay browser
     path('replays/', views.browseReplays, name='browseReplays'),
     path('replays/watch/', views.watchReplay, name='watchReplay'),
     path('replays/view/<str:replayType>/<int:replayId>/', views.replayViewer, name='replayViewer'),
+    path('replays/data/<str:replayType>/<int:replayId>/', views.replayStream, name='replayStream'),
+    path('replays/data/<str:replayType>/<int:replayId>/index/', views.replayIndex, name='replayIndex'),
     
     # Private lobbies
     path('private/', views.privateLobbies, name='privateLobbies'),
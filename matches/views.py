@@ -1,16 +1,24 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse, Http404
+from django.conf import settings
 from django.views.decorators.http import require_POST
-from django.db import transaction
+from django.db import transaction, IntegrityError
 from django.db.models import F, Q
 from django.utils import timezone
 from django.core.paginator import Paginator
+from django.core import signing
 from decimal import Decimal
-from .models import MatchType, Match, MatchParticipation, SoloRun, ProgressiveRun
+from .models import MatchType, Match, MatchParticipation, SoloRun, ProgressiveRun, HAS_REPLAY
+from .replaystore import storeReplay, loadMaterialized
+from .replay import replayChunks, replayWindow, seekIndex
+from .simulation import simulateRun, MAX_RUN_TICKS
 from shop.models import Transaction, SystemSettings
+import hashlib
 import json
 import random
+import secrets
 
 
 # Bot names for realistic appearance
@@ -37,9 +45,9 @@ def enforceReplayLimit():
     """Delete oldest replays if count exceeds maxReplaysStored setting."""
     maxReplays = SystemSettings.getInt('maxReplaysStored', 50)
     
-    # Count total replays (both SoloRun and ProgressiveRun have replayData)
-    soloWithReplay = SoloRun.objects.filter(replayData__isnull=False).count()
-    progressiveWithReplay = ProgressiveRun.objects.filter(replayData__isnull=False).count()
+    # Count total replays (stored blobs or not-yet-migrated inline replayData)
+    soloWithReplay = SoloRun.objects.filter(HAS_REPLAY).count()
+    progressiveWithReplay = ProgressiveRun.objects.filter(HAS_REPLAY).count()
     totalReplays = soloWithReplay + progressiveWithReplay
     
     if totalReplays > maxReplays:
@@ -47,7 +55,7 @@ def enforceReplayLimit():
         replayToDelete = totalReplays - maxReplays
         
         # Get IDs of oldest solo replays without using limit
-        oldestSoloIds = list(SoloRun.objects.filter(replayData__isnull=False).order_by('endedAt').values_list('id', flat=True)[:replayToDelete])
+        oldestSoloIds = list(SoloRun.objects.filter(HAS_REPLAY).order_by('endedAt').values_list('id', flat=True)[:replayToDelete])
         deleteCount = len(oldestSoloIds)
         
         if deleteCount > 0:
@@ -56,15 +64,47 @@ def enforceReplayLimit():
         
         # If we still need to delete more, delete from progressive
         if replayToDelete > 0:
-            oldestProgressiveIds = list(ProgressiveRun.objects.filter(replayData__isnull=False).order_by('endedAt').values_list('id', flat=True)[:replayToDelete])
+            oldestProgressiveIds = list(ProgressiveRun.objects.filter(HAS_REPLAY).order_by('endedAt').values_list('id', flat=True)[:replayToDelete])
             ProgressiveRun.objects.filter(id__in=oldestProgressiveIds).delete()
 
 
+RUN_SEED_SALT = 'matches.runSeed'
+RUN_SEED_MAX_AGE = 24 * 60 * 60
+
+
+@login_required
+@require_POST
+def runSeed(request):
+    """Issue the RNG seed for one solo or progressive run, signed so the save can trust it"""
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    mode = data.get('mode') if isinstance(data, dict) else None
+    if mode not in ('solo', 'progressive'):
+        return JsonResponse({'error': 'Unknown mode'}, status=400)
+    seed = secrets.randbits(32)
+    token = signing.dumps({'seed': seed, 'mode': mode, 'user': request.user.id}, salt=RUN_SEED_SALT)
+    return JsonResponse({'seed': seed, 'token': token})
+
+
+def readRunSeed(token, user, mode):
+    """Seed from a runSeed token issued to this user for this mode"""
+    try:
+        payload = signing.loads(token or '', salt=RUN_SEED_SALT, max_age=RUN_SEED_MAX_AGE)
+    except signing.BadSignature:
+        raise ValueError('Invalid or expired run seed, please reload the page')
+    if payload.get('user') != user.id or payload.get('mode') != mode:
+        raise ValueError('Run seed was issued for another run')
+    return payload['seed']
+
+
 @login_required
 def solo(request):
     profile = request.user.profile
     context = {
         'profile': profile,
+        'maxRunTicks': MAX_RUN_TICKS,
     }
     return render(request, 'matches/game.html', context)
 
@@ -72,13 +112,21 @@ def solo(request):
 @login_required
 @require_POST
 def saveSoloRun(request):
+    storedReplay = None
     try:
         data = json.loads(request.body)
-        wallsSurvived = int(data.get('wallsSurvived', 0))
-        wallsHit = int(data.get('wallsHit', 0))
-        survivalTime = int(data.get('survivalTime', 0))
-        finalGridState = data.get('finalGridState')
-        replayData = data.get('replayData')
+        seed = readRunSeed(data.get('seedToken'), request.user, 'solo')
+        if SoloRun.objects.filter(player=request.user, seed=seed).exists():
+            raise ValueError('Run already saved')
+        # Re-simulate from the seed and input log; the score and replay come from the server's run
+        simulation = simulateRun('solo', seed, data.get('gridSize'), data.get('inputs'), data.get('ticks'))
+        outcome = simulation.outcome()
+        wallsSurvived = outcome['wallsSurvived']
+        wallsHit = outcome['wallsHit']
+        survivalTime = outcome['survivalTime']
+        finalGridState = simulation.finalGridState()
+        # Compress the replay into the replay store before taking the profile lock
+        storedReplay = storeReplay(simulation.inputReplay())
         
         coinsEarned = Decimal(str(wallsSurvived))
         coinsLost = Decimal(str(wallsHit))
@@ -108,7 +156,8 @@ def saveSoloRun(request):
                 netCoins=netCoins,
                 survivalTime=survivalTime,
                 finalGridState=finalGridState,
-                replayData=replayData,
+                storedReplay=storedReplay,
+                seed=seed,
                 isPublic=True,
                 endedAt=timezone.now()
             )
@@ -133,6 +182,9 @@ def saveSoloRun(request):
                     balanceAfter=balanceAfter
                 )
         
+        # The saved run owns the replay from here on
+        storedReplay = None
+        
         # Enforce replay storage limit (outside transaction)
         enforceReplayLimit()
         
@@ -146,7 +198,15 @@ def saveSoloRun(request):
             'newHighScore': wallsSurvived > (profile.soloHighScore - wallsSurvived)
         })
         
+    except IntegrityError:
+        # Same run submitted twice at once; the seed constraint kept only the first
+        if storedReplay is not None:
+            storedReplay.delete()
+        return JsonResponse({'success': False, 'error': 'Run already saved'})
     except Exception as e:
+        # The transaction rolled back, so nothing references the stored replay
+        if storedReplay is not None:
+            storedReplay.delete()
         return JsonResponse({'success': False, 'error': str(e)})
 
 
@@ -161,6 +221,7 @@ def progressive(request):
         'profile': profile,
         'maxLevel': maxLevel,
         'costPerAttempt': costPerAttempt,
+        'maxRunTicks': MAX_RUN_TICKS,
     }
     return render(request, 'matches/gameProgressive.html', context)
 
@@ -168,14 +229,22 @@ def progressive(request):
 @login_required
 @require_POST
 def saveProgressiveRun(request):
+    storedReplay = None
     try:
         data = json.loads(request.body)
-        level = int(data.get('level', 1))
-        botsEliminated = int(data.get('botsEliminated', 0))
-        won = bool(data.get('won', False))
-        survivalTime = int(data.get('survivalTime', 0))
-        finalGridState = data.get('finalGridState')
-        replayData = data.get('replayData')
+        seed = readRunSeed(data.get('seedToken'), request.user, 'progressive')
+        level = data.get('level')
+        if type(level) is not int or not 1 <= level <= SystemSettings.getInt('progressiveMaxLevel', 30):
+            raise ValueError('Invalid level')
+        if ProgressiveRun.objects.filter(player=request.user, seed=seed).exists():
+            raise ValueError('Run already saved')
+        simulation = simulateRun('progressive', seed, data.get('gridSize'), data.get('inputs'), data.get('ticks'), level)
+        outcome = simulation.outcome()
+        botsEliminated = outcome['botsEliminated']
+        won = outcome['won']
+        survivalTime = outcome['survivalTime']
+        finalGridState = simulation.finalGridState()
+        storedReplay = storeReplay(simulation.inputReplay())
         
         costPerAttempt = Decimal(str(SystemSettings.getInt('progressiveCostPerAttempt', 10)))
         
@@ -234,11 +303,15 @@ def saveProgressiveRun(request):
                 coinsSpent=costPerAttempt,
                 coinsEarned=coinsEarned,
                 finalGridState=finalGridState,
-                replayData=replayData,
+                storedReplay=storedReplay,
+                seed=seed,
                 isPublic=True,
                 endedAt=timezone.now()
             )
         
+        # The saved run owns the replay from here on
+        storedReplay = None
+        
         # Enforce replay storage limit (outside transaction)
         enforceReplayLimit()
         
@@ -252,7 +325,13 @@ def saveProgressiveRun(request):
             'newHighestLevel': level > profile.progressiveHighestLevel
         })
         
+    except IntegrityError:
+        if storedReplay is not None:
+            storedReplay.delete()
+        return JsonResponse({'success': False, 'error': 'Run already saved'})
     except Exception as e:
+        if storedReplay is not None:
+            storedReplay.delete()
         return JsonResponse({'success': False, 'error': str(e)})
 
 
@@ -680,9 +759,9 @@ def browseReplays(request):
     # Solo replays
     if mode in ['all', 'solo']:
         solo_runs = SoloRun.objects.filter(
-            player_id=user_id,
-            replayData__isnull=False
-        ).select_related('player').order_by('-wallsSurvived', '-endedAt')[:50]
+            HAS_REPLAY,
+            player_id=user_id
+        ).defer('replayData', 'finalGridState').select_related('player').order_by('-wallsSurvived', '-endedAt')[:50]
         for run in solo_runs:
             replays.append({
                 'type': 'solo',
@@ -699,7 +778,6 @@ def browseReplays(request):
     if mode in ['all', 'progressive']:
         filters = {
             'player_id': user_id,
-            'replayData__isnull': False
         }
         
         if showLosses == 'wins':
@@ -708,8 +786,9 @@ def browseReplays(request):
             filters['won'] = False
         
         progressive_runs = ProgressiveRun.objects.filter(
+            HAS_REPLAY,
             **filters
-        ).select_related('player').order_by('-level', '-endedAt')[:50]
+        ).defer('replayData', 'finalGridState').select_related('player').order_by('-level', '-endedAt')[:50]
         for run in progressive_runs:
             replays.append({
                 'type': 'progressive',
@@ -727,7 +806,7 @@ def browseReplays(request):
     if mode in ['all', 'multiplayer']:
         match_participations = MatchParticipation.objects.filter(
             player_id=user_id,
-            replayData__isnull=False
+            replay__isnull=False
         ).select_related('player', 'match', 'match__matchType').order_by('-match__completedAt')[:50]
         for participation in match_participations:
             replays.append({
@@ -782,17 +861,17 @@ def watchReplay(request):
         replayExists = False
         
         if replayType == 'solo':
-            run = SoloRun.objects.filter(id=replayId, replayData__isnull=False).first()
+            run = SoloRun.objects.filter(HAS_REPLAY, id=replayId).first()
             if run:
                 ownerId = run.player.id
                 replayExists = True
         elif replayType == 'progressive':
-            run = ProgressiveRun.objects.filter(id=replayId, replayData__isnull=False).first()
+            run = ProgressiveRun.objects.filter(HAS_REPLAY, id=replayId).first()
             if run:
                 ownerId = run.player.id
                 replayExists = True
         elif replayType == 'multiplayer':
-            participation = MatchParticipation.objects.filter(id=replayId, replayData__isnull=False).first()
+            participation = MatchParticipation.objects.filter(id=replayId, replay__isnull=False).first()
             if participation:
                 ownerId = participation.player.id
                 replayExists = True
@@ -854,14 +933,12 @@ def watchReplay(request):
 
 @login_required
 def replayViewer(request, replayType, replayId):
-    """Render replay viewer page"""
-    replayData = None
+    """Render replay viewer page; the replay itself is fetched from replayStream"""
     metadata = {}
     playerId = None
     
     if replayType == 'solo':
-        run = get_object_or_404(SoloRun, id=replayId, replayData__isnull=False)
-        replayData = run.replayData
+        run = get_object_or_404(SoloRun.objects.filter(HAS_REPLAY).defer('replayData').select_related('player'), id=replayId)
         playerId = run.player.id
         metadata = {
             'type': 'Solo Mode',
@@ -871,8 +948,7 @@ def replayViewer(request, replayType, replayId):
             'date': run.endedAt,
         }
     elif replayType == 'progressive':
-        run = get_object_or_404(ProgressiveRun, id=replayId, replayData__isnull=False)
-        replayData = run.replayData
+        run = get_object_or_404(ProgressiveRun.objects.filter(HAS_REPLAY).defer('replayData').select_related('player'), id=replayId)
         playerId = run.player.id
         metadata = {
             'type': 'Progressive Mode',
@@ -882,8 +958,11 @@ def replayViewer(request, replayType, replayId):
             'date': run.endedAt,
         }
     elif replayType == 'multiplayer':
-        participation = get_object_or_404(MatchParticipation, id=replayId, replayData__isnull=False)
-        replayData = participation.replayData
+        participation = get_object_or_404(
+            MatchParticipation.objects.select_related('player', 'match__matchType'),
+            id=replayId,
+            replay__isnull=False
+        )
         playerId = participation.player.id
         metadata = {
             'type': 'Multiplayer',
@@ -909,11 +988,11 @@ def replayViewer(request, replayType, replayId):
         replayCost = SystemSettings.getInt('replayViewCostOther', 50)
     
     context = {
-        'replayData': json.dumps(replayData),
         'metadata': metadata,
         'replayType': replayType,
         'profile': profile,
         'hasAccess': hasPaid,
+        'canLoad': isOwner or hasPaid,
         'replayId': replayId,
         'replayCost': replayCost,
         'isOwner': isOwner,
@@ -921,6 +1000,199 @@ def replayViewer(request, replayType, replayId):
     return render(request, 'matches/replayViewer.html', context)
 
 
+def getReplayHolder(replayType, replayId):
+    """SoloRun, ProgressiveRun or MatchReplay behind a replay URL, and the id of the user it belongs to"""
+    if replayType == 'solo':
+        run = get_object_or_404(SoloRun.objects.filter(HAS_REPLAY).select_related('storedReplay'), id=replayId)
+        return run, run.player_id
+    if replayType == 'progressive':
+        run = get_object_or_404(ProgressiveRun.objects.filter(HAS_REPLAY).select_related('storedReplay'), id=replayId)
+        return run, run.player_id
+    if replayType == 'multiplayer':
+        participation = get_object_or_404(
+            MatchParticipation.objects.select_related('replay__storedReplay'),
+            id=replayId,
+            replay__isnull=False
+        )
+        return participation.replay, participation.player_id
+    raise Http404('Unknown replay type')
+
+
+def canViewReplay(user, replayType, replayId, ownerId):
+    """Owners can always load their replay's data; anyone else once they paid for it through watchReplay"""
+    from .models import ReplayView
+    if user.id == ownerId:
+        return True
+    return ReplayView.objects.filter(user=user.profile, replay_type=replayType, replay_id=replayId, paid=True).exists()
+
+
+def getViewableReplay(request, replayType, replayId):
+    """Replay holder behind a replay URL, or None if this user may not load its data"""
+    holder, ownerId = getReplayHolder(replayType, replayId)
+    if not canViewReplay(request.user, replayType, replayId, ownerId):
+        return None
+    return holder
+
+
+def parseByteRange(rangeHeader, length):
+    """(start, end) for a single 'bytes=' range; None to send the whole body, False if unsatisfiable"""
+    unit, _, spec = rangeHeader.partition('=')
+    if unit.strip() != 'bytes' or ',' in spec:
+        return None
+    first, _, last = spec.strip().partition('-')
+    try:
+        if not first:
+            suffix = int(last)
+            return (max(0, length - suffix), length - 1) if suffix > 0 and length else False
+        start = int(first)
+        end = min(int(last), length - 1) if last else length - 1
+    except ValueError:
+        return None
+    if start >= length or end < start:
+        return False
+    return start, end
+
+
+def replayCacheControl(holder):
+    # A replay still being streamed from a live (or crashed) match grows with every segment
+    if holder.storedReplay_id and not holder.storedReplay.complete:
+        return 'private, no-cache'
+    return settings.REPLAY_CACHE_CONTROL
+
+
+@login_required
+def replayStream(request, replayType, replayId):
+    """Replay data as NDJSON (header line, then one line per frame), streamed, with Range and ETag support.
+
+    ?start=<seconds>[&end=<seconds>] serves only that window, starting at the keyframe at or before start.
+    """
+    holder = getViewableReplay(request, replayType, replayId)
+    if holder is None:
+        return JsonResponse({'error': 'Pay to watch this replay first'}, status=403)
+    window = None
+    if 'start' in request.GET or 'end' in request.GET:
+        try:
+            window = (float(request.GET.get('start', 0)), float(request.GET['end']) if 'end' in request.GET else None)
+        except ValueError:
+            return JsonResponse({'error': 'start and end must be seconds'}, status=400)
+    
+    def chunks(replayData):
+        if window is None:
+            return replayChunks(replayData)
+        return replayChunks(replayData, *replayWindow(replayData, *window))
+    
+    # Stored replays are immutable once complete (re-storing gets a new key), so the key is a strong
+    # validator and a revalidation doesn't need to load the blob. Legacy inline replays are hashed.
+    body = None
+    if holder.storedReplay_id:
+        etag = holder.storedReplay.etag
+        if window is not None:
+            etag = etag[:-1] + (f'-{window[0]:g}-{window[1]:g}"' if window[1] is not None else f'-{window[0]:g}"')
+    else:
+        body = b''.join(chunks(holder.replayData))
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+    
+    if etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponse(status=304)
+    else:
+        replayData = holder.getReplayData()
+        byteRange = None
+        rangeHeader = request.headers.get('Range')
+        if window is None and rangeHeader and request.headers.get('If-Range', etag) == etag:
+            if body is None:
+                body = b''.join(chunks(replayData))
+            byteRange = parseByteRange(rangeHeader, len(body))
+        
+        if byteRange is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{len(body)}'
+        elif byteRange:
+            start, end = byteRange
+            response = HttpResponse(body[start:end + 1], status=206, content_type='application/x-ndjson')
+            response['Content-Range'] = f'bytes {start}-{end}/{len(body)}'
+        elif body is not None:
+            response = HttpResponse(body, content_type='application/x-ndjson')
+        else:
+            # Playback can start as soon as the header and first frames arrive
+            response = StreamingHttpResponse(chunks(replayData), content_type='application/x-ndjson')
+    
+    response['ETag'] = etag
+    if window is None:
+        response['Accept-Ranges'] = 'bytes'
+    response['Cache-Control'] = replayCacheControl(holder)
+    return response
+
+
+@login_required
+def replayIndex(request, replayType, replayId):
+    """Seek index for a replay: keyframe byte offsets into the full stream and event markers"""
+    holder = getViewableReplay(request, replayType, replayId)
+    if holder is None:
+        return JsonResponse({'error': 'Pay to watch this replay first'}, status=403)
+    storedReplay = holder.storedReplay
+    if storedReplay is None:
+        index = seekIndex(holder.replayData)
+    else:
+        etag = storedReplay.etag[:-1] + '-index"'
+        if etag in request.headers.get('If-None-Match', ''):
+            response = HttpResponse(status=304)
+            response['ETag'] = etag
+            response['Cache-Control'] = replayCacheControl(holder)
+            return response
+        if storedReplay.seekIndex is None:
+            # Input-log replays and ones stored before seek indexes existed; build it once
+            storedReplay.seekIndex = seekIndex(loadMaterialized(storedReplay))
+            storedReplay.save(update_fields=['seekIndex'])
+        index = storedReplay.seekIndex
+    
+    response = JsonResponse(index)
+    if storedReplay is not None:
+        response['ETag'] = etag
+        response['Cache-Control'] = replayCacheControl(holder)
+    return response
+
+
+@staff_member_required
+def engineStats(request):
+    """Tick scheduler stats for the worker serving this request"""
+    from .scheduler import SCHEDULER
+    return JsonResponse(SCHEDULER.getStats())
+
+
+@staff_member_required
+def engineDebug(request):
+    """Live engines on this worker with tick rate, lag, payload size and per-phase tick timings"""
+    from .metrics import PHASES
+    from .scheduler import SCHEDULER
+    stats = SCHEDULER.getStats()
+    engines = []
+    for matchId, engine in stats['engines'].items():
+        phases = [engine['phases'][phase] for phase in PHASES]
+        engines.append({
+            **engine,
+            'matchId': matchId,
+            'ticksPerSecond': 1000 / engine['frameDurationMs'] if engine['frameDurationMs'] else 0,
+            'phaseList': phases,
+            'tickMs': sum(phase['meanMs'] for phase in phases),
+        })
+    return render(request, 'matches/engineDebug.html', {
+        'stats': stats,
+        'engines': engines,
+        'phases': PHASES,
+        'workerPhases': [(phase, stats['phases'][phase]) for phase in PHASES],
+    })
+
+
+def engineMetrics(request):
+    """Prometheus metrics for the worker serving this request (staff session or GAME_METRICS_TOKEN)"""
+    from .metrics import prometheusText, tokenAuthorized
+    from .scheduler import SCHEDULER
+    authorized = request.user.is_authenticated and request.user.is_staff
+    if not authorized and not tokenAuthorized(request.headers.get('Authorization', '')):
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    return HttpResponse(prometheusText(SCHEDULER), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 # ============================================
 # PRIVATE LOBBY VIEWS
 # ============================================
@@ -13,6 +13,10 @@ from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 from channels.security.websocket import AllowedHostsOriginValidator
 from matches import routing
+from matches.scheduler import installDrainSignal
+
+# SIGUSR1 hands this worker's matches to the other workers before a restart
+installDrainSignal()
 
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
@@ -203,6 +203,100 @@ else:
             'BACKEND': 'channels.layers.InMemoryChannelLayer',
         },
     }
+
+
+# Game engine implementation: 'dict' (pure Python) or 'array' (NumPy kernel for large bot arenas)
+GAME_ENGINE_MODE = os.environ.get('GAME_ENGINE_MODE', 'dict')
+
+# Ticks missed under load: 'catchup' runs them back-to-back (at most GAME_TICK_MAX_CATCHUP per batch), 'skip' drops them
+GAME_TICK_POLICY = os.environ.get('GAME_TICK_POLICY', 'catchup')
+GAME_TICK_MAX_CATCHUP = int(os.environ.get('GAME_TICK_MAX_CATCHUP', 3))
+# Match ownership: each match's engine runs on the one worker holding its lease in GAME_OWNERSHIP_BACKEND
+# ('redis', or 'local' for a single worker and tests), renewed while it runs; consumers on other workers
+# forward inputs to the owner through the channel layer. A dead worker's matches move once its lease expires
+GAME_OWNERSHIP_BACKEND = os.environ.get('GAME_OWNERSHIP_BACKEND', 'redis' if redis_url else 'local')
+GAME_OWNERSHIP_OPTIONS = {
+    'redis': {'url': redis_url},
+}
+GAME_OWNERSHIP_LEASE_SECONDS = int(os.environ.get('GAME_OWNERSHIP_LEASE_SECONDS', 10))
+# Engines in processes of their own (`manage.py runengines`, as many as needed) instead of daphne's event loop:
+# consumers send matches nobody owns yet to GAME_ENGINE_CHANNEL and reach engines only through the channel layer
+GAME_ENGINE_WORKERS = _env_bool('GAME_ENGINE_WORKERS', False)
+GAME_ENGINE_CHANNEL = os.environ.get('GAME_ENGINE_CHANNEL', 'game-engines')
+# daphne's metrics and engine pages then show no engines: each runengines worker serves its own Prometheus
+# /metrics and JSON /stats on GAME_ENGINE_METRICS_PORT (0 is off; override with --metrics-port per worker)
+GAME_ENGINE_METRICS_PORT = int(os.environ.get('GAME_ENGINE_METRICS_PORT', 0))
+GAME_ENGINE_METRICS_HOST = os.environ.get('GAME_ENGINE_METRICS_HOST', '127.0.0.1')
+# Engine snapshots, so in-progress matches survive a worker drain (SIGUSR1) or crash: 'redis' (REDIS_URL,
+# shared by every host) or 'filesystem' (GAME_SNAPSHOT_ROOT, a stand-in shared by the workers of one host).
+# Engines are snapshotted every GAME_SNAPSHOT_INTERVAL seconds (0 turns snapshots and handoffs off); the next
+# owner of a match whose worker died resumes it from its last snapshot
+GAME_SNAPSHOT_BACKEND = os.environ.get('GAME_SNAPSHOT_BACKEND', 'redis' if redis_url else 'filesystem')
+GAME_SNAPSHOT_OPTIONS = {
+    'redis': {'url': redis_url},
+    'filesystem': {'root': os.environ.get('GAME_SNAPSHOT_ROOT', str(BASE_DIR / 'snapshots'))},
+}
+GAME_SNAPSHOT_INTERVAL = int(os.environ.get('GAME_SNAPSHOT_INTERVAL', 5))
+# Game-over settlements (payouts, stats, match completion) are queued as SettlementJob rows and run off the tick
+# path by each worker's settlement loop (or `manage.py runsettlements`): woken at game over, polling every
+# GAME_SETTLEMENT_POLL_SECONDS otherwise; failures retry after GAME_SETTLEMENT_RETRY_SECONDS, doubling, up to
+# GAME_SETTLEMENT_MAX_ATTEMPTS attempts before the job is marked FAILED (see the admin)
+GAME_SETTLEMENT_POLL_SECONDS = int(os.environ.get('GAME_SETTLEMENT_POLL_SECONDS', 10))
+GAME_SETTLEMENT_RETRY_SECONDS = int(os.environ.get('GAME_SETTLEMENT_RETRY_SECONDS', 5))
+GAME_SETTLEMENT_MAX_ATTEMPTS = int(os.environ.get('GAME_SETTLEMENT_MAX_ATTEMPTS', 5))
+# /matches/metrics/ (Prometheus text format) is open to staff sessions and to 'Authorization: Bearer <token>'
+GAME_METRICS_TOKEN = os.environ.get('GAME_METRICS_TOKEN', '')
+
+# gameState broadcasts: 'delta' (keyframe every GAME_STATE_KEYFRAME_INTERVAL messages + per-tick deltas) or 'full'
+GAME_STATE_PROTOCOL = os.environ.get('GAME_STATE_PROTOCOL', 'delta')
+GAME_STATE_KEYFRAME_INTERVAL = int(os.environ.get('GAME_STATE_KEYFRAME_INTERVAL', 50))
+# Offer binary frames (dash.bin.v1 subprotocol) to clients that ask for them; JSON is always available
+GAME_STATE_BINARY = _env_bool('GAME_STATE_BINARY', True)
+
+# Multiplayer replays (format v2): a keyframe every GAME_REPLAY_KEYFRAME_INTERVAL frames, deltas in between
+GAME_REPLAY_KEYFRAME_INTERVAL = int(os.environ.get('GAME_REPLAY_KEYFRAME_INTERVAL', 100))
+# Matches write their replay to the replay store every GAME_REPLAY_SEGMENT_FRAMES frames
+# (rounded up to whole keyframe intervals) from a background thread; 0 keeps it in memory until game over
+GAME_REPLAY_SEGMENT_FRAMES = int(os.environ.get('GAME_REPLAY_SEGMENT_FRAMES', 600))
+# 'inputs' stores only the seed, roster and inputs (kilobytes) and re-simulates the frames when the replay is
+# watched; 'frames' records them during the match (streamed in segments, so it survives a worker crash)
+GAME_REPLAY_FORMAT = os.environ.get('GAME_REPLAY_FORMAT', 'inputs')
+
+# Replays are stored as compressed blobs outside the database rows that reference them.
+# Backends: 'database' (ReplayBlob table), 'filesystem' (REPLAY_STORE_ROOT), 'storage' (a STORAGES alias)
+REPLAY_STORE_BACKEND = os.environ.get('REPLAY_STORE_BACKEND', 'database')
+REPLAY_STORE_OPTIONS = {
+    'filesystem': {'root': os.environ.get('REPLAY_STORE_ROOT', str(BASE_DIR / 'replays'))},
+    'storage': {'alias': os.environ.get('REPLAY_STORE_STORAGE', 'default')},
+}
+# 'gzip' or 'zstd' (zstd needs the zstandard package, otherwise gzip is used)
+REPLAY_COMPRESSION = os.environ.get('REPLAY_COMPRESSION', 'gzip')
+REPLAY_COMPRESSION_LEVEL = int(os.environ.get('REPLAY_COMPRESSION_LEVEL', 6))
+# Replay data responses never change for a given ETag. Replays are behind login, so the default keeps
+# them out of shared caches; set 'public, ...' when a CDN in front of the site handles authentication.
+REPLAY_CACHE_CONTROL = os.environ.get('REPLAY_CACHE_CONTROL', 'private, max-age=31536000, immutable')
+# Re-simulated replays are kept in the default cache for this many seconds
+REPLAY_MATERIALIZED_CACHE_TIMEOUT = int(os.environ.get('REPLAY_MATERIALIZED_CACHE_TIMEOUT', 600))
+
+# Game engine logging ('matches.game' logger): GAME_LOG_LEVEL gates it, per-tick lines go out every GAME_LOG_TICK_SAMPLE ticks
+GAME_LOG_LEVEL = os.environ.get('GAME_LOG_LEVEL', 'INFO')
+GAME_LOG_TICK_SAMPLE = int(os.environ.get('GAME_LOG_TICK_SAMPLE', 100))
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'matches.game': {
+            'handlers': ['console'],
+            'level': GAME_LOG_LEVEL,
+            'propagate': False,
+        },
+    },
+}
     
     
 X_FRAME_OPTIONS = 'ALLOWALL'
\ No newline at end of file